@@ -35,8 +35,120 @@ t_transfer_batch = sp.TRecord(
 
 t_transfer_params = sp.TList(t_transfer_batch)
 
+# Market parameters specifications
+
+t_listing = sp.TRecord(
+    contract_address = sp.TAddress,
+    token_id = sp.TNat,
+    price = sp.TMutez
+).layout(("contract_address", ("token_id", "price")))
+
+t_sale = sp.TRecord(
+    address = sp.TAddress,
+    item_id = sp.TNat
+).layout(("address", "item_id"))
+
+# entry of the price index, ordered by price then id
+t_price_key = sp.TRecord(
+    price = sp.TMutez,
+    item_id = sp.TNat
+).layout(("price", "item_id"))
+
+# width of the price buckets of the index, in mutez
+PRICE_BUCKET = 100000
+
+t_price_bucket = sp.TRecord(
+    contract = sp.TAddress,
+    bucket = sp.TNat
+).layout(("contract", "bucket"))
+
+t_price_level_key = sp.TRecord(
+    contract = sp.TAddress,
+    price = sp.TMutez
+).layout(("contract", "price"))
+
+t_price_item = sp.TRecord(
+    contract = sp.TAddress,
+    price = sp.TMutez,
+    item_id = sp.TNat
+).layout(("contract", ("price", "item_id")))
+
+# first and last item listed at a price, 0 is no item
+t_price_level = sp.TRecord(
+    head = sp.TNat,
+    tail = sp.TNat
+).layout(("head", "tail"))
+
+t_price_range = sp.TRecord(
+    contract = sp.TAddress,
+    lo = sp.TMutez,
+    hi = sp.TMutez,
+    limit = sp.TNat
+).layout(("contract", ("lo", ("hi", "limit"))))
+
+# terms a seller signs off-chain for SignedMarket, `nonce` lets them cancel
+t_signed_listing = sp.TRecord(
+    contract = sp.TAddress,
+    token_id = sp.TNat,
+    price = sp.TMutez,
+    expiry = sp.TTimestamp,
+    nonce = sp.TNat
+).layout(("contract", ("token_id", ("price", ("expiry", "nonce")))))
+
+t_signed_purchase = sp.TRecord(
+    listing = t_signed_listing,
+    seller_key = sp.TKey,
+    signature = sp.TSignature
+).layout(("listing", ("seller_key", "signature")))
+
+t_listing_nonce = sp.TRecord(
+    seller = sp.TAddress,
+    nonce = sp.TNat
+).layout(("seller", "nonce"))
+
+# key of the `n`-th item listed or bought by a user
+t_user_item = sp.TRecord(
+    user = sp.TAddress,
+    n = sp.TNat
+).layout(("user", "n"))
+
+# node of a list of item ids, the active items or the items of a price
+# level, in listing order, 0 is no item
+t_active_node = sp.TRecord(
+    prev = sp.TNat,
+    next = sp.TNat
+).layout(("prev", "next"))
+
+# pagination of the active items, `cursor` is the id of the first item
+# returned, 0 to start from the oldest
+t_page = sp.TRecord(
+    cursor = sp.TNat,
+    limit = sp.TNat
+).layout(("cursor", "limit"))
+
+# pagination of the items of a user, `cursor` is the position of the first
+# item returned in the order the user listed or bought them, from 0
+t_user_page = sp.TRecord(
+    user = sp.TAddress,
+    cursor = sp.TNat,
+    limit = sp.TNat
+).layout(("user", ("cursor", "limit")))
+
 class Market(sp.Contract):
 
+    # type of the items returned by the item views, see `view_item`
+    item_type = t_market_item
+
+    # off-chain views written to the TZIP-16 metadata
+    offchain_views = [
+        "get_list_fee",
+        "get_balance",
+        "fetch_active_items",
+        "fetch_active_items_page",
+        "fetch_purchased_items",
+        "fetch_created_items",
+    ]
+
     def __init__(self, owner, list_fee):
         
         self.init(
@@ -47,12 +159,289 @@ class Market(sp.Contract):
                 tkey=sp.TNat,
                 tvalue=t_market_item,
             ),
-            user_items = sp.big_map(
+            # the items in the `created` state, linked in listing order so
+            # that a call only touches the nodes it adds or removes
+            active_items = sp.big_map(
+                tkey=sp.TNat,
+                tvalue=t_active_node
+            ),
+            active_head = sp.nat(0),
+            active_tail = sp.nat(0),
+            # the active item before an item when it was unlinked, 0 for
+            # none, so that a page cursor on a sold or delisted item still
+            # leads to the next active one
+            unlinked_items = sp.big_map(
+                tkey=sp.TNat,
+                tvalue=sp.TNat
+            ),
+            # ids of the items listed (seller) and bought (buyer) by a user,
+            # one entry each under (user, n) with the count per user, so
+            # that recording one costs the same however many came before
+            seller_items = sp.big_map(
+                tkey=t_user_item,
+                tvalue=sp.TNat
+            ),
+            seller_counts = sp.big_map(
+                tkey=sp.TAddress,
+                tvalue=sp.TNat
+            ),
+            buyer_items = sp.big_map(
+                tkey=t_user_item,
+                tvalue=sp.TNat
+            ),
+            buyer_counts = sp.big_map(
                 tkey=sp.TAddress,
-                tvalue=sp.TList(sp.TNat)
+                tvalue=sp.TNat
+            ),
+            # sale proceeds and fees owed to an address, paid by `withdraw`
+            balances = sp.big_map(
+                tkey=sp.TAddress,
+                tvalue=sp.TMutez
+            ),
+            # Price index of the items for sale, per FA2 contract. The items
+            # listed at a price are linked in listing order, one entry each,
+            # so that a listing or a sale only touches its neighbours. The
+            # prices listed are kept in PRICE_BUCKET wide buckets.
+            price_items = sp.big_map(
+                tkey=t_price_item,
+                tvalue=t_active_node
+            ),
+            price_levels = sp.big_map(
+                tkey=t_price_level_key,
+                tvalue=t_price_level
+            ),
+            price_buckets = sp.big_map(
+                tkey=t_price_bucket,
+                tvalue=sp.TSet(sp.TMutez)
+            ),
+            # the non-empty buckets of a contract
+            collection_buckets = sp.big_map(
+                tkey=sp.TAddress,
+                tvalue=sp.TSet(sp.TNat)
+            ),
+            # the cheapest item of a contract
+            price_floor = sp.big_map(
+                tkey=sp.TAddress,
+                tvalue=t_price_key
             )
         )
+        self.init_metadata("metadata", {
+            "name": "NFT market",
+            "views": [getattr(self, name) for name in self.offchain_views],
+        })
     
+    def index_item(self, index, user, item_id):
+        with sp.if_(index.contains(user)):
+            index[user].add(item_id)
+        with sp.else_():
+            index[user] = sp.set([item_id], t = sp.TNat)
+
+    def link_active(self, item_id):
+        """
+        append the new item `item_id` to the active items
+        """
+        self.data.active_items[item_id] = sp.record(prev = self.data.active_tail, next = sp.nat(0))
+        with sp.if_(self.data.active_tail == 0):
+            self.data.active_head = item_id
+        with sp.else_():
+            self.data.active_items[self.data.active_tail].next = item_id
+        self.data.active_tail = item_id
+
+    def unlink_active(self, item_id):
+        node = sp.compute(self.data.active_items[item_id])
+        with sp.if_(node.prev == 0):
+            self.data.active_head = node.next
+        with sp.else_():
+            self.data.active_items[node.prev].next = node.next
+        with sp.if_(node.next == 0):
+            self.data.active_tail = node.prev
+        with sp.else_():
+            self.data.active_items[node.next].prev = node.prev
+        del self.data.active_items[item_id]
+        self.data.unlinked_items[item_id] = node.prev
+
+    def push_user_item(self, items, counts, user, item_id):
+        n = sp.compute(counts.get(user, sp.nat(0)))
+        items[sp.record(user = user, n = n)] = item_id
+        counts[user] = n + 1
+
+    def credit(self, balances, address, amount):
+        # no entry for nothing, `withdraw` would send 0 tez
+        with sp.if_(amount > sp.mutez(0)):
+            with sp.if_(balances.contains(address)):
+                balances[address] += amount
+            with sp.else_():
+                balances[address] = amount
+
+    def price_bucket(self, price):
+        return sp.compute(sp.fst(sp.ediv(price, sp.mutez(PRICE_BUCKET)).open_some()))
+
+    def first_element(self, name, elements, t):
+        """
+        the smallest element of the set `elements`, in the local `name`.
+        Michelson cannot stop an ITER, the set is walked to its end.
+        """
+        first = sp.local(name, sp.none, t = sp.TOption(t))
+        with sp.for_("element", elements.elements()) as element:
+            with sp.if_(first.value.is_none()):
+                first.value = sp.some(element)
+        return first.value.open_some()
+
+    def index_price(self, address, price, item_id):
+        level_key = sp.record(contract = address, price = price)
+        key = sp.record(contract = address, price = price, item_id = item_id)
+        with sp.if_(self.data.price_levels.contains(level_key)):
+            tail = sp.compute(self.data.price_levels[level_key].tail)
+            self.data.price_items[key] = sp.record(prev = tail, next = sp.nat(0))
+            self.data.price_items[sp.record(contract = address, price = price, item_id = tail)].next = item_id
+            self.data.price_levels[level_key].tail = item_id
+        with sp.else_():
+            self.data.price_items[key] = sp.record(prev = sp.nat(0), next = sp.nat(0))
+            self.data.price_levels[level_key] = sp.record(head = item_id, tail = item_id)
+            bucket = self.price_bucket(price)
+            bucket_key = sp.record(contract = address, bucket = bucket)
+            with sp.if_(self.data.price_buckets.contains(bucket_key)):
+                self.data.price_buckets[bucket_key].add(price)
+            with sp.else_():
+                self.data.price_buckets[bucket_key] = sp.set([price], t = sp.TMutez)
+                self.index_item(self.data.collection_buckets, address, bucket)
+        # ids grow, an item only becomes the floor with a lower price
+        with sp.if_(~self.data.price_floor.contains(address)):
+            self.data.price_floor[address] = sp.record(price = price, item_id = item_id)
+        with sp.else_():
+            with sp.if_(price < self.data.price_floor[address].price):
+                self.data.price_floor[address] = sp.record(price = price, item_id = item_id)
+
+    def unindex_price(self, address, price, item_id):
+        level_key = sp.record(contract = address, price = price)
+        key = sp.record(contract = address, price = price, item_id = item_id)
+        node = sp.compute(self.data.price_items[key])
+        del self.data.price_items[key]
+        with sp.if_(node.prev == 0):
+            self.data.price_levels[level_key].head = node.next
+        with sp.else_():
+            self.data.price_items[sp.record(contract = address, price = price, item_id = node.prev)].next = node.next
+        with sp.if_(node.next == 0):
+            self.data.price_levels[level_key].tail = node.prev
+        with sp.else_():
+            self.data.price_items[sp.record(contract = address, price = price, item_id = node.next)].prev = node.prev
+
+        bucket = self.price_bucket(price)
+        bucket_key = sp.record(contract = address, bucket = bucket)
+        with sp.if_(self.data.price_levels[level_key].head == 0):
+            del self.data.price_levels[level_key]
+            self.data.price_buckets[bucket_key].remove(price)
+            with sp.if_(sp.len(self.data.price_buckets[bucket_key]) == 0):
+                del self.data.price_buckets[bucket_key]
+                self.data.collection_buckets[address].remove(bucket)
+                with sp.if_(sp.len(self.data.collection_buckets[address]) == 0):
+                    del self.data.collection_buckets[address]
+
+        floor = self.data.price_floor[address]
+        with sp.if_((floor.price == price) & (floor.item_id == item_id)):
+            # the floor is the head of the lowest level, what follows it is
+            # the next item of its level, or the head of the next price
+            with sp.if_(node.next != 0):
+                self.data.price_floor[address].item_id = node.next
+            with sp.else_():
+                with sp.if_(~self.data.collection_buckets.contains(address)):
+                    del self.data.price_floor[address]
+                with sp.else_():
+                    next_bucket = sp.local("next_bucket", bucket)
+                    with sp.if_(~self.data.price_buckets.contains(bucket_key)):
+                        next_bucket.value = self.first_element(
+                            "first_bucket", self.data.collection_buckets[address], sp.TNat)
+                    next_price = self.first_element(
+                        "first_price",
+                        self.data.price_buckets[sp.record(contract = address, bucket = next_bucket.value)],
+                        sp.TMutez
+                    )
+                    self.data.price_floor[address] = sp.record(
+                        price = next_price,
+                        item_id = self.data.price_levels[sp.record(contract = address, price = next_price)].head
+                    )
+
+    def list_item(self, params):
+        """
+        store a new `created` item for sp.sender, the caller checks the fee
+        and that params.contract_address is a FA2 contract
+        """
+        sp.verify(params.price > sp.mutez(0), "price must be at least 1 mutez")
+        # the fee is taken from the price at the sale
+        sp.verify(params.price >= self.data.list_fee, "price must cover the listing fee")
+
+        item_id = sp.compute(self.data.item_id)
+        self.data.market_items[item_id] = self.new_item(item_id, params)
+        self.link_active(item_id)
+        self.index_price(params.contract_address, params.price, item_id)
+        self.push_user_item(self.data.seller_items, self.data.seller_counts, sp.sender, item_id)
+
+        self.data.item_id += sp.nat(1)
+
+    def sell_item(self, params):
+        """
+        release the item to sp.sender and return it as it was listed, the
+        caller checks the amount and makes the FA2 transfer and payments
+        """
+        sp.verify(self.data.market_items.contains(params.item_id), "item is not exists")
+        item = self.release_item(params)
+        self.unindex_price(item.address, item.price, item.id)
+
+        self.push_user_item(self.data.buyer_items, self.data.buyer_counts, sp.sender, item.id)
+        self.unlink_active(item.id)
+        return item
+
+    # The four methods below are the only ones that know the layout of
+    # `market_items`, CompactMarket overrides them.
+
+    def new_item(self, item_id, params):
+        return sp.record(
+            id = item_id,
+            address = params.contract_address,
+            token_id = params.token_id,
+            seller = sp.sender,
+            buyer = sp.none,
+            price = params.price,
+            state = sp.variant("created", sp.sender)
+        )
+
+    def release_item(self, params):
+        """
+        mark the listed item as sold to sp.sender and return a record with
+        its id, address, token_id, seller and price
+        """
+        item = sp.compute(self.data.market_items[params.item_id])
+        sp.verify(item.state.is_variant("created"), "item is not for sale")
+        sp.verify(item.address == params.address, "address does not match the item")
+        self.data.market_items[params.item_id].buyer = sp.some(sp.sender)
+        self.data.market_items[params.item_id].state = sp.variant("release", sp.sender)
+        return item
+
+    def view_item(self, item_id):
+        """
+        the item `item_id` as the views return it, of type `item_type`
+        """
+        return self.data.market_items[item_id]
+
+    def deactivate_item(self, item_id):
+        item = self.data.market_items[item_id]
+        with sp.if_(item.state.is_variant("created")):
+            item.state = sp.variant("inactive", sp.sender)
+            self.unlink_active(item_id)
+            self.unindex_price(item.address, item.price, item_id)
+
+    def transfer_batch(self, item):
+        return sp.record(
+            from_ = item.seller,
+            txs = sp.list([
+                sp.record(
+                    to_ = sp.sender,
+                    token_id = item.token_id,
+                    amount = sp.nat(1)
+                )
+            ])
+        )
+
     @sp.offchain_view()
     def get_list_fee(self):
         sp.result(self.data.list_fee)
@@ -67,15 +456,7 @@ class Market(sp.Contract):
             price = sp.TMutez
         ).layout("contract_address", ("token_id", "price"))
         """
-        sp.set_type(
-            params,
-            sp.TRecord(
-                contract_address = sp.TAddress,
-                token_id = sp.TNat,
-                price = sp.TMutez
-            ).layout(("contract_address", ("token_id", "price")))
-        )
-        sp.verify(params.price > sp.mutez(0), "price must be at least 1 mutez")
+        sp.set_type(params, t_listing)
         sp.verify(sp.amount == self.data.list_fee, "fee must be equal to listing fee")
 
         # current FA2 contract has no on-chain view 
@@ -87,27 +468,32 @@ class Market(sp.Contract):
         
         # TODO: using the balance_of to check the permission or offchain-view check 
 
-        item_id = self.data.item_id
-        item = sp.record(
-            id = item_id,
-            address = params.contract_address,
-            token_id = params.token_id,
-            seller = sp.sender,
-            buyer = sp.none,
-            price = params.price,
-            state = sp.variant("created", sp.sender)
-        )
-        self.data.market_items[item_id] = item
-        with sp.if_(self.data.user_items.contains(sp.sender)):
-            self.data.user_items[sp.sender].push(item_id)
-        with sp.else_():
-            self.data.user_items[sp.sender] = sp.list([item_id], t = sp.TNat)
-
-        self.data.item_id += sp.nat(1)
+        self.list_item(params)
 
+    @sp.entry_point
+    def create_market_items(self, params):
+        """
+        list several NFTs at once, the amount is the listing fee times the
+        number of items and each FA2 contract is looked up once
+        """
+        sp.set_type(params, sp.TList(t_listing))
+        sp.verify(
+            sp.amount == sp.split_tokens(self.data.list_fee, sp.len(params), 1),
+            "fee must be equal to listing fee"
+        )
 
+        checked = sp.local("checked", sp.set(t = sp.TAddress))
+        with sp.for_("listing", params) as listing:
+            with sp.if_(~checked.value.contains(listing.contract_address)):
+                sp.contract(
+                    t_operator_permission,
+                    listing.contract_address,
+                    "is_operator"
+                    ).open_some("is_operator must be defined")
+                checked.value.add(listing.contract_address)
+            self.list_item(listing)
 
-    @sp.entry_point
+    @sp.entry_point(lazify = False)
     def delete_market_item(self, params):
         """
         make the item inactive 
@@ -115,81 +501,413 @@ class Market(sp.Contract):
         sp.set_type(params, sp.TNat)
         sp.verify(params < self.data.item_id, "id must < current id")
         sp.verify(self.data.market_items.contains(params), "item is not exists")
-        item = self.data.market_items[params]
-        with sp.if_(item.state.is_variant("created")):
-            item.state = sp.variant("inactive", sp.sender)
+        self.deactivate_item(params)
 
     @sp.entry_point
     def create_market_sale(self, params):
-       sp.set_type(
-           params,
-           sp.TRecord(
-               address = sp.TAddress,
-               item_id = sp.TNat
-           ).layout(("address", "item_id"))
-       )
-       sp.verify(self.data.market_items.contains(params.item_id), "item is not exists")
-       item = self.data.market_items[params.item_id]
-       sp.verify(item.price == sp.amount, "please the asking price")
-       transfer = sp.contract(t_transfer_params, params.address, "transfer").open_some("address is not a FA2 contract")
-       
-       # transfer amount 
-       sp.transfer(sp.list([
-           sp.record(
-               from_ = item.seller,
-               txs = sp.list([
-                   sp.record(
-                       to_ = sp.sender,
-                       token_id = item.token_id,
-                       amount = sp.nat(1)
-                   )
-               ])
-           )
-       ], t= t_transfer_batch), sp.tez(0), transfer)
-
-       profit = sp.amount - self.data.list_fee
-       sp.send(self.data.owner_address, self.data.list_fee)
-       sp.send(item.seller, profit)
-
-       item_id = item.id
-       
-       with sp.if_(self.data.user_items.contains(sp.sender)):
-           self.data.user_items[sp.sender].push(item_id)     
-       with sp.else_():
-            self.data.user_items[sp.sender] = sp.list([item_id], t = sp.TNat)
-
-       item.buyer = sp.some(sp.sender)
-       item.state = sp.variant("release", sp.sender)
+        sp.set_type(params, t_sale)
+        item = self.sell_item(params)
+        sp.verify(item.price == sp.amount, "please the asking price")
+        transfer = sp.contract(t_transfer_params, item.address, "transfer").open_some("address is not a FA2 contract")
 
+        # transfer amount 
+        sp.transfer(sp.list([self.transfer_batch(item)], t = t_transfer_batch), sp.tez(0), transfer)
 
+        profit = sp.amount - self.data.list_fee
+        self.credit(self.data.balances, self.data.owner_address, self.data.list_fee)
+        self.credit(self.data.balances, item.seller, profit)
+
+    @sp.entry_point
+    def create_market_sales(self, params):
+        """
+        buy several items at once, the amount is the sum of their prices.
+        There is one FA2 transfer per token contract and one balance credit
+        per seller and for the listing fees.
+        """
+        sp.set_type(params, sp.TList(t_sale))
+        total = sp.local("total", sp.mutez(0))
+        transfers = sp.local("transfers", sp.map(tkey = sp.TAddress, tvalue = t_transfer_params))
+        profits = sp.local("profits", sp.map(tkey = sp.TAddress, tvalue = sp.TMutez))
+        with sp.for_("sale", params) as sale:
+            item = self.sell_item(sale)
+            total.value += item.price
+            with sp.if_(transfers.value.contains(item.address)):
+                transfers.value[item.address].push(self.transfer_batch(item))
+            with sp.else_():
+                transfers.value[item.address] = sp.list([self.transfer_batch(item)], t = t_transfer_batch)
+            self.credit(profits.value, item.seller, item.price - self.data.list_fee)
+        sp.verify(total.value == sp.amount, "please the asking price")
+
+        with sp.for_("transfer", transfers.value.items()) as transfer:
+            sp.transfer(
+                transfer.value,
+                sp.tez(0),
+                sp.contract(t_transfer_params, transfer.key, "transfer").open_some("address is not a FA2 contract")
+            )
+
+        self.credit(
+            self.data.balances,
+            self.data.owner_address,
+            sp.split_tokens(self.data.list_fee, sp.len(params), 1)
+        )
+        with sp.for_("profit", profits.value.items()) as profit:
+            self.credit(self.data.balances, profit.key, profit.value)
+
+    @sp.entry_point(lazify = False)
+    def withdraw(self):
+        """
+        send to sp.sender everything credited to it by the sales
+        """
+        sp.verify(self.data.balances.contains(sp.sender), "nothing to withdraw")
+        sp.send(sp.sender, self.data.balances[sp.sender])
+        del self.data.balances[sp.sender]
+
+    @sp.offchain_view()
+    def get_balance(self, address):
+        sp.set_type(address, sp.TAddress)
+        sp.result(self.data.balances.get(address, sp.mutez(0)))
+
+    def paginate(self, items, counts, page):
+        """
+        collect the items of page.user in `items` from position page.cursor
+        on, at most page.limit of them
+        """
+        result = sp.local("result", sp.list(l=[], t=self.item_type))
+        n = sp.local("n", page.cursor)
+        stop = sp.compute(sp.min(counts.get(page.user, sp.nat(0)), page.cursor + page.limit))
+        with sp.while_(n.value < stop):
+            result.value.push(self.view_item(items[sp.record(user = page.user, n = n.value)]))
+            n.value += 1
+        return result.value.rev()
+
+    def walk_active(self, start, limit):
+        """
+        collect at most `limit` active items from `start` on, return them
+        and the id following the last one, 0 at the end of the list
+        """
+        result = sp.local("result", sp.list(l=[], t=self.item_type))
+        count = sp.local("count", sp.nat(0))
+        current = sp.local("current", start)
+        with sp.while_((current.value != 0) & (count.value < limit)):
+            result.value.push(self.view_item(current.value))
+            count.value += 1
+            current.value = self.data.active_items[current.value].next
+        return sp.record(items = result.value.rev(), next = current.value)
 
     @sp.offchain_view()
     def fetch_active_items(self):
         """
-        fetch the active items
+        fetch the active items, prefer fetch_active_items_page as the list
+        grows
         """
-        result = sp.local("result", sp.list(l=[], t=t_market_item)).value
-        sp.compute
-        with sp.for_("index", sp.range(1, self.data.item_id+1)) as index:
-            item = self.data.market_items[index]
-            with sp.if_(item.state.is_variant("created")):
-                result.push(item)
-        
-        sp.result(result)
+        sp.result(self.walk_active(self.data.active_head, self.data.item_id).items)
+
+    @sp.offchain_view()
+    def fetch_active_items_page(self, params):
+        """
+        fetch at most `limit` active items from `cursor` on, in listing
+        order, with the cursor of the next page, 0 after the last one.
+        A cursor on an item unlinked since starts at the next active item.
+        """
+        sp.set_type(params, t_page)
+        # no item listed after an unlinked one is inserted before it, so
+        # the next active item follows the first active one before it
+        before = sp.local("before", params.cursor)
+        with sp.while_((before.value != 0) & ~self.data.active_items.contains(before.value)):
+            sp.verify(self.data.unlinked_items.contains(before.value), "cursor is not an item")
+            before.value = self.data.unlinked_items[before.value]
+        start = sp.local("start", self.data.active_head)
+        with sp.if_(before.value == params.cursor):
+            with sp.if_(params.cursor != 0):
+                start.value = params.cursor
+        with sp.else_():
+            with sp.if_(before.value != 0):
+                start.value = self.data.active_items[before.value].next
+        sp.result(self.walk_active(start.value, params.limit))
+
+    @sp.offchain_view()
+    def fetch_purchased_items(self, params):
+        """
+        fetch the items bought by `user`, page by page, in purchase order
+        """
+        sp.set_type(params, t_user_page)
+        sp.result(self.paginate(self.data.buyer_items, self.data.buyer_counts, params))
+
+    @sp.offchain_view()
+    def fetch_created_items(self, params):
+        """
+        fetch the items listed by `user`, page by page, in listing order
+        """
+        sp.set_type(params, t_user_page)
+        sp.result(self.paginate(self.data.seller_items, self.data.seller_counts, params))
+
+    # The views read the exact floor, and the items in range only from
+    # the buckets and prices that overlap it: their cost grows with the
+    # listed prices and `limit`, not with the number of items.
+
+    @sp.onchain_view()
+    def floor_price(self, contract):
+        """
+        the cheapest item for sale of the FA2 `contract`, if any
+        """
+        sp.set_type(contract, sp.TAddress)
+        sp.result(self.data.price_floor.get_opt(contract))
+
+    @sp.onchain_view()
+    def items_in_price_range(self, params):
+        """
+        the items for sale of `contract` priced from `lo` to `hi`, at most
+        `limit` of them, cheapest first
+        """
+        sp.set_type(params, t_price_range)
+        result = sp.local("result", sp.list(l=[], t=t_price_key))
+        count = sp.local("count", sp.nat(0))
+        current = sp.local("current", sp.nat(0))
+        lo = self.price_bucket(params.lo)
+        hi = self.price_bucket(params.hi)
+        buckets = self.data.collection_buckets.get(params.contract, sp.set(t = sp.TNat))
+        with sp.for_("bucket", buckets.elements()) as bucket:
+            with sp.if_((bucket >= lo) & (bucket <= hi) & (count.value < params.limit)):
+                bucket_key = sp.record(contract = params.contract, bucket = bucket)
+                with sp.for_("price", self.data.price_buckets[bucket_key].elements()) as price:
+                    with sp.if_((price >= params.lo) & (price <= params.hi) & (count.value < params.limit)):
+                        current.value = self.data.price_levels[sp.record(contract = params.contract, price = price)].head
+                        with sp.while_((current.value != 0) & (count.value < params.limit)):
+                            result.value.push(sp.record(price = price, item_id = current.value))
+                            count.value += 1
+                            current.value = self.data.price_items[sp.record(
+                                contract = params.contract, price = price, item_id = current.value)].next
+        sp.result(result.value.rev())
+
+
+
+# Lazy entry points
+
+class LazyMarket(Market):
+    """
+    Market whose large entry points are kept in a big_map and loaded only
+    when called, delete_market_item and withdraw stay in the script. The
+    owner can replace a lazy entry point with `update_entry_point`.
+    """
+
+    # lazy entry point -> its parameter type
+    lazy_entry_points = {
+        "crerate_market_item": t_listing,
+        "create_market_items": sp.TList(t_listing),
+        "create_market_sale": t_sale,
+        "create_market_sales": sp.TList(t_sale),
+    }
+
+    def __init__(self, owner, list_fee):
+        Market.__init__(self, owner, list_fee)
+        self.add_flag("lazy-entry-points")
+
+    @sp.entry_point(lazify = False)
+    def update_entry_point(self, params):
+        """
+        replace a lazy entry point by a lambda from (parameter, storage) to
+        (operations, storage)
+        """
+        sp.set_type(params, sp.TVariant(**{
+            name: sp.TLambda(
+                sp.TPair(t_parameter, sp.TUnknown()),
+                sp.TPair(sp.TList(sp.TOperation), sp.TUnknown())
+            ) for name, t_parameter in self.lazy_entry_points.items()
+        }))
+        sp.verify(sp.sender == self.data.owner_address, "only the owner can update entry points")
+        with params.match_cases() as arg:
+            for name in self.lazy_entry_points:
+                with arg.match(name) as entry_point:
+                    sp.set_entry_point(name, entry_point)
+
+
+# Signed listings
+
+def signed_message(market, listing):
+    """
+    the bytes a seller signs to list on `market`
+    """
+    return sp.pack(sp.pair(market, listing))
+
+class SignedMarket(Market):
+    """
+    Market where sellers can also list off-chain, for free: they sign a
+    t_signed_listing and the buyer submits it with `buy_signed_listing`.
+    Nothing is stored until the sale, which is recorded as a released item.
+    A seller withdraws signed listings by cancelling their nonces.
+    """
+
+    offchain_views = Market.offchain_views + ["is_listing_closed"]
+
+    def __init__(self, owner, list_fee):
+        Market.__init__(self, owner, list_fee)
+        self.update_initial_storage(
+            # nonces of the signed listings sold or cancelled
+            used_nonces = sp.big_map(
+                tkey=t_listing_nonce,
+                tvalue=sp.TUnit
+            )
+        )
+
+    @sp.entry_point
+    def buy_signed_listing(self, params):
+        """
+        buy the item of a signed listing, the amount is its price
+        """
+        sp.set_type(params, t_signed_purchase)
+        listing = params.listing
+        sp.verify(sp.now <= listing.expiry, "listing has expired")
+        sp.verify(listing.price == sp.amount, "please the asking price")
+        sp.verify(listing.price >= self.data.list_fee, "price must cover the listing fee")
+        sp.verify(
+            sp.check_signature(params.seller_key, params.signature, signed_message(sp.self_address, listing)),
+            "invalid signature"
+        )
+        seller = sp.compute(sp.to_address(sp.implicit_account(sp.hash_key(params.seller_key))))
+        nonce = sp.record(seller = seller, nonce = listing.nonce)
+        sp.verify(~self.data.used_nonces.contains(nonce), "listing is sold or cancelled")
+        self.data.used_nonces[nonce] = sp.unit
+
+        item_id = sp.compute(self.data.item_id)
+        self.data.market_items[item_id] = sp.record(
+            id = item_id,
+            address = listing.contract,
+            token_id = listing.token_id,
+            seller = seller,
+            buyer = sp.some(sp.sender),
+            price = listing.price,
+            state = sp.variant("release", sp.sender)
+        )
+        self.data.item_id += sp.nat(1)
+        self.push_user_item(self.data.seller_items, self.data.seller_counts, seller, item_id)
+        self.push_user_item(self.data.buyer_items, self.data.buyer_counts, sp.sender, item_id)
+
+        transfer = sp.contract(t_transfer_params, listing.contract, "transfer").open_some("address is not a FA2 contract")
+        sp.transfer(
+            sp.list([self.transfer_batch(sp.record(seller = seller, token_id = listing.token_id))], t = t_transfer_batch),
+            sp.tez(0),
+            transfer
+        )
+        self.credit(self.data.balances, self.data.owner_address, self.data.list_fee)
+        self.credit(self.data.balances, seller, sp.amount - self.data.list_fee)
+
+    @sp.entry_point
+    def cancel_signed_listings(self, nonces):
+        """
+        cancel the signed listings of sp.sender with these nonces
+        """
+        sp.set_type(nonces, sp.TList(sp.TNat))
+        with sp.for_("nonce", nonces) as nonce:
+            self.data.used_nonces[sp.record(seller = sp.sender, nonce = nonce)] = sp.unit
 
     @sp.offchain_view()
-    def fetch_purchased_items(self):
+    def is_listing_closed(self, params):
         """
-        it is your turn  
+        whether the signed listing of `seller` with `nonce` was sold or
+        cancelled
         """
-        pass
+        sp.set_type(params, t_listing_nonce)
+        sp.result(self.data.used_nonces.contains(params))
+
+
+# Compact layout
+
+ITEM_CREATED = 0
+ITEM_RELEASED = 1
+ITEM_INACTIVE = 2
+
+t_compact_item = sp.TRecord(
+    contract = sp.TNat,
+    token_id = sp.TNat,
+    seller = sp.TAddress,
+    price = sp.TMutez,
+    state = sp.TNat
+).layout(("contract", ("token_id", ("seller", ("price", "state")))))
+
+# compact item with its id, as the CompactMarket views return it
+t_compact_view_item = sp.TRecord(
+    id = sp.TNat,
+    item = t_compact_item
+).layout(("id", "item"))
+
+class CompactMarket(Market):
+    """
+    Market storing smaller items: the id is only the big_map key, the buyer
+    is only in `buyer_items`, the FA2 contract is interned in `contracts`
+    and the state is one of the ITEM_* codes.
+    """
+
+    item_type = t_compact_view_item
+    offchain_views = Market.offchain_views + ["get_token_contract"]
+
+    def __init__(self, owner, list_fee):
+        Market.__init__(self, owner, list_fee)
+        self.update_initial_storage(
+            market_items = sp.big_map(
+                tkey=sp.TNat,
+                tvalue=t_compact_item,
+            ),
+            contract_ids = sp.big_map(
+                tkey=sp.TAddress,
+                tvalue=sp.TNat
+            ),
+            contracts = sp.big_map(
+                tkey=sp.TNat,
+                tvalue=sp.TAddress
+            ),
+            contract_count = sp.nat(0)
+        )
+
+    def intern_contract(self, address):
+        with sp.if_(~self.data.contract_ids.contains(address)):
+            self.data.contract_ids[address] = self.data.contract_count
+            self.data.contracts[self.data.contract_count] = address
+            self.data.contract_count += 1
+        return sp.compute(self.data.contract_ids[address])
+
+    def new_item(self, item_id, params):
+        return sp.record(
+            contract = self.intern_contract(params.contract_address),
+            token_id = params.token_id,
+            seller = sp.sender,
+            price = params.price,
+            state = ITEM_CREATED
+        )
+
+    def release_item(self, params):
+        item = sp.compute(self.data.market_items[params.item_id])
+        sp.verify(item.state == ITEM_CREATED, "item is not for sale")
+        # contract_count is never a valid id, unknown addresses do not match
+        sp.verify(
+            self.data.contract_ids.get(params.address, self.data.contract_count) == item.contract,
+            "address does not match the item"
+        )
+        self.data.market_items[params.item_id].state = ITEM_RELEASED
+        return sp.record(
+            id = params.item_id,
+            address = params.address,
+            token_id = item.token_id,
+            seller = item.seller,
+            price = item.price
+        )
+
+    def view_item(self, item_id):
+        return sp.record(id = item_id, item = self.data.market_items[item_id])
+
+    def deactivate_item(self, item_id):
+        item = self.data.market_items[item_id]
+        with sp.if_(item.state == ITEM_CREATED):
+            item.state = ITEM_INACTIVE
+            self.unlink_active(item_id)
+            self.unindex_price(self.data.contracts[item.contract], item.price, item_id)
 
     @sp.offchain_view()
-    def fetch_created_items(self):
+    def get_token_contract(self, contract):
         """
-        it it your turn
+        resolve the `contract` field of an item
         """
-        pass
+        sp.set_type(contract, sp.TNat)
+        sp.result(self.data.contracts[contract])
 
 
 sp.add_compilation_target(
@@ -197,4 +915,25 @@ sp.add_compilation_target(
     Market(
         sp.address("tz1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB"), 
         sp.tez(1))
-)
\ No newline at end of file
+)
+
+sp.add_compilation_target(
+    "nft_market_lazy",
+    LazyMarket(
+        sp.address("tz1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB"),
+        sp.tez(1))
+)
+
+sp.add_compilation_target(
+    "nft_market_signed",
+    SignedMarket(
+        sp.address("tz1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB"),
+        sp.tez(1))
+)
+
+sp.add_compilation_target(
+    "nft_market_compact",
+    CompactMarket(
+        sp.address("tz1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB"),
+        sp.tez(1))
+)
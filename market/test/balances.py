@@ -0,0 +1,70 @@
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+fa2 = sp.io.import_script_from_url("file:market/test/mock_fa2.py")
+
+OWNER = sp.address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")
+
+@sp.add_test(name = "Balances")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Sale proceeds and withdrawals")
+    seller = sp.test_account("seller")
+    other = sp.test_account("other")
+    buyer = sp.test_account("buyer")
+    token = fa2.MockFA2()
+    c = market.Market(OWNER, sp.tez(1))
+    scenario += token
+    scenario += c
+
+    def list_item(c, sender, token_id, price, fee = sp.tez(1)):
+        c.crerate_market_item(
+            contract_address = token.address,
+            token_id = token_id,
+            price = price
+        ).run(sender = sender, amount = fee)
+
+    list_item(c, seller, 1, sp.tez(3))
+    list_item(c, seller, 2, sp.tez(2))
+    list_item(c, other, 3, sp.tez(4))
+    list_item(c, other, 4, sp.tez(1))
+    scenario.verify(~c.data.balances.contains(seller.address))
+    scenario.verify(c.get_balance(seller.address) == sp.tez(0))
+
+    scenario.h2("Single sale")
+    c.create_market_sale(address = token.address, item_id = 1).run(sender = buyer, amount = sp.tez(3))
+    scenario.verify(c.data.balances[seller.address] == sp.tez(2))
+    scenario.verify(c.data.balances[OWNER] == sp.tez(1))
+    scenario.verify(c.get_balance(seller.address) == sp.tez(2))
+
+    scenario.h2("Batched sale")
+    c.create_market_sales([
+        sp.record(address = token.address, item_id = 2),
+        sp.record(address = token.address, item_id = 3),
+        sp.record(address = token.address, item_id = 4),
+    ]).run(sender = buyer, amount = sp.tez(7))
+    scenario.verify(c.data.balances[seller.address] == sp.tez(3))
+    # item 4 is sold at the listing fee, it only credits the fee
+    scenario.verify(c.data.balances[other.address] == sp.tez(3))
+    scenario.verify(c.data.balances[OWNER] == sp.tez(4))
+    scenario.verify(c.get_balance(OWNER) == sp.tez(4))
+    scenario.verify(c.balance == sp.tez(14))
+
+    scenario.h2("Withdraw")
+    c.withdraw().run(sender = seller)
+    scenario.verify(~c.data.balances.contains(seller.address))
+    scenario.verify(c.get_balance(seller.address) == sp.tez(0))
+    scenario.verify(c.balance == sp.tez(11))
+    c.withdraw().run(sender = seller, valid = False, exception = "nothing to withdraw")
+    c.withdraw().run(sender = buyer, valid = False, exception = "nothing to withdraw")
+    c.withdraw().run(sender = other)
+    scenario.verify(c.balance == sp.tez(8))
+
+    scenario.h2("Nothing is credited for 0 tez")
+    free = market.Market(OWNER, sp.tez(0))
+    scenario += free
+    list_item(free, seller, 5, sp.tez(2), fee = sp.tez(0))
+    free.create_market_sale(address = token.address, item_id = 1).run(sender = buyer, amount = sp.tez(2))
+    scenario.verify(free.data.balances[seller.address] == sp.tez(2))
+    scenario.verify(~free.data.balances.contains(OWNER))
+    free.withdraw().run(sender = OWNER, valid = False, exception = "nothing to withdraw")
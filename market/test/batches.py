@@ -0,0 +1,126 @@
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+fa2 = sp.io.import_script_from_url("file:market/test/mock_fa2.py")
+
+OWNER = sp.address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")
+
+@sp.add_test(name = "Batches")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Batched listings and sales")
+    seller = sp.test_account("seller")
+    other = sp.test_account("other")
+    buyer = sp.test_account("buyer")
+    token_a = fa2.MockFA2()
+    token_b = fa2.MockFA2()
+    c = market.Market(OWNER, sp.tez(1))
+    scenario += token_a
+    scenario += token_b
+    scenario += c
+
+    def listing(token, token_id, price):
+        return sp.record(contract_address = token.address, token_id = token_id, price = price)
+
+    def items(*ids):
+        return sp.list([c.data.market_items[i] for i in ids])
+
+    scenario.h2("Batched listings")
+    listings = [listing(token_a, 1, sp.tez(2)), listing(token_a, 2, sp.tez(3)), listing(token_b, 1, sp.tez(2))]
+    c.create_market_items(listings).run(sender = seller, amount = sp.tez(2), valid = False,
+                                        exception = "fee must be equal to listing fee")
+    c.create_market_items(listings).run(sender = seller, amount = sp.tez(4), valid = False,
+                                        exception = "fee must be equal to listing fee")
+    c.create_market_items(listings).run(sender = seller, amount = sp.tez(3))
+    c.create_market_items([listing(token_a, 3, sp.tez(4)), listing(token_b, 2, sp.tez(5))]).run(
+        sender = other, amount = sp.tez(2))
+    scenario.verify(c.data.item_id == 6)
+
+    scenario.h2("Pages")
+    page = c.fetch_active_items_page(cursor = 0, limit = 2)
+    scenario.verify_equal(page.items, items(1, 2))
+    scenario.verify(page.next == 3)
+    page = c.fetch_active_items_page(cursor = 3, limit = 2)
+    scenario.verify_equal(page.items, items(3, 4))
+    scenario.verify(page.next == 5)
+    page = c.fetch_active_items_page(cursor = 5, limit = 2)
+    scenario.verify_equal(page.items, items(5))
+    scenario.verify(page.next == 0)
+    page = c.fetch_active_items_page(cursor = 0, limit = 5)
+    scenario.verify(sp.len(page.items) == 5)
+    scenario.verify(page.next == 0)
+    page = c.fetch_active_items_page(cursor = 2, limit = 0)
+    scenario.verify(sp.len(page.items) == 0)
+    scenario.verify(page.next == 2)
+    scenario.verify_equal(c.fetch_created_items(user = seller.address, cursor = 0, limit = 2), items(1, 2))
+    scenario.verify_equal(c.fetch_created_items(user = seller.address, cursor = 1, limit = 10), items(2, 3))
+    scenario.verify_equal(c.fetch_created_items(user = seller.address, cursor = 2, limit = 1), items(3))
+    scenario.verify(sp.len(c.fetch_created_items(user = seller.address, cursor = 3, limit = 10)) == 0)
+    scenario.verify(sp.len(c.fetch_created_items(user = seller.address, cursor = 0, limit = 0)) == 0)
+    scenario.verify_equal(c.fetch_created_items(user = other.address, cursor = 0, limit = 10), items(4, 5))
+    scenario.verify(sp.len(c.fetch_purchased_items(user = buyer.address, cursor = 0, limit = 10)) == 0)
+
+    scenario.h2("Rejected batched sales")
+    c.create_market_sales([
+        sp.record(address = token_a.address, item_id = 1),
+        sp.record(address = token_a.address, item_id = 1),
+    ]).run(sender = buyer, amount = sp.tez(4), valid = False, exception = "item is not for sale")
+    c.create_market_sales([
+        sp.record(address = token_a.address, item_id = 1),
+        sp.record(address = token_b.address, item_id = 3),
+    ]).run(sender = buyer, amount = sp.tez(3), valid = False, exception = "please the asking price")
+    c.create_market_sales([
+        sp.record(address = token_a.address, item_id = 1),
+        sp.record(address = token_a.address, item_id = 3),
+    ]).run(sender = buyer, amount = sp.tez(4), valid = False, exception = "address does not match the item")
+
+    scenario.h2("Batched sale over two collections")
+    c.create_market_sales([
+        sp.record(address = token_a.address, item_id = 1),
+        sp.record(address = token_b.address, item_id = 3),
+        sp.record(address = token_a.address, item_id = 4),
+        sp.record(address = token_b.address, item_id = 5),
+    ]).run(sender = buyer, amount = sp.tez(13))
+    # one transfer per token contract, with all its tokens
+    scenario.verify(token_a.data.transfers == 1)
+    scenario.verify(token_b.data.transfers == 1)
+    scenario.verify(token_a.data.ledger[1] == buyer.address)
+    scenario.verify(token_a.data.ledger[3] == buyer.address)
+    scenario.verify(~token_a.data.ledger.contains(2))
+    scenario.verify(token_b.data.ledger[1] == buyer.address)
+    scenario.verify(token_b.data.ledger[2] == buyer.address)
+    # the price less the listing fee, per seller
+    scenario.verify(c.data.balances[seller.address] == sp.tez(2))
+    scenario.verify(c.data.balances[other.address] == sp.tez(7))
+    scenario.verify(c.data.balances[OWNER] == sp.tez(4))
+
+    scenario.h2("Pages after the sale")
+    page = c.fetch_active_items_page(cursor = 0, limit = 10)
+    scenario.verify_equal(page.items, items(2))
+    scenario.verify(page.next == 0)
+    scenario.verify_equal(c.fetch_purchased_items(user = buyer.address, cursor = 0, limit = 10), items(1, 3, 4, 5))
+    scenario.verify_equal(c.fetch_purchased_items(user = buyer.address, cursor = 1, limit = 2), items(3, 4))
+    scenario.verify_equal(c.fetch_purchased_items(user = buyer.address, cursor = 3, limit = 2), items(5))
+    scenario.verify(sp.len(c.fetch_purchased_items(user = buyer.address, cursor = 4, limit = 2)) == 0)
+
+    scenario.h2("The cursor item is sold between two pages")
+    c.create_market_items([listing(token_a, token_id, sp.tez(2)) for token_id in [10, 11, 12]]).run(
+        sender = seller, amount = sp.tez(3))
+    page = c.fetch_active_items_page(cursor = 0, limit = 2)
+    scenario.verify_equal(page.items, items(2, 6))
+    scenario.verify(page.next == 7)
+    c.create_market_sale(address = token_a.address, item_id = 7).run(sender = buyer, amount = sp.tez(2))
+    page = c.fetch_active_items_page(cursor = 7, limit = 2)
+    scenario.verify_equal(page.items, items(8))
+    scenario.verify(page.next == 0)
+    # the tail is sold, then an item is listed after it
+    c.create_market_sale(address = token_a.address, item_id = 8).run(sender = buyer, amount = sp.tez(2))
+    c.create_market_items([listing(token_a, 13, sp.tez(2))]).run(sender = seller, amount = sp.tez(1))
+    scenario.verify_equal(c.fetch_active_items_page(cursor = 8, limit = 2).items, items(9))
+    scenario.verify_equal(c.fetch_active_items_page(cursor = 7, limit = 2).items, items(9))
+    # every item before the cursor is sold too
+    c.create_market_sale(address = token_a.address, item_id = 2).run(sender = buyer, amount = sp.tez(3))
+    c.create_market_sale(address = token_a.address, item_id = 6).run(sender = buyer, amount = sp.tez(2))
+    scenario.verify_equal(c.fetch_active_items_page(cursor = 7, limit = 2).items, items(9))
+    # purchases are paged in the order they were made
+    scenario.verify_equal(c.fetch_purchased_items(user = buyer.address, cursor = 4, limit = 10), items(7, 8, 2, 6))
@@ -0,0 +1,85 @@
+import os
+
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+# compiles the `mock_fa2` target the market calls
+fa2 = sp.io.import_script_from_url("file:market/test/mock_fa2.py")
+
+# Storage sizes of the benchmark targets, set by tools/bench.py
+SIZES = [int(size) for size in os.environ.get("BENCH_SIZES", "1,100,1000,10000").split(",")]
+
+# bootstrap1 and bootstrap2 of the octez mockup
+OWNER = sp.address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")
+SELLER = sp.address("tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN")
+
+# replaced by the address of the mock FA2 once it is originated
+FA2_PLACEHOLDER = sp.address("KT1C58ssiuw2Y92kK5VwXhE9k69P9aqhtP1Q")
+
+# price of the listed items, in mutez
+PRICE = 2000000
+
+def listed_market(size, cls = market.Market):
+    """
+    a `cls` market where SELLER has listed `size` items, ids 1 to size
+    """
+    c = cls(OWNER, sp.tez(1))
+    ids = range(1, size + 1)
+    c.update_initial_storage(
+        item_id = sp.nat(size + 1),
+        market_items = sp.big_map({
+            i: sp.record(
+                id = i,
+                address = FA2_PLACEHOLDER,
+                token_id = i,
+                seller = SELLER,
+                buyer = sp.none,
+                price = sp.mutez(PRICE),
+                state = sp.variant("created", SELLER)
+            ) for i in ids
+        }, tkey = sp.TNat, tvalue = market.t_market_item),
+        active_items = sp.big_map({
+            i: sp.record(prev = i - 1, next = i + 1 if i < size else 0) for i in ids
+        }, tkey = sp.TNat, tvalue = market.t_active_node),
+        active_head = sp.nat(1 if size else 0),
+        active_tail = sp.nat(size),
+        unlinked_items = sp.big_map(tkey = sp.TNat, tvalue = sp.TNat),
+        seller_items = sp.big_map(
+            {sp.record(user = SELLER, n = i - 1): i for i in ids},
+            tkey = market.t_user_item,
+            tvalue = sp.TNat
+        ),
+        seller_counts = sp.big_map({SELLER: size} if size else {}, tkey = sp.TAddress, tvalue = sp.TNat),
+        price_items = sp.big_map({
+            sp.record(contract = FA2_PLACEHOLDER, price = sp.mutez(PRICE), item_id = i):
+                sp.record(prev = i - 1, next = i + 1 if i < size else 0)
+            for i in ids
+        }, tkey = market.t_price_item, tvalue = market.t_active_node),
+        price_levels = sp.big_map(
+            {sp.record(contract = FA2_PLACEHOLDER, price = sp.mutez(PRICE)): sp.record(head = 1, tail = size)}
+            if size else {},
+            tkey = market.t_price_level_key,
+            tvalue = market.t_price_level
+        ),
+        price_buckets = sp.big_map(
+            {sp.record(contract = FA2_PLACEHOLDER, bucket = PRICE // market.PRICE_BUCKET): sp.set([sp.mutez(PRICE)])}
+            if size else {},
+            tkey = market.t_price_bucket,
+            tvalue = sp.TSet(sp.TMutez)
+        ),
+        collection_buckets = sp.big_map(
+            {FA2_PLACEHOLDER: sp.set([PRICE // market.PRICE_BUCKET])} if size else {},
+            tkey = sp.TAddress,
+            tvalue = sp.TSet(sp.TNat)
+        ),
+        price_floor = sp.big_map(
+            {FA2_PLACEHOLDER: sp.record(price = sp.mutez(PRICE), item_id = 1)} if size else {},
+            tkey = sp.TAddress,
+            tvalue = market.t_price_key
+        )
+    )
+    return c
+
+for size in SIZES:
+    sp.add_compilation_target("bench_market_%d" % size, listed_market(size))
+    sp.add_compilation_target("bench_market_lazy_%d" % size, listed_market(size, market.LazyMarket))
@@ -0,0 +1,99 @@
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+fa2 = sp.io.import_script_from_url("file:market/test/mock_fa2.py")
+
+# bootstrap1 of the octez mockup, see tools/compare_layouts.py
+OWNER = sp.address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")
+ITEMS = 1000
+
+@sp.add_test(name = "Market layouts")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Market storage layouts")
+    seller = sp.test_account("seller")
+    buyer = sp.test_account("buyer")
+    token = fa2.MockFA2()
+    full = market.Market(OWNER, sp.tez(1))
+    compact = market.CompactMarket(OWNER, sp.tez(1))
+    scenario += token
+    scenario += full
+    scenario += compact
+
+    scenario.h2("List the same %d items" % ITEMS)
+    for c in [full, compact]:
+        for token_id in range(ITEMS):
+            c.crerate_market_item(
+                contract_address = token.address,
+                token_id = token_id,
+                price = sp.tez(2)
+            ).run(sender = seller, amount = sp.tez(1))
+        c.create_market_sale(address = token.address, item_id = 1).run(sender = buyer, amount = sp.tez(2))
+        c.delete_market_item(2).run(sender = seller)
+
+    scenario.h2("Price index")
+    for c in [full, compact]:
+        c.crerate_market_item(
+            contract_address = token.address,
+            token_id = ITEMS,
+            price = sp.tez(3)
+        ).run(sender = seller, amount = sp.tez(1))
+        scenario.verify(c.floor_price(token.address).open_some().item_id == 3)
+        in_range = c.items_in_price_range(contract = token.address, lo = sp.tez(3), hi = sp.tez(5), limit = 10)
+        scenario.verify(sp.len(in_range) == 1)
+        c.delete_market_item(3).run(sender = seller)
+        scenario.verify(c.floor_price(token.address).open_some().item_id == 4)
+        scenario.verify(c.floor_price(seller.address).is_none())
+        # a cheaper bucket becomes the floor until it is empty again
+        c.crerate_market_item(
+            contract_address = token.address,
+            token_id = ITEMS + 1,
+            price = sp.mutez(1500000)
+        ).run(sender = seller, amount = sp.tez(1))
+        scenario.verify(c.floor_price(token.address).open_some().item_id == ITEMS + 2)
+        in_range = c.items_in_price_range(contract = token.address, lo = sp.mutez(1500000), hi = sp.tez(2), limit = 3)
+        scenario.verify(sp.len(in_range) == 3)
+        c.delete_market_item(ITEMS + 2).run(sender = seller)
+        scenario.verify(c.floor_price(token.address).open_some().item_id == 4)
+        # two prices of one bucket, the floor moves to the next price
+        for token_id, price in [(ITEMS + 2, sp.mutez(1500000)), (ITEMS + 3, sp.mutez(1550000))]:
+            c.crerate_market_item(
+                contract_address = token.address,
+                token_id = token_id,
+                price = price
+            ).run(sender = seller, amount = sp.tez(1))
+        c.delete_market_item(ITEMS + 3).run(sender = seller)
+        scenario.verify_equal(c.floor_price(token.address), sp.some(sp.record(price = sp.mutez(1550000), item_id = ITEMS + 4)))
+        in_range = c.items_in_price_range(contract = token.address, lo = sp.mutez(1500000), hi = sp.tez(2), limit = 3)
+        scenario.verify_equal(in_range, sp.list([
+            sp.record(price = sp.mutez(1550000), item_id = ITEMS + 4),
+            sp.record(price = sp.tez(2), item_id = 4),
+            sp.record(price = sp.tez(2), item_id = 5),
+        ]))
+        c.delete_market_item(ITEMS + 4).run(sender = seller)
+        scenario.verify(c.floor_price(token.address).open_some().item_id == 4)
+
+    scenario.h2("Item views")
+    page = full.fetch_active_items_page(cursor = 0, limit = 1)
+    scenario.verify_equal(page.items, sp.list([full.data.market_items[4]]))
+    scenario.verify(page.next == 5)
+    page = compact.fetch_active_items_page(cursor = 0, limit = 1)
+    scenario.verify_equal(page.items, sp.list([sp.record(id = 4, item = compact.data.market_items[4])]))
+    scenario.verify(page.next == 5)
+    scenario.verify_equal(
+        compact.fetch_purchased_items(user = buyer.address, cursor = 0, limit = 10),
+        sp.list([sp.record(id = 1, item = compact.data.market_items[1])])
+    )
+
+    scenario.h2("Packed bytes per item")
+    for c in [full, compact]:
+        for item_id in [1, 2, 3]:
+            scenario.show(sp.len(sp.pack(c.data.market_items[item_id])))
+    scenario.verify(
+        sp.len(sp.pack(compact.data.market_items[3])) < sp.len(sp.pack(full.data.market_items[3]))
+    )
+
+
+sp.add_compilation_target("layout_market_full", market.Market(OWNER, sp.tez(1)))
+sp.add_compilation_target("layout_market_compact", market.CompactMarket(OWNER, sp.tez(1)))
+sp.add_compilation_target("layout_market_lazy", market.LazyMarket(OWNER, sp.tez(1)))
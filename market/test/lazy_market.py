@@ -0,0 +1,63 @@
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+fa2 = sp.io.import_script_from_url("file:market/test/mock_fa2.py")
+
+OWNER = sp.test_account("owner")
+
+def paused_sale(self, params):
+    """
+    replacement of create_market_sale that refuses every sale
+    """
+    sp.set_type(params, market.t_sale)
+    sp.verify(self.data.market_items.contains(params.item_id), "item is not exists")
+    sp.failwith("sales are paused")
+
+@sp.add_test(name = "Lazy entry points")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Update a lazy entry point")
+    seller = sp.test_account("seller")
+    buyer = sp.test_account("buyer")
+    token = fa2.MockFA2()
+    c = market.LazyMarket(OWNER.address, sp.tez(1))
+    scenario += token
+    scenario += c
+
+    for token_id in [1, 2]:
+        c.crerate_market_item(
+            contract_address = token.address,
+            token_id = token_id,
+            price = sp.tez(2)
+        ).run(sender = seller, amount = sp.tez(1))
+    c.create_market_sale(address = token.address, item_id = 1).run(sender = buyer, amount = sp.tez(2))
+    scenario.verify(token.data.ledger[1] == buyer.address)
+
+    update = sp.variant("create_market_sale", sp.utils.wrap_entry_point("create_market_sale", paused_sale))
+
+    scenario.h2("Only the owner updates")
+    c.update_entry_point(update).run(sender = seller, valid = False,
+                                     exception = "only the owner can update entry points")
+    c.create_market_sale(address = token.address, item_id = 2).run(sender = buyer, amount = sp.tez(2))
+    scenario.verify(token.data.ledger[2] == buyer.address)
+
+    scenario.h2("The new code runs")
+    c.crerate_market_item(
+        contract_address = token.address,
+        token_id = 3,
+        price = sp.tez(2)
+    ).run(sender = seller, amount = sp.tez(1))
+    c.update_entry_point(update).run(sender = OWNER)
+    c.create_market_sale(address = token.address, item_id = 3).run(
+        sender = buyer, amount = sp.tez(2), valid = False, exception = "sales are paused")
+    c.create_market_sale(address = token.address, item_id = 4).run(
+        sender = buyer, amount = sp.tez(2), valid = False, exception = "item is not exists")
+    scenario.verify(c.data.market_items[3].state.is_variant("created"))
+    scenario.verify(~token.data.ledger.contains(3))
+    # the other lazy entry points keep their code
+    c.crerate_market_item(
+        contract_address = token.address,
+        token_id = 4,
+        price = sp.tez(2)
+    ).run(sender = seller, amount = sp.tez(1))
+    scenario.verify(c.data.item_id == 5)
@@ -0,0 +1,34 @@
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+
+class MockFA2(sp.Contract):
+    """
+    Minimal FA2 stand-in for the Market scenarios: `is_operator` exists so
+    listing passes, `transfer` records the new owner without any check
+    and counts its calls.
+    """
+
+    def __init__(self):
+        self.init(
+            ledger = sp.big_map(
+                tkey=sp.TNat,
+                tvalue=sp.TAddress
+            ),
+            transfers = sp.nat(0)
+        )
+
+    @sp.entry_point
+    def transfer(self, params):
+        sp.set_type(params, market.t_transfer_params)
+        self.data.transfers += 1
+        with sp.for_("batch", params) as batch:
+            with sp.for_("tx", batch.txs) as tx:
+                self.data.ledger[tx.token_id] = tx.to_
+
+    @sp.entry_point
+    def is_operator(self, params):
+        sp.set_type(params, market.t_operator_permission)
+
+
+sp.add_compilation_target("mock_fa2", MockFA2())
@@ -0,0 +1,73 @@
+import smartpy as sp
+
+market = sp.io.import_script_from_url("file:market/contracts/market.py")
+fa2 = sp.io.import_script_from_url("file:market/test/mock_fa2.py")
+
+OWNER = sp.address("tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx")
+
+@sp.add_test(name = "Signed listings")
+def test():
+    scenario = sp.test_scenario()
+    scenario.h1("Signed listings")
+    seller = sp.test_account("seller")
+    buyer = sp.test_account("buyer")
+    token = fa2.MockFA2()
+    c = market.SignedMarket(OWNER, sp.tez(1))
+    scenario += token
+    scenario += c
+
+    def signed(token_id, price, nonce, expiry = sp.timestamp(1000)):
+        listing = sp.record(
+            contract = token.address,
+            token_id = token_id,
+            price = price,
+            expiry = expiry,
+            nonce = nonce
+        )
+        sp.set_type_expr(listing, market.t_signed_listing)
+        signature = scenario.compute(
+            sp.make_signature(seller.secret_key, market.signed_message(c.address, listing), message_format = "Raw")
+        )
+        return sp.record(listing = listing, seller_key = seller.public_key, signature = signature)
+
+    scenario.h2("Buy a signed listing")
+    purchase = signed(7, sp.tez(2), 1)
+    c.buy_signed_listing(purchase).run(sender = buyer, amount = sp.tez(2), now = sp.timestamp(100))
+    scenario.verify(c.data.item_id == 2)
+    scenario.verify(c.data.market_items[1].seller == seller.address)
+    scenario.verify(c.data.market_items[1].buyer == sp.some(buyer.address))
+    scenario.verify(token.data.ledger[7] == buyer.address)
+    scenario.verify(c.data.balances[seller.address] == sp.tez(1))
+    scenario.verify(c.data.balances[OWNER] == sp.tez(1))
+    scenario.verify(c.data.active_head == 0)
+
+    scenario.h2("A listing is sold once")
+    c.buy_signed_listing(purchase).run(sender = buyer, amount = sp.tez(2), now = sp.timestamp(100), valid = False)
+
+    scenario.h2("Expired, underpaid and forged listings")
+    c.buy_signed_listing(signed(8, sp.tez(2), 2)).run(
+        sender = buyer, amount = sp.tez(2), now = sp.timestamp(1001), valid = False)
+    c.buy_signed_listing(signed(8, sp.tez(2), 2)).run(
+        sender = buyer, amount = sp.tez(1), now = sp.timestamp(100), valid = False)
+    forged = signed(8, sp.tez(2), 2)
+    c.buy_signed_listing(
+        listing = sp.record(
+            contract = token.address,
+            token_id = 8,
+            price = sp.tez(1),
+            expiry = sp.timestamp(1000),
+            nonce = 2
+        ),
+        seller_key = forged.seller_key,
+        signature = forged.signature
+    ).run(sender = buyer, amount = sp.tez(1), now = sp.timestamp(100), valid = False)
+    c.buy_signed_listing(forged).run(sender = buyer, amount = sp.tez(2), now = sp.timestamp(100))
+    scenario.verify(c.data.market_items[2].token_id == 8)
+
+    scenario.h2("Cancel a signed listing")
+    cancelled = signed(9, sp.tez(3), 3)
+    c.cancel_signed_listings([3]).run(sender = seller)
+    scenario.verify(c.data.used_nonces.contains(sp.record(seller = seller.address, nonce = 3)))
+    scenario.verify(~c.data.used_nonces.contains(sp.record(seller = seller.address, nonce = 4)))
+    c.buy_signed_listing(cancelled).run(sender = buyer, amount = sp.tez(3), now = sp.timestamp(100), valid = False)
+    scenario.verify(c.data.item_id == 3)
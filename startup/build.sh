@@ -1,6 +1,4 @@
 #!/bin/bash
 
-SmartPy.sh compile startup/contracts/store.py startup/compilation
-SmartPy.sh compile startup/contracts/init_type.py startup/compilation
-SmartPy.sh compile startup/contracts/inheritance.py startup/compilation
-SmartPy.sh compile startup/contracts/upgradable.py startup/compilation
\ No newline at end of file
+# Compile every target of startup/ and market/, see tools/build.py
+cd "$(dirname "$0")/.." && exec python3 -m tools.build "$@"
@@ -25,7 +25,11 @@ class Creator(sp.Contract):
         self.created = Created()
         self.created2 = Created2()
         self.init(x = sp.none,
-                  l = sp.build_lambda(self.opopop))
+                  l = sp.build_lambda(self.opopop),
+                  # contracts originated by create_batch, by (batch, sequence)
+                  next_batch = sp.nat(0),
+                  batch_sizes = sp.big_map(tkey = sp.TNat, tvalue = sp.TNat),
+                  children = sp.big_map(tkey = sp.TPair(sp.TNat, sp.TNat), tvalue = sp.TAddress))
 
 
     @sp.entry_point
@@ -46,7 +50,29 @@ class Creator(sp.Contract):
     @sp.entry_point
     def create4(self, l):
         sp.for x in l:
-        sp.create_contract(storage = sp.record(a = x, b = 15), contract = self.created, baker = sp.none)
+            sp.create_contract(storage = sp.record(a = x, b = 15), contract = self.created, baker = sp.none)
+
+    @sp.entry_point
+    def create_batch(self, storages):
+        # one Created per initial storage, all in one operation
+        sp.set_type(storages, sp.TList(sp.TRecord(a = sp.TInt, b = sp.TNat)))
+        seq = sp.local("seq", sp.nat(0))
+        sp.for storage in storages:
+            self.data.children[(self.data.next_batch, seq.value)] = sp.create_contract(storage = storage, contract = self.created)
+            seq.value += 1
+        self.data.batch_sizes[self.data.next_batch] = seq.value
+        self.data.next_batch += 1
+
+    @sp.onchain_view()
+    def get_child(self, params):
+        # address of the contract (batch, sequence) of create_batch
+        sp.set_type(params, sp.TPair(sp.TNat, sp.TNat))
+        sp.result(self.data.children[params])
+
+    @sp.onchain_view()
+    def get_batch_size(self, batch):
+        sp.set_type(batch, sp.TNat)
+        sp.result(self.data.batch_sizes[batch])
 
     @sp.entry_point
     def create5(self):
@@ -85,4 +111,10 @@ def test():
     scenario.show(dyn0.baker)
     scenario.show(dyn0.address)
 
+    c1.create_batch([sp.record(a = 1, b = 2), sp.record(a = 3, b = 4)])
+    scenario.verify(c1.data.batch_sizes[0] == 2)
+    dyn6 = scenario.dynamic_contract(6, c1.created)
+    scenario.verify(c1.data.children[(0, 1)] == dyn6.address)
+    scenario.verify(dyn6.data.a == 3)
+
 sp.add_compilation_target("create_contract", Creator(sp.none))
\ No newline at end of file
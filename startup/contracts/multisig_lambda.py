@@ -12,29 +12,52 @@ class MultisigLambda(sp.Contract):
     administrating another contract...
 
     When a lambda is applied, all submitted lambdas until now are inactivated.
-    The members can still submit new lambdas.
+    The members can still submit new lambdas. Inactive lambdas and their votes
+    are deleted oldest first, up to an id with `prune` or a few at each call
+    with `auto_prune`, so `prunedBefore` is the first id not deleted.
     """
 
-    def __init__(self, members, required_votes):
+    # `votes` holds the set of voters of each lambda, see CountedMultisigLambda
+    counted_votes = False
+
+    def __init__(self, members, required_votes, auto_prune=0):
         """Constructor
 
         Args:
             members (sp.TSet(sp.TAddress)): people who can submit and vote for
                 lambda.
             required_votes (sp.TNat): number of votes required
+            auto_prune (int): number of inactive lambdas deleted, oldest
+                first, by each `submit_lambda` and `vote_lambda`.
         """
-        assert required_votes <= len(members), "required_votes must be <= len(members)"
+        self.auto_prune = auto_prune
+        if self.counted_votes:
+            votes = dict(
+                votes=sp.big_map(tkey=sp.TNat, tvalue=sp.TNat),
+                voters=sp.big_map(tkey=sp.TPair(sp.TNat, sp.TAddress), tvalue=sp.TUnit),
+            )
+        else:
+            votes = dict(votes=sp.big_map(tkey=sp.TNat, tvalue=sp.TSet(sp.TAddress)))
         self.init(
             lambdas=sp.big_map(
                 tkey=sp.TNat, tvalue=sp.TLambda(sp.TUnit, sp.TList(sp.TOperation))
             ),
-            votes=sp.big_map(tkey=sp.TNat, tvalue=sp.TSet(sp.TAddress)),
             nextId=0,
             inactiveBefore=0,
-            members=sp.set(members, t=sp.TAddress),
+            prunedBefore=0,
             required_votes=required_votes,
+            **votes,
+            **self.members_storage(members, required_votes)
         )
 
+    def members_storage(self, members, required_votes):
+        assert required_votes <= len(members), "required_votes must be <= len(members)"
+        return dict(members=sp.set(members, t=sp.TAddress))
+
+    def vote_weight(self):
+        """Votes added to the count by sp.sender, with counted_votes."""
+        return sp.nat(1)
+
     @sp.entry_point
     def submit_lambda(self, lambda_):
         """Submit a new lambda to the vote.
@@ -48,8 +71,12 @@ class MultisigLambda(sp.Contract):
             `You are not a member`
         """
         sp.verify(self.data.members.contains(sp.sender), "You are not a member")
+        self.prune_oldest(self.auto_prune)
         self.data.lambdas[self.data.nextId] = lambda_
-        self.data.votes[self.data.nextId] = sp.set()
+        if self.counted_votes:
+            self.data.votes[self.data.nextId] = 0
+        else:
+            self.data.votes[self.data.nextId] = sp.set()
         self.data.nextId += 1
 
     @sp.entry_point
@@ -67,17 +94,57 @@ class MultisigLambda(sp.Contract):
         sp.verify(self.data.members.contains(sp.sender), "You are not a member")
         sp.verify(id >= self.data.inactiveBefore, "The lambda is inactive")
         sp.verify(self.data.lambdas.contains(id), "Lambda not found")
-        self.data.votes[id].add(sp.sender)
-        with sp.if_(sp.len(self.data.votes[id]) >= self.data.required_votes):
+        self.prune_oldest(self.auto_prune)
+        if self.counted_votes:
+            with sp.if_(~self.data.voters.contains((id, sp.sender))):
+                self.data.voters[(id, sp.sender)] = sp.unit
+                self.data.votes[id] += self.vote_weight()
+            count = self.data.votes[id]
+        else:
+            self.data.votes[id].add(sp.sender)
+            count = sp.len(self.data.votes[id])
+        with sp.if_(count >= self.data.required_votes):
             sp.add_operations(self.data.lambdas[id](sp.unit))
             self.data.inactiveBefore = self.data.nextId
+            if self.counted_votes:
+                del self.data.votes[id]
+
+    def prune_oldest(self, count):
+        """Delete up to `count` inactive lambdas following `prunedBefore`."""
+        if count > 0:
+            with sp.for_("i", sp.range(0, count)):
+                with sp.if_(self.data.prunedBefore < self.data.inactiveBefore):
+                    del self.data.lambdas[self.data.prunedBefore]
+                    del self.data.votes[self.data.prunedBefore]
+                    self.data.prunedBefore += 1
+
+    @sp.entry_point
+    def prune(self, stop):
+        """Delete inactive lambdas and their votes.
+
+        Anyone can call it, only inactive lambdas are deleted. The deletion
+        goes on from `prunedBefore`, so `auto_prune` never deletes the same
+        ids again.
+
+        Args:
+            stop (sp.TNat): id before which every lambda is deleted.
+        Raises:
+            `The lambda is active`
+        """
+        sp.set_type(stop, sp.TNat)
+        sp.verify(stop <= self.data.inactiveBefore, "The lambda is active")
+        with sp.while_(self.data.prunedBefore < stop):
+            del self.data.lambdas[self.data.prunedBefore]
+            del self.data.votes[self.data.prunedBefore]
+            self.data.prunedBefore += 1
 
     @sp.onchain_view()
     def get_lambda(self, id):
         """Return the corresponding lambda.
 
         Args:
-            id (sp.TNat): id of the lambda to get.
+            id (sp.TNat): id of the lambda to get, it fails once the lambda
+                is pruned.
 
         Return:
             pair of the lambda and a boolean showing if the lambda is active.
@@ -85,6 +152,120 @@ class MultisigLambda(sp.Contract):
         sp.result(sp.pair(self.data.lambdas[id], id >= self.data.inactiveBefore))
 
 
+class CountedMultisigLambda(MultisigLambda):
+    """MultisigLambda whose votes cost the same however many members voted.
+
+    `votes` holds the number of votes of each lambda instead of the set of
+    its voters, which is deserialized on every vote, and `voters` records
+    who voted for which lambda. The count of an executed lambda is deleted,
+    but `prune` and `auto_prune` only delete the lambdas and their counts:
+    the `voters` entries of a lambda stay in storage until `clear_voters` is
+    called with them.
+    """
+
+    counted_votes = True
+
+    @sp.entry_point
+    def clear_voters(self, ballots):
+        """Delete the `voters` entries of inactive lambdas.
+
+        Anyone can call it, typically with the voters of the lambdas
+        inactivated by the last execution.
+
+        Args:
+            ballots (sp.TList(sp.TPair(sp.TNat, sp.TAddress))): (id, voter)
+                entries to delete.
+        Raises:
+            `The lambda is active`
+        """
+        sp.set_type(ballots, sp.TList(sp.TPair(sp.TNat, sp.TAddress)))
+        with sp.for_("ballot", ballots) as ballot:
+            sp.verify(sp.fst(ballot) < self.data.inactiveBefore, "The lambda is active")
+            del self.data.voters[ballot]
+
+
+class WeightedMultisigLambda(CountedMultisigLambda):
+    """CountedMultisigLambda whose members are a big_map of vote weights.
+
+    Checking a member reads one big_map entry instead of the whole set of
+    members, and a vote adds the weight of the voter to the count of the
+    lambda. `required_votes` is a weight, at most `total_weight`.
+
+    Members and `required_votes` can only be changed by the contract itself,
+    through a lambda calling `add_member`, `remove_member` or
+    `set_required_votes`.
+    """
+
+    def members_storage(self, members, required_votes):
+        """
+        Args:
+            members (dict of sp.TAddress to int): weight of each member.
+        """
+        total_weight = sum(members.values())
+        assert required_votes <= total_weight, "required_votes must be <= total weight"
+        return dict(
+            members=sp.big_map(members, tkey=sp.TAddress, tvalue=sp.TNat),
+            total_weight=sp.nat(total_weight),
+        )
+
+    def vote_weight(self):
+        return self.data.members[sp.sender]
+
+    @sp.entry_point
+    def add_member(self, params):
+        """Add a member or change its weight.
+
+        Lowering a weight must leave `total_weight` at least
+        `required_votes`, or no lambda could be executed any more.
+
+        Args:
+            params (sp.TRecord(address=sp.TAddress, weight=sp.TNat)): member
+                and its new weight, at least 1.
+        Raises:
+            `Only through a lambda`, `The weight must be positive`,
+            `required_votes must be <= total weight`
+        """
+        sp.set_type(params, sp.TRecord(address=sp.TAddress, weight=sp.TNat).layout(("address", "weight")))
+        sp.verify(sp.sender == sp.self_address, "Only through a lambda")
+        sp.verify(params.weight > 0, "The weight must be positive")
+        self.data.total_weight = (
+            sp.as_nat(self.data.total_weight - self.data.members.get(params.address, 0)) + params.weight
+        )
+        self.data.members[params.address] = params.weight
+        sp.verify(self.data.required_votes <= self.data.total_weight, "required_votes must be <= total weight")
+
+    @sp.entry_point
+    def remove_member(self, address):
+        """Remove a member, its votes on active lambdas are kept.
+
+        Args:
+            address (sp.TAddress): member to remove.
+        Raises:
+            `Only through a lambda`, `Member not found`,
+            `required_votes must be <= total weight`
+        """
+        sp.set_type(address, sp.TAddress)
+        sp.verify(sp.sender == sp.self_address, "Only through a lambda")
+        sp.verify(self.data.members.contains(address), "Member not found")
+        self.data.total_weight = sp.as_nat(self.data.total_weight - self.data.members[address])
+        del self.data.members[address]
+        sp.verify(self.data.required_votes <= self.data.total_weight, "required_votes must be <= total weight")
+
+    @sp.entry_point
+    def set_required_votes(self, required_votes):
+        """Change the weight of votes a lambda needs to be executed.
+
+        Args:
+            required_votes (sp.TNat): at most `total_weight`.
+        Raises:
+            `Only through a lambda`, `required_votes must be <= total weight`
+        """
+        sp.set_type(required_votes, sp.TNat)
+        sp.verify(sp.sender == sp.self_address, "Only through a lambda")
+        sp.verify(required_votes <= self.data.total_weight, "required_votes must be <= total weight")
+        self.data.required_votes = required_votes
+
+
 if "templates" not in __name__:
 
     class Administrated(sp.Contract):
@@ -136,3 +317,122 @@ if "templates" not in __name__:
 
         # We can check that the administrated contract received the transfer.
         sc.verify(c2.data.value == 42)
+
+    @sp.add_test(name="CountedMultisigLambda scenario")
+    def counted_scenario():
+        """Vote counting, double votes and cleanup of the voters."""
+        sc = sp.test_scenario()
+        sc.h1("Counted votes.")
+
+        member1 = sp.test_account("member1")
+        member2 = sp.test_account("member2")
+        member3 = sp.test_account("member3")
+        members = [member1.address, member2.address, member3.address]
+
+        c1 = CountedMultisigLambda(members, required_votes=2)
+        sc += c1
+        c2 = Administrated(c1.address)
+        sc += c2
+
+        def set_42(params):
+            administrated = sp.contract(sp.TInt, c2.address, entry_point="set_value")
+            sp.transfer(sp.int(42), sp.tez(0), administrated.open_some())
+
+        c1.submit_lambda(sp.utils.lambda_operations_only(set_42)).run(sender=member1)
+        c1.vote_lambda(0).run(sender=member1)
+        c1.vote_lambda(0).run(sender=member1)
+        sc.verify(c1.data.votes[0] == 1)
+        c1.clear_voters([(0, member1.address)]).run(sender=member3, valid=False)
+
+        c1.vote_lambda(0).run(sender=member2)
+        sc.verify(c2.data.value == 42)
+        sc.verify(~c1.data.votes.contains(0))
+        c1.clear_voters([(0, member1.address), (0, member2.address)]).run(sender=member3)
+        sc.verify(~c1.data.voters.contains((0, member1.address)))
+
+    @sp.add_test(name="MultisigLambda pruning")
+    def pruning_scenario():
+        """Explicit and automatic deletion of inactive lambdas."""
+        sc = sp.test_scenario()
+        sc.h1("Pruning.")
+
+        member1 = sp.test_account("member1")
+        member2 = sp.test_account("member2")
+        c1 = MultisigLambda([member1.address, member2.address], required_votes=1, auto_prune=1)
+        sc += c1
+
+        nothing = sp.utils.lambda_operations_only(lambda params: None)
+        for _ in range(4):
+            c1.submit_lambda(nothing).run(sender=member1)
+        c1.prune(1).run(sender=member2, valid=False)
+
+        c1.vote_lambda(3).run(sender=member1)
+        sc.verify(c1.data.inactiveBefore == 4)
+        c1.prune(2).run(sender=member2)
+        sc.verify(~c1.data.lambdas.contains(1))
+        sc.verify(c1.data.lambdas.contains(2))
+        sc.verify(c1.data.prunedBefore == 2)
+        # already deleted
+        c1.prune(1).run(sender=member2)
+        sc.verify(c1.data.prunedBefore == 2)
+        c1.prune(5).run(sender=member2, valid=False)
+
+        sc.h2("auto_prune deletes one lambda per call, after the pruned ones")
+        c1.submit_lambda(nothing).run(sender=member1)
+        sc.verify(~c1.data.lambdas.contains(2))
+        sc.verify(c1.data.prunedBefore == 3)
+        c1.submit_lambda(nothing).run(sender=member1)
+        sc.verify(~c1.data.lambdas.contains(3))
+        sc.verify(c1.data.prunedBefore == 4)
+        # lambda 4 is active
+        c1.submit_lambda(nothing).run(sender=member1)
+        sc.verify(c1.data.lambdas.contains(4))
+        sc.verify(c1.data.prunedBefore == 4)
+
+    @sp.add_test(name="WeightedMultisigLambda scenario")
+    def weighted_scenario():
+        """Weighted votes and membership changes through a lambda."""
+        sc = sp.test_scenario()
+        sc.h1("Weighted members.")
+
+        member1 = sp.test_account("member1")
+        member2 = sp.test_account("member2")
+        member3 = sp.test_account("member3")
+        member4 = sp.test_account("member4")
+        c1 = WeightedMultisigLambda(
+            {member1.address: 2, member2.address: 1, member3.address: 1}, required_votes=3
+        )
+        sc += c1
+
+        c1.add_member(address=member4.address, weight=1).run(sender=member1, valid=False)
+
+        def add_member4(params):
+            add_member = sp.contract(
+                sp.TRecord(address=sp.TAddress, weight=sp.TNat).layout(("address", "weight")),
+                c1.address,
+                entry_point="add_member",
+            )
+            sp.transfer(sp.record(address=member4.address, weight=1), sp.tez(0), add_member.open_some())
+
+        c1.submit_lambda(sp.utils.lambda_operations_only(add_member4)).run(sender=member2)
+        c1.vote_lambda(0).run(sender=member1)
+        sc.verify(c1.data.votes[0] == 2)
+        sc.verify(~c1.data.members.contains(member4.address))
+        c1.vote_lambda(0).run(sender=member3)
+        sc.verify(c1.data.members[member4.address] == 1)
+        sc.verify(c1.data.total_weight == 5)
+
+        sc.h2("A weight cannot drop below required_votes")
+        c1.set_required_votes(5).run(sender=c1.address)
+        c1.add_member(address=member1.address, weight=1).run(
+            sender=c1.address, valid=False, exception="required_votes must be <= total weight"
+        )
+        sc.verify(c1.data.members[member1.address] == 2)
+        c1.set_required_votes(4).run(sender=c1.address)
+        c1.add_member(address=member1.address, weight=1).run(sender=c1.address)
+        sc.verify(c1.data.total_weight == 4)
+
+    sp.add_compilation_target(
+        "multisig_lambda",
+        MultisigLambda([sp.address("tz1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB")], required_votes=1),
+    )
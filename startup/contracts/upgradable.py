@@ -1,18 +1,34 @@
 import smartpy as sp
 
+t_logic = sp.TLambda(sp.TNat, sp.TNat)
+
 class Upgradable(sp.Contract):
+    # the logic lambdas live in a big_map keyed by version, so a call only
+    # loads the active one, however many and large the versions are
     def __init__(self, logic):
-        self.init(logic = logic, value = 9)
+        self.init(
+            logics = sp.big_map({0: logic}, tkey = sp.TNat, tvalue = t_logic),
+            version = sp.nat(0),
+            value = sp.nat(9)
+        )
+
 
-    
-    @sp.entry_point(lazify = True, lazy_no_code = True)
+    @sp.entry_point(lazify = True)
     def calc(self, value):
-        self.data.value = self.data.logic(value)
+        self.data.value = self.data.logics[self.data.version](value)
 
-    
     @sp.entry_point
-    def upgrad_logic(self, logic):
-        self.data.logic = logic
+    def register_logic(self, params):
+        # a registered version never changes, upgrading is switching version
+        sp.set_type(params, sp.TRecord(version = sp.TNat, logic = t_logic).layout(("version", "logic")))
+        sp.verify(~self.data.logics.contains(params.version), "version already registered")
+        self.data.logics[params.version] = params.logic
+
+    @sp.entry_point
+    def upgrad_logic(self, version):
+        sp.set_type(version, sp.TNat)
+        sp.verify(self.data.logics.contains(version), "version not registered")
+        self.data.version = version
 
 
 class UpgradContract(sp.Contract):
@@ -20,20 +36,39 @@ class UpgradContract(sp.Contract):
         self.init(address = address)
 
     def calc_logic(data):
-        t = sp.TNat
-        unpacked = sp.unpack(data, t).open_some(message = "unpack nat failed")
-        sp.result(unpacked+2)
+        sp.result(data + 2)
 
     @sp.entry_point
-    def do_upgrade(self):
-        # sp.TLambda(t1, t2) t1 is the parameter type and the t2 is the result type 
-        contract = sp.contract(sp.TLambda(sp.TBytes, sp.TNat), self.data.address, "upgrade_logic").open_some()
-        sp.transfer(sp.build_lambda(UpgradContract.calc_logic), sp.tez(0), contract)
+    def do_upgrade(self, version):
+        # sp.TLambda(t1, t2) t1 is the parameter type and the t2 is the result type
+        register = sp.contract(
+            sp.TRecord(version = sp.TNat, logic = t_logic).layout(("version", "logic")),
+            self.data.address,
+            "register_logic"
+        ).open_some()
+        sp.transfer(sp.record(version = version, logic = sp.build_lambda(UpgradContract.calc_logic)), sp.tez(0), register)
+        upgrade = sp.contract(sp.TNat, self.data.address, "upgrad_logic").open_some()
+        sp.transfer(version, sp.tez(0), upgrade)
 
 def origin_logic(data):
-    t = sp.TNat
-    unpacked = sp.unpack(data, t).open_some(message = "unpack nat failed")
-    sp.result(unpacked+1)
+    sp.result(data + 1)
+
+@sp.add_test(name = "Upgradable")
+def test():
+    scenario = sp.test_scenario()
+    c = Upgradable(sp.build_lambda(origin_logic))
+    scenario += c
+    c.calc(1)
+    scenario.verify(c.data.value == 2)
+    trigger = UpgradContract(c.address)
+    scenario += trigger
+    trigger.do_upgrade(1)
+    c.calc(1)
+    scenario.verify(c.data.value == 3)
+    c.upgrad_logic(0)
+    c.calc(1)
+    scenario.verify(c.data.value == 2)
+    c.upgrad_logic(2).run(valid = False)
 
 sp.add_compilation_target("upgradable_target", Upgradable(sp.build_lambda(origin_logic)))
 sp.add_compilation_target("upgradable_trigger", UpgradContract(sp.address("KT1C58ssiuw2Y92kK5VwXhE9k69P9aqhtP1Q")))
\ No newline at end of file
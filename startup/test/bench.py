@@ -0,0 +1,57 @@
+import hashlib
+import os
+
+import smartpy as sp
+
+creation = sp.io.import_script_from_url("file:startup/contracts/creation.py")
+inheritance = sp.io.import_script_from_url("file:startup/contracts/inheritance.py")
+multisig = sp.io.import_script_from_url("file:startup/contracts/multisig_lambda.py")
+store = sp.io.import_script_from_url("file:startup/contracts/store.py")
+syntax = sp.io.import_script_from_url("file:startup/contracts/syntax.py")
+upgradable = sp.io.import_script_from_url("file:startup/contracts/upgradable.py")
+
+# Storage sizes of the benchmark targets, set by tools/bench.py
+SIZES = [int(size) for size in os.environ.get("BENCH_SIZES", "1,100,1000,10000").split(",")]
+
+# bootstrap2 and bootstrap3 of the octez mockup, they make the calls
+BOOTSTRAP2 = sp.address("tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN")
+BOOTSTRAP3 = sp.address("tz1faswCTDciRzE4oJ9jn2Vm2dvjeyA9fUzU")
+
+B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+
+def address(i):
+    """
+    a valid tz1 address derived from i, sp.test_account is too slow to
+    create thousands of members
+    """
+    payload = bytes([6, 161, 159]) + hashlib.blake2b(str(i).encode(), digest_size = 20).digest()
+    n = int.from_bytes(payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4], "big")
+    result = ""
+    while n:
+        n, r = divmod(n, 58)
+        result = B58[r] + result
+    return sp.address(result)
+
+sp.add_compilation_target("bench_store", store.StoreContract(1))
+sp.add_compilation_target("bench_descendant", inheritance.Descendant())
+sp.add_compilation_target("bench_upgradable", upgradable.Upgradable(sp.build_lambda(upgradable.origin_logic)))
+sp.add_compilation_target("bench_creator", creation.Creator(sp.none))
+
+for size in SIZES:
+    members = [address(i) for i in range(size)] + [BOOTSTRAP2, BOOTSTRAP3]
+    sp.add_compilation_target(
+        "bench_multisig_%d" % size,
+        multisig.MultisigLambda(members, required_votes = 2)
+    )
+    sp.add_compilation_target(
+        "bench_counted_multisig_%d" % size,
+        multisig.CountedMultisigLambda(members, required_votes = 2)
+    )
+    sp.add_compilation_target(
+        "bench_weighted_multisig_%d" % size,
+        multisig.WeightedMultisigLambda({member: 1 for member in members}, required_votes = 2)
+    )
+
+    demo = syntax.SyntaxDemo(True, "abc", sp.bytes("0xaabb"), 7, toto = "ABC", acb = "toto", f = False)
+    demo.update_initial_storage(m = sp.map({i: 1 for i in range(size)}, tkey = sp.TInt, tvalue = sp.TInt))
+    sp.add_compilation_target("bench_syntax_%d" % size, demo)
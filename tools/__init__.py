@@ -0,0 +1,9 @@
+"""Development tools for the workshop contracts.
+
+Every tool is a module runnable from the repository root, for example
+``python3 -m tools.compare_layouts``.
+"""
+
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
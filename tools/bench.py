@@ -0,0 +1,263 @@
+"""Gas and storage benchmarks of every workshop contract.
+
+The targets of startup/test/bench.py and market/test/bench.py are compiled
+with their storage already holding 1, 100, 1k and 10k entries, originated in
+an octez mockup, then every entry point of the case is called once. For each
+call the report records the consumed gas, the storage size delta of the
+called contract and the size of the parameter in the operation.
+
+The run fails when a number exceeds the baseline, tools/bench_baseline.json,
+by more than the tolerance; the calls it has no numbers for are listed, to be
+recorded with --update-baseline:
+
+    python3 -m tools.bench --json bench.json --csv bench.csv
+    python3 -m tools.bench --update-baseline
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import tempfile
+from dataclasses import dataclass, field
+
+from tools import ROOT, octez, smartpy_cli
+
+SIZES = [1, 100, 1000, 10000]
+BASELINE = os.path.join(ROOT, "tools", "bench_baseline.json")
+METRICS = ["gas", "storage_delta", "param_bytes"]
+
+FA2_PLACEHOLDER = "KT1C58ssiuw2Y92kK5VwXhE9k69P9aqhtP1Q"
+LIST_FEE = 1000000
+PRICE = 2000000
+
+
+@dataclass
+class Call:
+    entrypoint: str
+    # formatted with `size`, `fa2` and the ids `n1`..`n3` following the
+    # prefilled ones, `ints` is the Michelson list 0 .. size - 1 and `pairs`
+    # the list of Pair i 15
+    arg: str = "Unit"
+    amount: int = 0
+    source: str = "bootstrap2"
+    label: str = None
+
+    @property
+    def name(self):
+        return self.label or self.entrypoint
+
+
+@dataclass
+class Case:
+    name: str
+    script: str
+    # the target name may contain {size}, otherwise one target serves all
+    # sizes and only the parameters grow
+    target: str
+    calls: list
+    sizes: list = field(default_factory=lambda: SIZES)
+    balance: int = 0
+
+
+MARKET_CALLS = [
+    Call("crerate_market_item", 'Pair "{fa2}" (Pair 0 %d)' % PRICE, amount=LIST_FEE),
+    Call("create_market_items",
+         '{{ Pair "{fa2}" (Pair 1 %d) ; Pair "{fa2}" (Pair 2 %d) }}' % (PRICE, PRICE),
+         amount=2 * LIST_FEE),
+    Call("create_market_sale", 'Pair "{fa2}" {n1}', amount=PRICE, source="bootstrap3"),
+    Call("create_market_sales", '{{ Pair "{fa2}" {n2} }}', amount=PRICE, source="bootstrap3"),
+    Call("delete_market_item", "{n3}"),
+    Call("withdraw"),
+]
+
+CASES = [
+    Case("Market", "market/test/bench.py", "bench_market_{size}", MARKET_CALLS),
+    Case("LazyMarket", "market/test/bench.py", "bench_market_lazy_{size}", MARKET_CALLS),
+    Case("MultisigLambda", "startup/test/bench.py", "bench_multisig_{size}", [
+        Call("submit_lambda", "{{ DROP ; NIL operation }}"),
+        Call("vote_lambda", "0", label="vote_lambda"),
+        Call("vote_lambda", "0", source="bootstrap3", label="vote_lambda_execute"),
+        Call("prune", "1"),
+    ]),
+    Case("CountedMultisigLambda", "startup/test/bench.py", "bench_counted_multisig_{size}", [
+        Call("submit_lambda", "{{ DROP ; NIL operation }}"),
+        Call("vote_lambda", "0", label="vote_lambda"),
+        Call("vote_lambda", "0", source="bootstrap3", label="vote_lambda_execute"),
+        Call("clear_voters", '{{ Pair 0 "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN" }}'),
+        Call("prune", "1"),
+    ]),
+    Case("WeightedMultisigLambda", "startup/test/bench.py", "bench_weighted_multisig_{size}", [
+        Call("submit_lambda", "{{ DROP ; NIL operation }}"),
+        Call("vote_lambda", "0", label="vote_lambda"),
+        Call("vote_lambda", "0", source="bootstrap3", label="vote_lambda_execute"),
+        Call("prune", "1"),
+    ]),
+    Case("Upgradable", "startup/test/bench.py", "bench_upgradable", [
+        Call("calc", "1"),
+        Call("register_logic", "Pair 1 {{ PUSH nat 2 ; ADD }}"),
+        Call("upgrad_logic", "1"),
+        Call("calc", "1", label="calc_upgraded"),
+    ], sizes=[1]),
+    Case("Creator", "startup/test/bench.py", "bench_creator", [
+        Call("create1"),
+        Call("create2"),
+        Call("create4", "{ints}"),
+        Call("create_batch", "{pairs}"),
+        Call("create5"),
+        Call("create_op"),
+    ], sizes=[1, 100], balance=10000000),
+    Case("Descendant", "startup/test/bench.py", "bench_descendant", [
+        Call("add_x", "1"),
+        Call("mul_y"),
+        Call("double_t"),
+        Call("set_t", "3"),
+    ], sizes=[1]),
+    Case("StoreContract", "startup/test/bench.py", "bench_store", [
+        Call("store", "2"),
+    ], sizes=[1]),
+    Case("SyntaxDemo", "startup/test/bench.py", "bench_syntax_{size}", [
+        Call("someComputations", 'Pair "abcd" 12'),
+        Call("localVariable"),
+        Call("iterations"),
+        Call("myMessageName4"),
+        Call("myMessageName5"),
+        Call("myMessageName6", "-18"),
+    ]),
+]
+
+
+def call_fields(size, fa2):
+    """The fields the Call arguments are formatted with."""
+    return {
+        "size": size, "fa2": fa2, "n1": size + 1, "n2": size + 2, "n3": size + 3,
+        "ints": "{ %s }" % " ; ".join(str(i) for i in range(size)),
+        "pairs": "{ %s }" % " ; ".join("Pair %d 15" % i for i in range(size)),
+    }
+
+
+def run_case(mockup, output_dir, case, size, fa2):
+    code, storage = smartpy_cli.compiled(output_dir, case.target.format(size=size))
+    with open(storage) as f:
+        address, origination = mockup.originate(
+            "%s_%d" % (case.name, size), code,
+            f.read().replace(FA2_PLACEHOLDER, fa2), balance=case.balance,
+        )
+    fields = call_fields(size, fa2)
+    rows = []
+    storage_size = origination.storage_size
+    for call in case.calls:
+        arg = call.arg.format(**fields)
+        row = {"contract": case.name, "size": size, "call": call.name}
+        try:
+            receipt = mockup.call(address, call.entrypoint, arg, amount=call.amount, source=call.source)
+        except octez.OctezError as e:
+            row["error"] = str(e).splitlines()[0]
+        else:
+            row.update(
+                gas=receipt.consumed_gas,
+                storage_delta=receipt.storage_size - storage_size,
+                param_bytes=mockup.data_size(arg),
+            )
+            storage_size = receipt.storage_size
+        rows.append(row)
+    return rows
+
+
+def run(cases, sizes):
+    rows = []
+    with tempfile.TemporaryDirectory() as output_dir, octez.Mockup() as mockup:
+        os.environ["BENCH_SIZES"] = ",".join(str(size) for size in sizes)
+        for script in sorted({case.script for case in cases}):
+            smartpy_cli.compile(script, output_dir)
+        fa2 = ""
+        if any(case.script.startswith("market/") for case in cases):
+            code, storage = smartpy_cli.compiled(output_dir, "mock_fa2")
+            with open(storage) as f:
+                fa2, _ = mockup.originate("mock_fa2", code, f.read())
+        for case in cases:
+            for size in case.sizes:
+                if size in sizes:
+                    print("%s at %d entries" % (case.name, size), file=sys.stderr)
+                    rows += run_case(mockup, output_dir, case, size, fa2)
+    return rows
+
+
+def key(row):
+    return "%s/%d/%s" % (row["contract"], row["size"], row["call"])
+
+
+def regressions(rows, baseline, tolerance):
+    """Return a message for every number above its baseline."""
+    found = []
+    for row in rows:
+        expected = baseline.get(key(row))
+        if expected is None or "error" in row:
+            continue
+        for metric in METRICS:
+            limit = expected[metric] + abs(expected[metric]) * tolerance
+            if row[metric] > limit:
+                found.append("%s %s: %s > baseline %s" % (key(row), metric, row[metric], expected[metric]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contract", action="append", help="only run these cases")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)))
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--csv", help="write the results to this file")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.02,
+                        help="allowed relative increase over the baseline")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in CASES if not args.contract or case.name in args.contract]
+    rows = run(cases, [int(size) for size in args.sizes.split(",")])
+
+    for row in rows:
+        if "error" in row:
+            print("%-40s FAILED %s" % (key(row), row["error"]))
+        else:
+            print("%-40s gas %10.1f  storage %+6d  param %5d"
+                  % (key(row), row["gas"], row["storage_delta"], row["param_bytes"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, ["contract", "size", "call"] + METRICS + ["error"])
+            writer.writeheader()
+            writer.writerows(rows)
+
+    failed = [row for row in rows if "error" in row]
+    if args.update_baseline:
+        if failed:
+            sys.exit("not updating the baseline, %d calls failed" % len(failed))
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update({key(row): {metric: row[metric] for metric in METRICS} for row in rows})
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return
+
+    if not os.path.exists(args.baseline):
+        sys.exit("no baseline at %s, run with --update-baseline" % args.baseline)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    found = regressions(rows, baseline, args.tolerance)
+    for row in rows:
+        if "error" not in row and key(row) not in baseline:
+            print("NO BASELINE " + key(row), file=sys.stderr)
+    for message in found:
+        print("REGRESSION " + message, file=sys.stderr)
+    if found or failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
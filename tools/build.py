@@ -0,0 +1,198 @@
+"""Compile every compilation target of startup/ and market/.
+
+A script is compiled again only when it, a script it imports, or the flags
+changed since its targets were written to ``<project>/compilation``. Stale
+scripts are compiled in parallel, or restored from the tools.cache cache when
+it already holds their outputs.
+
+With ``--compact-errors`` the scripts are compiled with numeric error codes
+(see tools.error_codes) into ``<project>/compilation/compact``, next to the
+code -> message mapping, and the bytes saved per contract are reported
+against the regular build.
+
+With ``--gas-budget`` the build fails when an entry point is estimated above
+the budget of ``tools/gas_budget.json`` by tools.gas_bounds.
+
+    python3 -m tools.build [--jobs N] [--force] [--no-cache] [--compact-errors] [--gas-budget] [script ...]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+
+from tools import ROOT, cache, error_codes, gas_bounds, smartpy_cli, targets
+
+STATE = ".build-state.json"
+
+
+def read_state(directory):
+    path = os.path.join(ROOT, directory, STATE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(directory, state):
+    with open(os.path.join(ROOT, directory, STATE), "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def output_dir(script, compact_errors=False):
+    if compact_errors:
+        return os.path.join(script.compilation_dir, "compact")
+    return script.compilation_dir
+
+
+def up_to_date(script, directory, key, state):
+    entry = state.get(script.path)
+    return (
+        entry is not None
+        and entry["digest"] == key
+        and all(
+            os.path.exists(smartpy_cli.compiled(os.path.join(ROOT, directory), target)[0])
+            for target in script.targets
+        )
+    )
+
+
+def compile_script(script, directory, flags, cache_dir, cwd=ROOT, variant=""):
+    start = time.monotonic()
+    hit, error = False, None
+    try:
+        _, hit = cache.run(
+            "compile", script, directory, flags,
+            cache.Cache(cache_dir) if cache_dir else None,
+            cwd=cwd, variant=variant,
+        )
+    except smartpy_cli.SmartPyError as e:
+        error = str(e)
+    return time.monotonic() - start, hit, error
+
+
+def build(scripts, jobs=None, force=False, flags=(), cache_dir=cache.DEFAULT_DIR, compact_errors=False):
+    """Compile the stale ``scripts``, return False if any of them failed."""
+    with tempfile.TemporaryDirectory() as tree:
+        cwd, variant = ROOT, ""
+        if compact_errors:
+            codes = compact_codes(scripts)
+            error_codes.mirror(tree, codes)
+            cwd, variant = tree, json.dumps(codes, sort_keys=True)
+        return compile_all(scripts, jobs, force, flags, cache_dir, compact_errors, cwd, variant)
+
+
+def compile_all(scripts, jobs, force, flags, cache_dir, compact_errors, cwd, variant, log=print, pool=None):
+    """Compile the stale ``scripts`` in ``pool``, a new one by default, and
+    ``log`` a line per script."""
+    directories = {s.path: output_dir(s, compact_errors) for s in scripts}
+    states = {d: read_state(d) for d in directories.values()}
+    stale = []
+    for script in scripts:
+        directory = directories[script.path]
+        os.makedirs(os.path.join(ROOT, directory), exist_ok=True)
+        key = targets.digest(script.path, *flags, *([variant] if variant else []))
+        if force or not up_to_date(script, directory, key, states[directory]):
+            stale.append((script, key))
+        else:
+            log("%-45s up to date" % script.path)
+
+    ok = True
+    with nullcontext(pool) if pool else ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(
+                compile_script, script, directories[script.path], flags, cache_dir, cwd, variant
+            ): (script, key)
+            for script, key in stale
+        }
+        for future in as_completed(futures):
+            script, key = futures[future]
+            seconds, hit, error = future.result()
+            if error:
+                ok = False
+                log("%-45s FAILED in %.1fs\n%s" % (script.path, seconds, error))
+                continue
+            log("%-45s %.1fs%s  %s" % (
+                script.path, seconds, " (cached)" if hit else "", ", ".join(script.targets)))
+            directory = directories[script.path]
+            states[directory][script.path] = {"digest": key, "targets": sorted(script.targets)}
+            write_state(directory, states[directory])
+    return ok
+
+
+def compact_codes(scripts):
+    """Return the error codes of every script, keeping those of the mapping
+    files already written, and write the updated mapping next to the compact
+    outputs of every project."""
+    paths = [
+        os.path.join(ROOT, project, "compilation", "compact", error_codes.MAPPING)
+        for project in sorted({s.project for s in scripts})
+    ]
+    previous = {}
+    for path in paths:
+        previous.update(error_codes.read_mapping(path))
+    codes = error_codes.assign(error_codes.read_scripts().values(), previous)
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        error_codes.write_mapping(path, codes)
+    return codes
+
+
+def report_savings(scripts):
+    """Print the bytes saved by the compact error codes per contract, for
+    the targets also built without them."""
+    for script in scripts:
+        for target in sorted(script.targets):
+            regular = os.path.join(ROOT, output_dir(script))
+            compact = os.path.join(ROOT, output_dir(script, True))
+            if not os.path.exists(smartpy_cli.compiled(regular, target)[0]):
+                print("%-45s %-30s not built without --compact-errors" % (script.path, target))
+                continue
+            before = smartpy_cli.contract_size(regular, target)
+            after = smartpy_cli.contract_size(compact, target)
+            print("%-45s %-30s %7d -> %7d bytes, %5d saved" % (
+                script.path, target, before, after, before - after))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scripts", nargs="*", help="only build these scripts")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--force", action="store_true", help="compile even up to date scripts")
+    parser.add_argument("--no-cache", action="store_true", help="always run the compiler")
+    parser.add_argument("--compact-errors", action="store_true", help="replace error messages by codes")
+    parser.add_argument("--gas-budget", nargs="?", const=gas_bounds.BUDGET,
+                        help="fail when an entry point is estimated above this budget file")
+    args = parser.parse_args(argv)
+
+    scripts = [
+        s for s in targets.scripts()
+        if s.targets and (not args.scripts or s.path in args.scripts)
+    ]
+    start = time.monotonic()
+    ok = build(
+        scripts, jobs=args.jobs, force=args.force,
+        cache_dir=None if args.no_cache else cache.DEFAULT_DIR,
+        compact_errors=args.compact_errors,
+    )
+    print("built in %.1fs" % (time.monotonic() - start))
+    if args.compact_errors and ok:
+        report_savings(scripts)
+    if args.gas_budget and ok:
+        failures = gas_bounds.check(
+            scripts, gas_bounds.read_budget(args.gas_budget),
+            {s.path: output_dir(s, args.compact_errors) for s in scripts},
+        )
+        for failure in failures:
+            print("OVER BUDGET " + failure)
+        ok = not failures
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Content-addressed cache of SmartPy compile and test outputs.
+
+An entry is keyed by the command, the digest of the script and its imports,
+the SmartPy CLI version, the flags and the sp.add_compilation_target calls,
+which hold the constructor arguments. It stores the whole output directory
+and the printed output; only successful runs are stored. Entries are evicted
+least recently used first once the cache exceeds its size.
+
+    python3 -m tools.cache test [script ...] [--no-cache]
+    python3 -m tools.cache stats
+    python3 -m tools.cache clear
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from tools import ROOT, smartpy_cli, targets
+
+DEFAULT_DIR = os.environ.get("TEZ_WORKSHOP_CACHE", os.path.expanduser("~/.cache/tez-workshop"))
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def tree_size(path):
+    return sum(
+        os.path.getsize(os.path.join(directory, name))
+        for directory, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class Cache:
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, command, script, flags=(), variant=""):
+        h = hashlib.sha256()
+        for part in [
+            command,
+            variant,
+            targets.digest(script.path),
+            smartpy_cli.version(),
+            json.dumps(list(flags)),
+            json.dumps(script.targets, sort_keys=True),
+        ]:
+            h.update(part.encode() + b"\0")
+        return h.hexdigest()
+
+    def entries(self):
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if not name.startswith(".")
+        ]
+
+    def get(self, key):
+        """Return the entry directory of ``key``, or None on a miss."""
+        entry = os.path.join(self.directory, key)
+        if not os.path.exists(os.path.join(entry, "meta.json")):
+            return None
+        os.utime(entry)
+        return entry
+
+    def put(self, key, output_dir, meta):
+        entry = os.path.join(self.directory, key)
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        shutil.copytree(output_dir, os.path.join(tmp, "out"))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp, entry)
+        self.evict()
+
+    def evict(self):
+        entries = sorted(
+            ((os.path.getmtime(e), e, tree_size(e)) for e in self.entries()),
+            reverse=True,
+        )
+        total = 0
+        for _, entry, size in entries:
+            total += size
+            if total > self.max_bytes:
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def clear(self):
+        for entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def run(command, script, output_dir, flags=(), cache=None, cwd=ROOT, variant=""):
+    """Run ``SmartPy.sh <command>`` on ``script`` into ``output_dir`` through
+    ``cache``, return (printed output, cache hit). A script run from another
+    ``cwd`` than the repository is cached under its ``variant``."""
+    output_dir = os.path.join(ROOT, output_dir)
+    if cache is None:
+        return smartpy_cli.run(command, script.path, output_dir, *flags, cwd=cwd), False
+    key = cache.key(command, script, flags, variant)
+    entry = cache.get(key)
+    if entry is not None:
+        shutil.copytree(os.path.join(entry, "out"), output_dir, dirs_exist_ok=True)
+        with open(os.path.join(entry, "meta.json")) as f:
+            return json.load(f)["output"], True
+    with tempfile.TemporaryDirectory() as tmp:
+        output = smartpy_cli.run(command, script.path, tmp, *flags, cwd=cwd)
+        shutil.copytree(tmp, output_dir, dirs_exist_ok=True)
+        cache.put(key, tmp, {"output": output, "script": script.path, "command": command})
+    return output, False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["test", "stats", "clear"])
+    parser.add_argument("scripts", nargs="*", help="scripts to test, all by default")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--cache-dir", default=DEFAULT_DIR)
+    args = parser.parse_args(argv)
+
+    cache = Cache(args.cache_dir)
+    if args.command == "stats":
+        entries = cache.entries()
+        print("%d entries, %d bytes in %s" % (len(entries), sum(map(tree_size, entries)), cache.directory))
+    elif args.command == "clear":
+        cache.clear()
+    else:
+        failed = False
+        for script in targets.scripts():
+            if not script.tests or (args.scripts and script.path not in args.scripts):
+                continue
+            try:
+                _, hit = run("test", script, script.test_dir, cache=None if args.no_cache else cache)
+                print("%-45s ok%s" % (script.path, " (cached)" if hit else ""))
+            except smartpy_cli.SmartPyError as e:
+                failed = True
+                print("%-45s FAILED\n%s" % (script.path, e))
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
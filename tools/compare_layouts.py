@@ -0,0 +1,96 @@
+"""Compare the gas and storage cost of the Market, CompactMarket and LazyMarket
+layouts.
+
+The layouts are compiled from market/test/layout_comparison.py, originated in
+an octez mockup next to a mock FA2, loaded with the same listings, then a
+share of the items is sold and delisted. The report gives, per layout and
+entry point, the gas per call and the storage bytes paid per call.
+
+    python3 -m tools.compare_layouts --items 1000 --json layouts.json
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+
+from tools import octez, smartpy_cli
+
+SCRIPT = "market/test/layout_comparison.py"
+LAYOUTS = ["layout_market_full", "layout_market_compact", "layout_market_lazy"]
+LIST_FEE = 1000000
+PRICE = 2000000
+
+
+def summarize(receipts):
+    gas = [r.consumed_gas for r in receipts]
+    return {
+        "calls": len(receipts),
+        "gas_mean": statistics.mean(gas),
+        "gas_max": max(gas),
+        "paid_bytes_mean": statistics.mean(r.paid_storage_size_diff for r in receipts),
+    }
+
+
+def measure(mockup, output_dir, layout, token, items, sold):
+    code, storage = smartpy_cli.compiled(output_dir, layout)
+    with open(storage) as f:
+        address, origination = mockup.originate(layout, code, f.read())
+    calls = {"crerate_market_item": [], "create_market_sale": [], "delete_market_item": []}
+    for token_id in range(items):
+        calls["crerate_market_item"].append(mockup.call(
+            address, "crerate_market_item",
+            'Pair "%s" (Pair %d %d)' % (token, token_id, PRICE),
+            amount=LIST_FEE, source="bootstrap2",
+        ))
+    # item ids start at 1
+    for item_id in range(1, sold + 1):
+        calls["create_market_sale"].append(mockup.call(
+            address, "create_market_sale", 'Pair "%s" %d' % (token, item_id),
+            amount=PRICE, source="bootstrap3",
+        ))
+    for item_id in range(sold + 1, 2 * sold + 1):
+        calls["delete_market_item"].append(mockup.call(
+            address, "delete_market_item", str(item_id), source="bootstrap2",
+        ))
+    final_size = mockup.call(address, "crerate_market_item",
+                             'Pair "%s" (Pair %d %d)' % (token, items, PRICE),
+                             amount=LIST_FEE).storage_size
+    return {
+        "origination_bytes": origination.storage_size,
+        "bytes_per_item": (final_size - origination.storage_size) / (items + 1),
+        "entry_points": {name: summarize(r) for name, r in calls.items() if r},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--sold", type=int, default=50, help="items sold, as many are delisted")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        smartpy_cli.compile(SCRIPT, output_dir)
+        with octez.Mockup() as mockup:
+            fa2_code, fa2_storage = smartpy_cli.compiled(output_dir, "mock_fa2")
+            with open(fa2_storage) as f:
+                token, _ = mockup.originate("mock_fa2", fa2_code, f.read())
+            report = {
+                layout: measure(mockup, output_dir, layout, token, args.items, args.sold)
+                for layout in LAYOUTS
+            }
+
+    for layout, result in report.items():
+        print("%s: %d bytes at origination, %.1f bytes per item"
+              % (layout, result["origination_bytes"], result["bytes_per_item"]))
+        for name, stats in result["entry_points"].items():
+            print("  %-22s %5d calls  gas mean %9.1f  max %9.1f  paid bytes %6.1f"
+                  % (name, stats["calls"], stats["gas_mean"], stats["gas_max"], stats["paid_bytes_mean"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""Keep a compiler server running for the edit-compile-test loop.
+
+The SmartPy CLI has no resident mode, each ``SmartPy.sh`` run loads its
+runtime again. The server keeps everything around it loaded instead: a pool
+of workers with the tools imported and the CLI version known, the
+tools.cache cache and the build states, so that a request only runs
+SmartPy.sh for the scripts whose sources changed, and answers the others at
+once. Requests are read from a Unix socket:
+
+    python3 -m tools.daemon serve [--watch] &
+    python3 -m tools.daemon compile [script ...] [--force]
+    python3 -m tools.daemon test [script ...]
+    python3 -m tools.daemon stop
+
+With ``--watch`` the server also compiles again, as soon as a file under
+startup/contracts or market/contracts changes, the scripts whose targets
+depend on it.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tools import ROOT, build, cache, scenarios, smartpy_cli, targets
+
+SOCKET = os.path.join(ROOT, ".compiler.sock")
+WATCHED = ["startup/contracts", "market/contracts"]
+WATCH_INTERVAL = 0.2
+
+
+def warm_up():
+    # loads the tools in the worker and caches the CLI version cache keys use
+    smartpy_cli.version()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, jobs, cache_dir):
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, Handler)
+        self.jobs = jobs
+        self.cache_dir = cache_dir
+        self.pool = ProcessPoolExecutor(max_workers=jobs)
+        for future in [self.pool.submit(warm_up) for _ in range(jobs)]:
+            future.result()
+        # the build and test states are read and written by one request at
+        # a time
+        self.lock = threading.Lock()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+    def compile(self, paths=(), force=False, log=print):
+        scripts = [s for s in targets.scripts() if s.targets and (not paths or s.path in paths)]
+        with self.lock:
+            return build.compile_all(
+                scripts, self.jobs, force, (), self.cache_dir, False, ROOT, "", log=log, pool=self.pool)
+
+    def test(self, paths=(), log=print):
+        scripts = [
+            s for s in targets.scripts(kinds=("contracts", "test"))
+            if s.tests and (not paths or s.path in paths)
+        ]
+        ok = True
+        with self.lock:
+            futures = {self.pool.submit(scenarios.run_script, s, self.cache_dir): s for s in scripts}
+            for future in as_completed(futures):
+                script = futures[future]
+                seconds, hit, error = future.result()
+                ok = ok and error is None
+                log("%-45s %s in %.1fs%s  %s" % (
+                    script.path, "FAILED" if error else "ok", seconds,
+                    " (cached)" if hit else "", ", ".join(script.tests)))
+                if error:
+                    log(error)
+        return ok
+
+    def watch(self):
+        """Compile the stale scripts whenever a watched file changes."""
+        mtimes = watched_mtimes()
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            current = watched_mtimes()
+            if current == mtimes:
+                continue
+            changed = sorted(path for path in set(current) | set(mtimes) if current.get(path) != mtimes.get(path))
+            mtimes = current
+            print("changed: %s" % ", ".join(changed))
+            start = time.monotonic()
+            ok = self.compile(log=lambda line: None if line.endswith("up to date") else print(line))
+            print("%s in %.2fs" % ("compiled" if ok else "FAILED", time.monotonic() - start))
+
+
+def watched_mtimes():
+    mtimes = {}
+    for directory in WATCHED:
+        for name in os.listdir(os.path.join(ROOT, directory)):
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                mtimes[path] = os.stat(os.path.join(ROOT, path)).st_mtime_ns
+    return mtimes
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+
+        def log(line):
+            self.send({"line": line})
+
+        command = request["command"]
+        if command == "compile":
+            ok = self.server.compile(request.get("scripts"), request.get("force", False), log)
+        elif command == "test":
+            ok = self.server.test(request.get("scripts"), log)
+        elif command == "stop":
+            ok = True
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            log("unknown command %s" % command)
+            ok = False
+        self.send({"ok": ok})
+
+    def send(self, message):
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+
+def request(path, message):
+    """Send ``message`` to the server at ``path``, print its lines and
+    return whether it succeeded."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(path)
+        client.sendall(json.dumps(message).encode() + b"\n")
+        for line in client.makefile():
+            reply = json.loads(line)
+            if "line" in reply:
+                print(reply["line"])
+            else:
+                return reply["ok"]
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["serve", "compile", "test", "stop"])
+    parser.add_argument("scripts", nargs="*", help="only these scripts")
+    parser.add_argument("--socket", default=SOCKET)
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--no-cache", action="store_true", help="always run the compiler")
+    parser.add_argument("--watch", action="store_true", help="compile the changed contracts")
+    parser.add_argument("--force", action="store_true", help="compile even up to date scripts")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = Server(args.socket, args.jobs, None if args.no_cache else cache.DEFAULT_DIR)
+        print("listening on %s" % args.socket)
+        if args.watch:
+            threading.Thread(target=server.watch, daemon=True).start()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+
+    try:
+        ok = request(args.socket, {"command": args.command, "scripts": args.scripts, "force": args.force})
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.exit("no server on %s, start one with `python3 -m tools.daemon serve`" % args.socket)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
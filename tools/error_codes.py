@@ -0,0 +1,140 @@
+"""Replace the error messages of the contracts with numeric codes.
+
+Every string message of ``sp.verify``, ``sp.failwith`` and ``open_some`` in
+the workshop scripts is given a code, and an ``sp.verify`` without message,
+which SmartPy fails with the text of its condition, gets one too. The
+rewritten scripts are written to a mirror of the repository, with the same
+paths so that their imports resolve, which ``tools.build --compact-errors``
+compiles into ``<project>/compilation/compact``. Codes are kept from the
+previous mapping and never reused: the messages no longer found stay in the
+mapping, so that the contracts originated with them still decode, and new
+messages get codes above every code assigned so far.
+
+    python3 -m tools.error_codes [--mapping error_codes.json]
+"""
+
+import argparse
+import ast
+import json
+import os
+import re
+
+from tools import ROOT, targets
+
+MAPPING = "error_codes.json"
+
+# SmartPy's own statements, `sp.for x in l:`, are not Python
+STATEMENT = re.compile(r"^(\s*)sp\.(for|if|elif|else|while)\b", re.MULTILINE)
+
+
+def parse(text):
+    """Parse ``text`` as Python, the SmartPy statements turned into the
+    Python ones at the same offsets."""
+    return ast.parse(STATEMENT.sub(lambda m: m.group(1) + m.group(2) + "   ", text))
+
+
+def messages(text):
+    """Yield (start, end, message) for every message of ``text``: the
+    message literal to replace, or the empty span before the closing
+    parenthesis of an ``sp.verify`` without message. Offsets index the UTF-8
+    encoded text, as the ast ones do."""
+    lines = text.encode().splitlines(keepends=True)
+    starts = [0]
+    for line in lines:
+        starts.append(starts[-1] + len(line))
+
+    def offset(lineno, col):
+        return starts[lineno - 1] + col
+
+    for node in ast.walk(parse(text)):
+        if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Attribute):
+            continue
+        name = node.func.attr
+        position = {"verify": 1, "failwith": 0, "open_some": 0}.get(name)
+        if position is None:
+            continue
+        # scenario.verify is checked by the test interpreter, not compiled
+        if name != "open_some" and getattr(node.func.value, "id", None) != "sp":
+            continue
+        message = node.args[position] if len(node.args) > position else None
+        for keyword in node.keywords:
+            if keyword.arg == "message":
+                message = keyword.value
+        if isinstance(message, ast.Constant) and isinstance(message.value, str):
+            yield (offset(message.lineno, message.col_offset),
+                   offset(message.end_lineno, message.end_col_offset),
+                   message.value)
+        elif message is None and name == "verify" and len(node.args) == 1:
+            condition = ast.get_source_segment(text, node.args[0])
+            end = offset(node.end_lineno, node.end_col_offset) - 1
+            yield end, end, "WrongCondition: %s" % condition
+
+
+def transform(text, codes):
+    """Return ``text`` with every message replaced by its code in
+    ``codes``."""
+    data = text.encode()
+    for start, end, message in sorted(messages(text), reverse=True):
+        code = str(codes[message]).encode()
+        data = data[:start] + (code if start != end else b", " + code) + data[end:]
+    return data.decode()
+
+
+def read_scripts():
+    """Return {path: text} of every workshop script."""
+    scripts = {}
+    for script in targets.scripts(kinds=("contracts", "test")):
+        with open(os.path.join(ROOT, script.path)) as f:
+            scripts[script.path] = f.read()
+    return scripts
+
+
+def assign(texts, previous=None):
+    """Return {message: code} for the messages of ``texts`` and those of
+    ``previous``, whose codes are kept."""
+    codes = dict(previous or {})
+    found = sorted({message for text in texts for _, _, message in messages(text)})
+    for message in found:
+        if message not in codes:
+            codes[message] = max(codes.values(), default=0) + 1
+    return codes
+
+
+def read_mapping(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {message: int(code) for code, message in json.load(f).items()}
+
+
+def write_mapping(path, codes):
+    """Write the code -> message mapping clients use to decode failures."""
+    with open(path, "w") as f:
+        json.dump({str(code): message for message, code in sorted(codes.items(), key=lambda c: c[1])},
+                  f, indent=2)
+
+
+def mirror(directory, codes, scripts=None):
+    """Write every script, its messages replaced by ``codes``, under
+    ``directory`` at its path in the repository."""
+    for path, text in (scripts or read_scripts()).items():
+        target = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "w") as f:
+            f.write(transform(text, codes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mapping", help="write the code -> message mapping to this file")
+    args = parser.parse_args(argv)
+
+    codes = assign(read_scripts().values(), read_mapping(args.mapping) if args.mapping else None)
+    for message, code in sorted(codes.items(), key=lambda c: c[1]):
+        print("%4d  %s" % (code, message))
+    if args.mapping:
+        write_mapping(args.mapping, codes)
+
+
+if __name__ == "__main__":
+    main()
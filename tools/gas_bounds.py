@@ -0,0 +1,395 @@
+"""Static worst-case gas of the compiled entry points.
+
+Every ``ITER``, ``MAP``, ``LOOP`` and ``LOOP_LEFT`` of the compiled targets
+is bounded by what the SmartPy command it comes from iterates over: a storage
+field (``self.data.active_items.elements()``), the parameter (``sp.for x in
+params``), a local or a constant range. The cost of an entry point is then a
+polynomial of those sizes, such as ``1000 + 2*active_items + 0.6*params``,
+the elements of the sets, maps and lists of the storage, which every call
+decodes, being first-degree terms.
+
+Instruction costs are coarse, in gas, meant to find which entry points grow
+with the state and how fast rather than to predict a receipt, see
+tools.gas_profile for measured ones. The estimates at the sizes declared in
+``tools/gas_budget.json`` are checked against its budget; the run, or
+``tools.build --gas-budget``, fails when an entry point exceeds it:
+
+    python3 -m tools.gas_bounds [--budget tools/gas_budget.json] [target ...]
+
+Off-chain views are read from the TZIP-16 metadata SmartPy writes next to
+the contract, for the views listed in ``self.init_metadata``, and reported
+as ``offchain:<name>``. Their Micheline has no SmartPy comments, so their
+loops are named ``offchain:<name>:loop``. They are checked against the same
+budget, the gas limit of the ``run_code`` that evaluates them.
+"""
+
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+
+from tools import ROOT, gas_profile, smartpy_cli, targets, views
+
+BUDGET = os.path.join(ROOT, "tools", "gas_budget.json")
+
+# gas of a call before its code runs: the manager operation and the script
+# decoding
+BASE = 1000
+DEFAULT_COST = 0.05
+COSTS = {
+    "GET": 0.5, "MEM": 0.5, "UPDATE": 0.5, "GET_AND_UPDATE": 0.5,
+    "CONTRACT": 10, "TRANSFER_TOKENS": 1, "CREATE_CONTRACT": 30, "SET_DELEGATE": 1,
+    "EXEC": 0.5, "PACK": 1, "UNPACK": 1, "CHECK_SIGNATURE": 5,
+    "SHA256": 0.5, "SHA512": 0.5, "BLAKE2B": 0.5, "KECCAK": 0.5, "SHA3": 0.5,
+    "CONCAT": 0.2, "SIZE": 0.1, "SLICE": 0.2,
+}
+# decoding an element of a set, map or list of the storage
+STORAGE_ELEMENT = 2
+LOOPS = ("ITER", "MAP", "LOOP", "LOOP_LEFT")
+BRANCHES = ("IF", "IF_LEFT", "IF_NONE", "IF_CONS")
+# their code is not run where it is written
+NOT_RUN = ("LAMBDA", "LAMBDA_REC", "CREATE_CONTRACT", "PUSH")
+
+STORAGE_FIELD = re.compile(r"self\.data\.(\w+)")
+PARAMETER = re.compile(r"\bparams((?:\.\w+)*)")
+ITERATED = re.compile(r"for \w+ in (.*?):?\s*(?:\.\.\.)?$")
+# the end of a range, the bound of its loop
+RANGE_END = re.compile(r"range\([^,]*,\s*([^,)]*)")
+NAME = re.compile(r"[A-Za-z_]\w*")
+
+
+class Node:
+    def __init__(self, prim, entry_point, command):
+        self.prim = prim
+        self.args = []
+        self.annots = []
+        self.entry_point = entry_point
+        self.command = command
+
+
+def parse(text):
+    """Parse the Michelson script ``text`` to its toplevel sections, every
+    instruction a Node with the entry point and SmartPy command of the
+    comments above it, the sequences lists and the literals strings."""
+    tokens = gas_profile.TOKEN.findall(text)
+    position = 0
+    entry_point = command = None
+    scopes = []
+    line_start = True
+
+    def peek():
+        """The next token, after the comments, which update the context."""
+        nonlocal position, entry_point, command, line_start
+        while position < len(tokens):
+            token = tokens[position]
+            if token == "\n":
+                line_start = True
+            elif token.startswith("#"):
+                marker = gas_profile.ENTRY_POINT.match(token)
+                if marker:
+                    entry_point, command = marker.group(1), None
+                elif line_start:
+                    command = token[1:].split(" # ")[0].strip()
+            else:
+                return token
+            position += 1
+        return None
+
+    def take():
+        nonlocal position, line_start, entry_point, command
+        token = peek()
+        position += 1
+        line_start = False
+        if token == "{":
+            scopes.append((entry_point, command))
+        elif token == "}":
+            entry_point, command = scopes.pop()
+        return token
+
+    def sequence(end):
+        items = []
+        while peek() not in (end, None):
+            if peek() == ";":
+                take()
+                continue
+            items.append(expression())
+        take()
+        return items
+
+    def atom():
+        token = take()
+        if token == "(":
+            node = expression()
+            take()
+            return node
+        if token == "{":
+            return sequence("}")
+        if token[0].isalpha():
+            return Node(token, entry_point, command)
+        return token
+
+    def expression():
+        node = atom()
+        if isinstance(node, Node):
+            while peek() not in (";", "}", ")", None):
+                if peek()[0] in "%@:":
+                    node.annots.append(take())
+                else:
+                    node.args.append(atom())
+        return node
+
+    return sequence(None)
+
+
+def from_micheline(node):
+    """The Node tree of the Micheline JSON ``node``, the literals strings."""
+    if isinstance(node, list):
+        return [from_micheline(item) for item in node]
+    if "prim" not in node:
+        return json.dumps(next(iter(node.values())))
+    result = Node(node["prim"], None, None)
+    result.args = [from_micheline(arg) for arg in node.get("args", [])]
+    result.annots = node.get("annots", [])
+    return result
+
+
+def section(script, name):
+    return next(node for node in script if isinstance(node, Node) and node.prim == name)
+
+
+# polynomials of the sizes: {sorted tuple of size names: coefficient}
+
+def add(p, q):
+    result = collections.Counter(p)
+    result.update(q)
+    return dict(result)
+
+
+def times(p, bound):
+    if isinstance(bound, int):
+        return {term: coefficient * bound for term, coefficient in p.items()}
+    return {tuple(sorted(term + (bound,))): coefficient for term, coefficient in p.items()}
+
+
+def upper(p, q):
+    """A polynomial above both ``p`` and ``q``."""
+    return {term: max(p.get(term, 0), q.get(term, 0)) for term in set(p) | set(q)}
+
+
+def evaluate(p, sizes, default):
+    total = 0
+    for term, coefficient in p.items():
+        for name in term:
+            coefficient *= sizes.get(name, default)
+        total += coefficient
+    return total
+
+
+def format_polynomial(p):
+    terms = sorted(p.items(), key=lambda t: (len(t[0]), t[0]))
+    return " + ".join(
+        "%g" % coefficient + "".join("*" + name for name in term)
+        for term, coefficient in terms if coefficient
+    ) or "0"
+
+
+class Loop:
+    def __init__(self, entry_point, command, bound, kind):
+        self.entry_point = entry_point
+        self.command = command
+        # a size name, or the number of iterations of a constant range
+        self.bound = bound
+        # storage, parameter, local, while or constant
+        self.kind = kind
+
+
+def loop_bound(node, entry_point):
+    """Return the bound and kind of the loop ``node``."""
+    command = node.command or ""
+    if command.startswith("while"):
+        field = STORAGE_FIELD.search(command)
+        return (field.group(1) if field else "%s:while" % entry_point), "while"
+    iterated = ITERATED.match(command)
+    if iterated is None:
+        return "%s:loop" % entry_point, "local"
+    expression = iterated.group(1)
+    end = RANGE_END.search(expression)
+    if end:
+        expression = end.group(1)
+        if re.fullmatch(r"\s*\d+\s*", expression):
+            return int(expression), "constant"
+    field = STORAGE_FIELD.search(expression)
+    if field:
+        return field.group(1), "storage"
+    parameter = PARAMETER.search(expression)
+    if parameter:
+        return "params" + parameter.group(1), "parameter"
+    name = NAME.search(expression)
+    return (name.group(0) if name else "%s:loop" % entry_point), "local"
+
+
+def cost(code, entry_point, loops, scope=None):
+    """Cost of ``code`` when ``entry_point`` is called, the loops it runs
+    appended to ``loops``. The instructions of the other entry points cost
+    nothing, those of none are shared by all. Loops without a name are named
+    after ``scope``, by default the entry point."""
+    if isinstance(code, list):
+        total = {}
+        for node in code:
+            total = add(total, cost(node, entry_point, loops, scope))
+        return total
+    if not isinstance(code, Node) or code.entry_point not in (None, entry_point):
+        return {}
+    if code.prim[0].islower():
+        return {}
+    if code.prim in NOT_RUN:
+        return {(): COSTS.get(code.prim, DEFAULT_COST)}
+    total = {(): COSTS.get(code.prim, DEFAULT_COST)}
+    bodies = [arg for arg in code.args if isinstance(arg, list)]
+    if code.prim in LOOPS and bodies:
+        bound, kind = loop_bound(code, scope or entry_point)
+        loops.append(Loop(entry_point, code.command, bound, kind))
+        total = add(total, times(cost(bodies[-1], entry_point, loops, scope), bound))
+    elif code.prim in BRANCHES and len(bodies) == 2:
+        total = add(total, upper(cost(bodies[0], entry_point, loops, scope),
+                                 cost(bodies[1], entry_point, loops, scope)))
+    else:
+        for body in bodies:
+            total = add(total, cost(body, entry_point, loops, scope))
+    return total
+
+
+def storage_terms(type_):
+    """The first-degree terms of the sets, maps and lists of the storage
+    type ``type_``, named by their field annotation."""
+    terms = {}
+    if not isinstance(type_, Node):
+        return terms
+    if type_.prim in ("set", "map", "list"):
+        names = [a[1:] for a in type_.annots if a.startswith("%")]
+        if names:
+            terms[(names[0],)] = STORAGE_ELEMENT
+        return terms
+    if type_.prim in ("pair", "or", "option"):
+        for arg in type_.args:
+            terms.update(storage_terms(arg))
+    return terms
+
+
+def entry_points(code):
+    """The entry points marked in ``code``, in order."""
+    found = []
+    pending = list(code)
+    while pending:
+        node = pending.pop(0)
+        if isinstance(node, list):
+            pending[:0] = node
+        elif isinstance(node, Node):
+            if node.entry_point and node.entry_point not in found:
+                found.append(node.entry_point)
+            pending[:0] = [arg for arg in node.args if isinstance(arg, (list, Node))]
+    return found
+
+
+def analyze(text, offchain_views=None):
+    """Return {entry point: (polynomial, loops)} of the Michelson script
+    ``text``, the on-chain views named ``view:<name>`` and the
+    michelsonStorageView ``offchain_views``, by name, ``offchain:<name>``."""
+    script = parse(text)
+    code = section(script, "code").args[0]
+    storage = storage_terms(section(script, "storage").args[0])
+    fixed = add({(): BASE}, storage)
+    result = {}
+    for entry_point in entry_points(code) or ["default"]:
+        loops = []
+        result[entry_point] = add(fixed, cost(code, entry_point, loops)), loops
+    for node in script:
+        if isinstance(node, Node) and node.prim == "view":
+            loops = []
+            name = "view:" + json.loads(node.args[0])
+            result[name] = add(storage, cost(node.args[-1], None, loops, name)), loops
+    for name, view in sorted((offchain_views or {}).items()):
+        loops = []
+        name = "offchain:" + name
+        result[name] = add(storage, cost(from_micheline(view["code"]), None, loops, name)), loops
+    return result
+
+
+def offchain_views(directory, target):
+    """The michelsonStorageView off-chain views of the metadata of
+    ``target``, by name."""
+    found = {}
+    for path in smartpy_cli.metadata(directory, target):
+        found.update(views.load_views(path))
+    return found
+
+
+def read_budget(path):
+    with open(path) as f:
+        budget = json.load(f)
+    budget.setdefault("targets", {})
+    return budget
+
+
+def limits(budget, target):
+    """The gas budget and the declared sizes of ``target``."""
+    overrides = budget["targets"].get(target, {})
+    sizes = dict(budget.get("max_sizes", {}))
+    sizes.update(overrides.get("max_sizes", {}))
+    return overrides.get("budget", budget["budget"]), sizes
+
+
+def check(scripts, budget, directories=None):
+    """Print the estimates of every target of ``scripts``, compiled in
+    ``directories[script.path]`` or their compilation directory, return the
+    entry points above the budget."""
+    default = budget.get("default_size", 100)
+    failures = []
+    for script in scripts:
+        directory = os.path.join(ROOT, (directories or {}).get(script.path, script.compilation_dir))
+        for target in sorted(script.targets):
+            code_path = smartpy_cli.compiled(directory, target)[0]
+            if not os.path.exists(code_path):
+                print("%-30s not compiled, run tools.build" % target)
+                continue
+            gas_budget, sizes = limits(budget, target)
+            with open(code_path) as f:
+                analysis = analyze(f.read(), offchain_views(directory, target))
+            print(target)
+            for entry_point, (polynomial, loops) in analysis.items():
+                estimate = evaluate(polynomial, sizes, default)
+                over = estimate > gas_budget
+                print("  %-28s %12.1f%s  %s" % (
+                    entry_point, estimate, " OVER BUDGET" if over else "", format_polynomial(polynomial)))
+                for loop in loops:
+                    undeclared = isinstance(loop.bound, str) and loop.bound not in sizes
+                    print("    loop over %s (%s%s): %s" % (
+                        loop.bound, loop.kind, ", undeclared" if undeclared else "", loop.command))
+                if over:
+                    failures.append("%s %s: %.1f > %d" % (target, entry_point, estimate, gas_budget))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("targets", nargs="*", help="only analyze these targets")
+    parser.add_argument("--budget", default=BUDGET)
+    args = parser.parse_args(argv)
+
+    scripts = []
+    for script in targets.scripts():
+        if args.targets:
+            script.targets = {t: s for t, s in script.targets.items() if t in args.targets}
+        if script.targets:
+            scripts.append(script)
+    failures = check(scripts, read_budget(args.budget))
+    for failure in failures:
+        print("OVER BUDGET " + failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
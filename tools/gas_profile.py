@@ -0,0 +1,261 @@
+"""Attribute the gas of the benchmark calls to Michelson instructions and
+SmartPy source lines.
+
+Every call of the tools.bench cases is first run with ``octez-client run
+script --trace-stack`` on the storage of the originated contract, which logs
+the gas of every instruction, then sent to the mockup so that the next call
+sees its effects. Instructions are located in the compiled ``.tz`` and mapped
+to the SmartPy command in the comment SmartPy writes above them, then to the
+line of the contract sources with the same text. Commands SmartPy prints
+differently from the source are reported by their text.
+
+The collapsed stacks, one ``case;entry point;source line;instruction gas``
+line per frame in milligas, are read by flamegraph.pl, inferno and
+speedscope:
+
+    python3 -m tools.gas_profile --contract Market --sizes 1000 --folded market.folded
+    flamegraph.pl market.folded > market.svg
+
+Only the code of the called contract is traced: the internal operations it
+emits and the lambdas it runs from its storage are not broken down.
+"""
+
+import argparse
+import collections
+import os
+import re
+import sys
+import tempfile
+
+from tools import ROOT, bench, octez, smartpy_cli, snapshot
+
+TOP = 10
+
+TOKEN = re.compile(r'#[^\n]*|"(?:[^"\\]|\\.)*"|0x[0-9a-fA-F]*|-?\d+|[A-Za-z_][A-Za-z0-9_.]*|[{}();]|[%@:][\w.%@]*|\n')
+ENTRY_POINT = re.compile(r"#\s*==\s*(\w+)\s*==")
+# octez-client logs the gas of the instruction, older ones what remains
+TRACE = re.compile(r"- location: (\d+) \((?:just consumed gas: ([\d.]+)|remaining gas: ([\d.]+))")
+IMPORT = re.compile(r'import_script_from_url\("file:([^"]+)"\)')
+
+
+class Instruction:
+    def __init__(self, prim, entry_point, command):
+        self.prim = prim
+        self.entry_point = entry_point
+        # the SmartPy command compiled to the instruction, None before the
+        # first one
+        self.command = command
+
+
+def instructions(text):
+    """Return {location: Instruction} of the Michelson script ``text``.
+
+    Locations are numbered as octez-client does: every node of the script
+    in prefix order, the toplevel sequence being 0 and annotations not
+    counted."""
+    located = {}
+    entry_point = None
+    command = None
+    line_start = True
+    location = 0
+    scopes = []
+    for token in TOKEN.findall(text):
+        if token == "\n":
+            line_start = True
+            continue
+        if token.startswith("#"):
+            marker = ENTRY_POINT.match(token)
+            if marker:
+                entry_point, command = marker.group(1), None
+            elif line_start:
+                # ` # @storage` after an instruction is its stack type
+                command = token[1:].split(" # ")[0].strip()
+            continue
+        line_start = False
+        # the markers and commands of a block end with it
+        if token == "{":
+            scopes.append((entry_point, command))
+        elif token == "}":
+            entry_point, command = scopes.pop()
+        if token[0] in "%@:" or token in "();}":
+            continue
+        location += 1
+        if token[0].isalpha() and token[0].isupper():
+            located[location] = Instruction(token, entry_point, command)
+    return located
+
+
+def normalize(text):
+    text = re.sub(r"\s+", "", text).replace('"', "'")
+    return text[3:] if text.startswith("sp.") else text
+
+
+def source_files(script):
+    """The script and the scripts it imports, transitively."""
+    found = []
+    pending = [script]
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.exists(os.path.join(ROOT, path)):
+            continue
+        found.append(path)
+        with open(os.path.join(ROOT, path)) as f:
+            pending += IMPORT.findall(f.read())
+    return found
+
+
+class Sources:
+    def __init__(self, script):
+        self.lines = []
+        for path in source_files(script):
+            with open(os.path.join(ROOT, path)) as f:
+                for lineno, line in enumerate(f, 1):
+                    code = line.split("#")[0]
+                    if code.strip():
+                        self.lines.append(("%s:%d" % (path, lineno), normalize(code)))
+        self.found = {}
+
+    def locate(self, command):
+        """``path:line`` of the source line of ``command``, or its text."""
+        if command is None:
+            return "<prologue>"
+        if command not in self.found:
+            wanted = normalize(command)
+            self.found[command] = next(
+                (place for place, code in self.lines if wanted
+                 and (code.startswith(wanted) or (len(code) >= 12 and wanted.startswith(code)))),
+                command,
+            )
+        return self.found[command]
+
+
+def trace(output):
+    """Yield (location, gas) for every instruction logged in ``output``."""
+    remaining = None
+    for match in TRACE.finditer(output):
+        location, consumed, left = match.groups()
+        if consumed is not None:
+            yield int(location), float(consumed)
+        else:
+            left = float(left)
+            yield int(location), remaining - left if remaining is not None else 0.0
+            remaining = left
+
+
+def run_script(mockup, code, address, call, arg):
+    """The trace of ``call`` run on the current storage of ``address``."""
+    return mockup.run(
+        "run", "script", code,
+        "on", "storage", mockup.data(mockup.storage(address)),
+        "and", "input", mockup.data(arg),
+        "--entrypoint", call.entrypoint,
+        "--amount", octez.tez(call.amount),
+        "--balance", octez.tez(snapshot.mutez(mockup.run("get", "balance", "for", address))),
+        "--source", call.source, "--payer", call.source,
+        "--self-address", address,
+        "--trace-stack",
+    )
+
+
+def profile_case(mockup, output_dir, case, size, fa2):
+    """Return {(call, entry point, source line, instruction): gas} of the
+    calls of ``case`` at ``size``."""
+    target = case.target.format(size=size)
+    code, storage = smartpy_cli.compiled(output_dir, target)
+    with open(storage) as f:
+        address, _ = mockup.originate(
+            "%s_%d" % (case.name, size), code,
+            f.read().replace(bench.FA2_PLACEHOLDER, fa2), balance=case.balance,
+        )
+    with open(code) as f:
+        located = instructions(f.read())
+    sources = Sources(case.script)
+    fields = bench.call_fields(size, fa2)
+    frames = collections.Counter()
+    for call in case.calls:
+        arg = call.arg.format(**fields)
+        try:
+            output = run_script(mockup, code, address, call, arg)
+            mockup.call(address, call.entrypoint, arg, amount=call.amount, source=call.source)
+        except octez.OctezError as e:
+            print("%s %s failed: %s" % (target, call.name, str(e).splitlines()[0]), file=sys.stderr)
+            continue
+        for location, gas in trace(output):
+            instruction = located.get(location)
+            if instruction is None:
+                frames[call.name, call.entrypoint, "<lambda>", "?"] += gas
+            else:
+                frames[call.name, instruction.entry_point or call.entrypoint,
+                       sources.locate(instruction.command), instruction.prim] += gas
+    return frames
+
+
+def profile(cases, sizes):
+    """Return {(case, size): frames} of ``profile_case``."""
+    profiles = {}
+    with tempfile.TemporaryDirectory() as output_dir, octez.Mockup() as mockup:
+        os.environ["BENCH_SIZES"] = ",".join(str(size) for size in sizes)
+        for script in sorted({case.script for case in cases}):
+            smartpy_cli.compile(script, output_dir)
+        fa2 = ""
+        if any(case.script.startswith("market/") for case in cases):
+            code, storage = smartpy_cli.compiled(output_dir, "mock_fa2")
+            with open(storage) as f:
+                fa2, _ = mockup.originate("mock_fa2", code, f.read())
+        for case in cases:
+            for size in case.sizes:
+                if size in sizes:
+                    print("%s at %d entries" % (case.name, size), file=sys.stderr)
+                    profiles[case.name, size] = profile_case(mockup, output_dir, case, size, fa2)
+    return profiles
+
+
+def folded(profiles):
+    """Yield the collapsed stack lines of ``profiles``, gas in milligas."""
+    for (case, size), frames in profiles.items():
+        for (call, entry_point, line, prim), gas in sorted(frames.items()):
+            stack = ["%s_%d" % (case, size), call]
+            if entry_point != call:
+                stack.append(entry_point)
+            stack += [line, prim]
+            yield "%s %d" % (";".join(s.replace(";", ",").replace(" ", "_") for s in stack),
+                             round(gas * 1000))
+
+
+def hot_lines(frames, top=TOP):
+    """Return {call: [(source line, gas, share)]}, the ``top`` lines of
+    every call by gas."""
+    calls = collections.defaultdict(collections.Counter)
+    for (call, _, line, _), gas in frames.items():
+        calls[call][line] += gas
+    table = {}
+    for call, lines in calls.items():
+        total = sum(lines.values()) or 1
+        table[call] = [(line, gas, gas / total) for line, gas in lines.most_common(top)]
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contract", action="append", help="only profile these cases")
+    parser.add_argument("--sizes", default="100")
+    parser.add_argument("--top", type=int, default=TOP, help="hot lines per entry point")
+    parser.add_argument("--folded", help="write the collapsed stacks to this file")
+    args = parser.parse_args(argv)
+
+    cases = [case for case in bench.CASES if not args.contract or case.name in args.contract]
+    profiles = profile(cases, [int(size) for size in args.sizes.split(",")])
+
+    for (case, size), frames in profiles.items():
+        for call, lines in hot_lines(frames, args.top).items():
+            print("%s/%d/%s" % (case, size, call))
+            for line, gas, share in lines:
+                print("  %10.3f  %5.1f%%  %s" % (gas, share * 100, line))
+    if args.folded:
+        with open(args.folded, "w") as f:
+            for line in folded(profiles):
+                f.write(line + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+"""Index a Market contract into SQLite by replaying its operations.
+
+The indexer reads blocks either from a recorded JSON operation log or from a
+local node, applies every successful Market call the way the contract does,
+and keeps the items, per-user items and balances in SQLite, indexed for the
+Market views. It resumes from the last indexed block and, when a block does
+not follow the indexed chain, rolls the recent levels back from a journal.
+With a node, the indexed blocks of the last levels are first compared with
+the node's, so that a reorg at or below the indexed head is undone too, and
+the owner_address and list_fee of a new index are read from the contract
+storage. Calls to the entry points that change no indexed state, such as
+``default`` or ``update_entry_point``, are skipped.
+
+    python3 -m tools.indexer sync --db market.db --log operations.json --owner tz1...
+    python3 -m tools.indexer sync --db market.db --node http://localhost:8732 --contract KT1...
+    python3 -m tools.indexer query --db market.db active --limit 20
+    python3 -m tools.indexer query --db market.db created tz1...
+
+A JSON operation log is a list of blocks, oldest first:
+
+    {"level": 12, "hash": "B...", "predecessor": "B...",
+     "operations": [{"entrypoint": "crerate_market_item", "sender": "tz1...",
+                     "amount": 1000000, "parameters": <Micheline JSON>}]}
+
+It lists only the applied operations sent to the indexed Market.
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+import urllib.request
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS blocks (level INTEGER PRIMARY KEY, hash TEXT, predecessor TEXT);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY, address TEXT, token_id INTEGER, seller TEXT,
+    buyer TEXT, price INTEGER, state TEXT, level INTEGER
+);
+CREATE TABLE IF NOT EXISTS user_items (
+    user TEXT, item_id INTEGER, role TEXT, PRIMARY KEY (user, role, item_id)
+);
+CREATE TABLE IF NOT EXISTS balances (address TEXT PRIMARY KEY, amount INTEGER);
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT, level INTEGER, tbl TEXT, key TEXT, old TEXT
+);
+CREATE INDEX IF NOT EXISTS items_seller ON items (seller);
+CREATE INDEX IF NOT EXISTS items_buyer ON items (buyer);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, id);
+CREATE INDEX IF NOT EXISTS items_address ON items (address, state);
+CREATE INDEX IF NOT EXISTS journal_level ON journal (level);
+"""
+
+KEYS = {
+    "meta": ["key"],
+    "items": ["id"],
+    "user_items": ["user", "role", "item_id"],
+    "balances": ["address"],
+}
+
+# levels kept in the journal, deeper reorgs need a full reindex
+MAX_REORG = 60
+
+# the Market calls replayed by Index, the others change no indexed state
+ENTRY_POINTS = {
+    "crerate_market_item", "create_market_items", "delete_market_item",
+    "create_market_sale", "create_market_sales", "buy_signed_listing",
+    "cancel_signed_listings", "withdraw",
+}
+
+
+class ReorgError(Exception):
+    pass
+
+
+# Micheline decoding
+
+B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+ADDRESS_PREFIXES = {
+    (0, 0): bytes([6, 161, 159]),  # tz1
+    (0, 1): bytes([6, 161, 161]),  # tz2
+    (0, 2): bytes([6, 161, 164]),  # tz3
+    (1, None): bytes([2, 90, 121]),  # KT1
+}
+
+
+def b58check(payload):
+    data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    n = int.from_bytes(data, "big")
+    result = ""
+    while n:
+        n, r = divmod(n, 58)
+        result = B58[r] + result
+    return "1" * (len(data) - len(data.lstrip(b"\0"))) + result
+
+
+# base58 prefix of the public keys -> their curve, the tag of the tz address
+KEY_PREFIXES = {
+    "edpk": (bytes([13, 15, 37, 217]), 0),
+    "sppk": (bytes([3, 254, 226, 86]), 1),
+    "p2pk": (bytes([3, 178, 139, 127]), 2),
+}
+
+
+def b58decode(text):
+    n = 0
+    for c in text:
+        n = n * 58 + B58.index(c)
+    data = n.to_bytes((n.bit_length() + 7) // 8, "big")
+    return b"\0" * (len(text) - len(text.lstrip("1"))) + data
+
+
+def key_address(node):
+    """The implicit account of a Micheline public key, readable or
+    optimized."""
+    if "string" in node:
+        prefix, curve = KEY_PREFIXES[node["string"][:4]]
+        key = b58decode(node["string"])[len(prefix):-4]
+    else:
+        raw = bytes.fromhex(node["bytes"])
+        curve, key = raw[0], raw[1:]
+    key_hash = hashlib.blake2b(key, digest_size=20).digest()
+    return b58check(ADDRESS_PREFIXES[(0, curve)] + key_hash)
+
+
+def address(node):
+    """Decode a Micheline address, readable or optimized."""
+    if "string" in node:
+        return node["string"]
+    raw = bytes.fromhex(node["bytes"])
+    if raw[0] == 0:
+        return b58check(ADDRESS_PREFIXES[(0, raw[1])] + raw[2:22])
+    return b58check(ADDRESS_PREFIXES[(1, None)] + raw[1:21])
+
+
+def nat(node):
+    return int(node["int"])
+
+
+def pair(node):
+    """Return the two members of a Pair, or of a pair type, flattening right
+    combs."""
+    args = node["args"]
+    if len(args) > 2:
+        return args[0], {"prim": node["prim"], "args": args[1:]}
+    return args[0], args[1]
+
+
+def fields(type_, value, found=None):
+    """Return {annotation: value} of the fields of a Micheline value, read
+    along its type. Combs may be written as sequences."""
+    found = {} if found is None else found
+    for annot in type_.get("annots", []):
+        if annot.startswith("%"):
+            found[annot[1:]] = value
+    if type_.get("prim") == "pair":
+        if isinstance(value, list):
+            value = {"prim": "Pair", "args": value}
+        for member_type, member in zip(pair(type_), pair(value)):
+            fields(member_type, member, found)
+    return found
+
+
+def listing(node):
+    contract, rest = pair(node)
+    token_id, price = pair(rest)
+    return address(contract), nat(token_id), nat(price)
+
+
+def sale(node):
+    contract, item_id = pair(node)
+    return address(contract), nat(item_id)
+
+
+# Index
+
+class Index:
+    def __init__(self, path, owner=None, list_fee=1000000):
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+        self.level = None
+        if self.get_meta("item_id") is None:
+            self.level = 0
+            self.set_meta("item_id", 1)
+            self.set_meta("owner", owner)
+            self.set_meta("list_fee", list_fee)
+            self.db.commit()
+
+    # journaled writes
+
+    def row(self, table, key):
+        where = " AND ".join("%s = ?" % k for k in KEYS[table])
+        found = self.db.execute("SELECT * FROM %s WHERE %s" % (table, where), key).fetchone()
+        return dict(found) if found else None
+
+    def journal(self, table, key):
+        old = self.row(table, key)
+        self.db.execute(
+            "INSERT INTO journal (level, tbl, key, old) VALUES (?, ?, ?, ?)",
+            (self.level, table, json.dumps(key), json.dumps(old)),
+        )
+
+    def put(self, table, **row):
+        key = [row[k] for k in KEYS[table]]
+        self.journal(table, key)
+        self.db.execute(
+            "INSERT OR REPLACE INTO %s (%s) VALUES (%s)"
+            % (table, ", ".join(row), ", ".join("?" * len(row))),
+            list(row.values()),
+        )
+
+    def delete(self, table, *key):
+        self.journal(table, list(key))
+        where = " AND ".join("%s = ?" % k for k in KEYS[table])
+        self.db.execute("DELETE FROM %s WHERE %s" % (table, where), key)
+
+    def get_meta(self, key):
+        found = self.row("meta", [key])
+        return json.loads(found["value"]) if found else None
+
+    def set_meta(self, key, value):
+        self.put("meta", key=key, value=json.dumps(value))
+
+    def credit(self, address_, amount):
+        if amount == 0:
+            return
+        current = self.row("balances", [address_])
+        self.put("balances", address=address_, amount=(current["amount"] if current else 0) + amount)
+
+    # Market entry points, as the contract applies them
+
+    def crerate_market_item(self, params, sender, amount):
+        self.list_item(*listing(params), sender)
+
+    def create_market_items(self, params, sender, amount):
+        for node in params:
+            self.list_item(*listing(node), sender)
+
+    def list_item(self, contract, token_id, price, sender):
+        item_id = self.get_meta("item_id")
+        self.put("items", id=item_id, address=contract, token_id=token_id, seller=sender,
+                 buyer=None, price=price, state="created", level=self.level)
+        self.put("user_items", user=sender, item_id=item_id, role="seller")
+        self.set_meta("item_id", item_id + 1)
+
+    def delete_market_item(self, params, sender, amount):
+        item = self.row("items", [nat(params)])
+        if item["state"] == "created":
+            self.put("items", **dict(item, state="inactive", level=self.level))
+
+    def create_market_sale(self, params, sender, amount):
+        self.sell_item(sale(params)[1], sender)
+
+    def create_market_sales(self, params, sender, amount):
+        for node in params:
+            self.sell_item(sale(node)[1], sender)
+
+    def sell_item(self, item_id, sender):
+        item = self.row("items", [item_id])
+        self.put("items", **dict(item, buyer=sender, state="release", level=self.level))
+        self.put("user_items", user=sender, item_id=item_id, role="buyer")
+        fee = self.get_meta("list_fee")
+        self.credit(self.get_meta("owner"), fee)
+        self.credit(item["seller"], item["price"] - fee)
+
+    def buy_signed_listing(self, params, sender, amount):
+        # only the settled sale is recorded, as a released item
+        terms, rest = pair(params)
+        seller = key_address(pair(rest)[0])
+        contract, rest = pair(terms)
+        token_id, rest = pair(rest)
+        price = nat(pair(rest)[0])
+        item_id = self.get_meta("item_id")
+        self.put("items", id=item_id, address=address(contract), token_id=nat(token_id), seller=seller,
+                 buyer=sender, price=price, state="release", level=self.level)
+        self.put("user_items", user=seller, item_id=item_id, role="seller")
+        self.put("user_items", user=sender, item_id=item_id, role="buyer")
+        self.set_meta("item_id", item_id + 1)
+        fee = self.get_meta("list_fee")
+        self.credit(self.get_meta("owner"), fee)
+        self.credit(seller, price - fee)
+
+    def cancel_signed_listings(self, params, sender, amount):
+        # signed listings are not indexed before they are sold
+        pass
+
+    def withdraw(self, params, sender, amount):
+        self.delete("balances", sender)
+
+    # blocks
+
+    def head(self):
+        found = self.db.execute("SELECT * FROM blocks ORDER BY level DESC LIMIT 1").fetchone()
+        return dict(found) if found else None
+
+    def block_hash(self, level):
+        found = self.db.execute("SELECT hash FROM blocks WHERE level = ?", (level,)).fetchone()
+        return found["hash"] if found else None
+
+    def apply(self, block):
+        """Index ``block``, rolling back first if it forks the indexed chain.
+        Blocks already indexed are skipped, return whether it was indexed."""
+        if self.block_hash(block["level"]) == block["hash"]:
+            return False
+        head = self.head()
+        if head is not None and block["predecessor"] != head["hash"]:
+            fork = self.db.execute(
+                "SELECT level FROM blocks WHERE hash = ?", (block["predecessor"],)
+            ).fetchone()
+            if fork is None:
+                raise ReorgError("block %s at level %d does not follow the index"
+                                 % (block["hash"], block["level"]))
+            self.rollback(fork["level"])
+        self.level = block["level"]
+        for op in block["operations"]:
+            if op["entrypoint"] not in ENTRY_POINTS:
+                print("level %d: skipped a call to %s" % (self.level, op["entrypoint"]), file=sys.stderr)
+                continue
+            getattr(self, op["entrypoint"])(op["parameters"], op["sender"], op.get("amount", 0))
+        self.db.execute("INSERT INTO blocks VALUES (?, ?, ?)",
+                        (block["level"], block["hash"], block["predecessor"]))
+        self.db.execute("DELETE FROM journal WHERE level <= ?", (block["level"] - MAX_REORG,))
+        self.db.execute("DELETE FROM blocks WHERE level <= ?", (block["level"] - MAX_REORG,))
+        self.db.commit()
+        return True
+
+    def rollback(self, level):
+        """Undo every block above ``level``."""
+        undo = self.db.execute(
+            "SELECT * FROM journal WHERE level > ? ORDER BY seq DESC", (level,)
+        ).fetchall()
+        for entry in undo:
+            table, key, old = entry["tbl"], json.loads(entry["key"]), json.loads(entry["old"])
+            where = " AND ".join("%s = ?" % k for k in KEYS[table])
+            self.db.execute("DELETE FROM %s WHERE %s" % (table, where), key)
+            if old is not None:
+                self.db.execute(
+                    "INSERT INTO %s (%s) VALUES (%s)" % (table, ", ".join(old), ", ".join("?" * len(old))),
+                    list(old.values()),
+                )
+        self.db.execute("DELETE FROM journal WHERE level > ?", (level,))
+        self.db.execute("DELETE FROM blocks WHERE level > ?", (level,))
+        self.db.commit()
+
+    # queries, as the Market views
+
+    def items(self, where, args, cursor=0, limit=100):
+        return [dict(r) for r in self.db.execute(
+            "SELECT * FROM items WHERE %s AND id >= ? ORDER BY id LIMIT ?" % where,
+            list(args) + [cursor, limit],
+        )]
+
+    def active_items(self, cursor=0, limit=100):
+        return self.items("state = 'created'", [], cursor, limit)
+
+    def created_items(self, user, cursor=0, limit=100):
+        return self.items("seller = ?", [user], cursor, limit)
+
+    def purchased_items(self, user, cursor=0, limit=100):
+        return self.items("buyer = ?", [user], cursor, limit)
+
+    def collection_items(self, contract, cursor=0, limit=100):
+        return self.items("address = ? AND state = 'created'", [contract], cursor, limit)
+
+    def list_fee(self):
+        return self.get_meta("list_fee")
+
+
+# sources
+
+def log_blocks(path, head=None):
+    """Return the blocks of the log recorded after the indexed ``head``."""
+    with open(path) as f:
+        blocks = json.load(f)
+    hashes = [block["hash"] for block in blocks]
+    if head is not None and head["hash"] in hashes:
+        return blocks[len(hashes) - hashes[::-1].index(head["hash"]):]
+    return blocks
+
+
+def rpc(node, path):
+    with urllib.request.urlopen(node.rstrip("/") + path) as response:
+        return json.load(response)
+
+
+def market_calls(contents, contract):
+    """Yield the applied Market calls of a manager operation, internal ones
+    included."""
+    for content in contents:
+        results = [(content, content.get("metadata", {}).get("operation_result", {}))]
+        results += [
+            (internal, internal.get("result", {}))
+            for internal in content.get("metadata", {}).get("internal_operation_results", [])
+        ]
+        for op, result in results:
+            if op.get("kind") == "transaction" and op.get("destination") == contract \
+                    and result.get("status") == "applied" and "parameters" in op:
+                yield {
+                    "entrypoint": op["parameters"]["entrypoint"],
+                    "parameters": op["parameters"]["value"],
+                    "sender": op.get("sender", op.get("source")),
+                    "amount": int(op.get("amount", 0)),
+                }
+
+
+def node_settings(node, contract):
+    """Return the owner_address and list_fee of the Market ``contract``, read
+    from its storage on ``node``."""
+    path = "/chains/main/blocks/head/context/contracts/%s" % contract
+    code = rpc(node, path + "/script")["code"]
+    storage_type = next(section["args"][0] for section in code if section["prim"] == "storage")
+    storage = fields(storage_type, rpc(node, path + "/storage"))
+    return address(storage["owner_address"]), nat(storage["list_fee"])
+
+
+def node_start(index, node, from_level):
+    """Return the level to sync from with ``node``. Indexed blocks the node
+    no longer has on its chain are rolled back first, the last MAX_REORG
+    levels being compared from the top."""
+    head = index.head()
+    if head is None:
+        return from_level
+    node_head = rpc(node, "/chains/main/blocks/head/header")["level"]
+    for level in range(min(head["level"], node_head), head["level"] - MAX_REORG, -1):
+        indexed = index.block_hash(level)
+        if indexed is None:
+            break
+        if rpc(node, "/chains/main/blocks/%d/header" % level)["hash"] == indexed:
+            if level < head["level"]:
+                index.rollback(level)
+            return level + 1
+    raise ReorgError("no indexed block of the last %d levels is on the chain of %s, reindex"
+                     % (MAX_REORG, node))
+
+
+def node_blocks(node, contract, start):
+    """Yield the blocks from level ``start`` to the current head."""
+    head = rpc(node, "/chains/main/blocks/head/header")["level"]
+    for level in range(start, head + 1):
+        header = rpc(node, "/chains/main/blocks/%d/header" % level)
+        operations = []
+        for op in rpc(node, "/chains/main/blocks/%d/operations/3" % level):
+            operations += market_calls(op["contents"], contract)
+        yield {"level": level, "hash": header["hash"], "predecessor": header["predecessor"],
+               "operations": operations}
+
+
+def sync(index, blocks):
+    count = 0
+    for block in blocks:
+        count += index.apply(block)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default="market.db")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = commands.add_parser("sync")
+    source = sync_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--log", help="JSON operation log")
+    source.add_argument("--node", help="node RPC URL")
+    sync_parser.add_argument("--contract", help="Market address, with --node")
+    sync_parser.add_argument("--owner", help="owner_address of the Market, with --log")
+    sync_parser.add_argument("--list-fee", type=int, default=1000000, help="in mutez, with --log")
+    sync_parser.add_argument("--from-level", type=int, default=1, help="first level with --node")
+
+    query = commands.add_parser("query")
+    query.add_argument("view", choices=["active", "created", "purchased", "collection", "list-fee"])
+    query.add_argument("address", nargs="?")
+    query.add_argument("--cursor", type=int, default=0)
+    query.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        if args.node and not args.contract:
+            parser.error("--node needs --contract")
+        if args.node:
+            index = Index(args.db, *node_settings(args.node, args.contract))
+        else:
+            index = Index(args.db, args.owner, args.list_fee)
+        try:
+            if args.log:
+                blocks = log_blocks(args.log, index.head())
+            else:
+                blocks = node_blocks(args.node, args.contract, node_start(index, args.node, args.from_level))
+            print("indexed %d blocks" % sync(index, blocks))
+        except ReorgError as e:
+            sys.exit(str(e))
+        return
+
+    index = Index(args.db)
+    if args.view == "list-fee":
+        result = index.list_fee()
+    elif args.view == "active":
+        result = index.active_items(args.cursor, args.limit)
+    else:
+        if not args.address:
+            parser.error("%s needs an address" % args.view)
+        result = getattr(index, args.view + "_items")(args.address, args.cursor, args.limit)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Measure contracts with ``octez-client --mode mockup``.
+
+A mockup is a throw-away local context: contracts are originated and called
+without a node, and every operation prints the same receipt as on chain, with
+the consumed gas and storage sizes the cost tools report.
+"""
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from dataclasses import dataclass
+
+# accounts funded in every mockup
+BOOTSTRAP_ACCOUNTS = {
+    "bootstrap1": "tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx",
+    "bootstrap2": "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN",
+    "bootstrap3": "tz1faswCTDciRzE4oJ9jn2Vm2dvjeyA9fUzU",
+    "bootstrap4": "tz1b7tUupMgCNw2cCLpKTkSD1NZzB5TkP2sv",
+    "bootstrap5": "tz1ddb9NMYHZi5UzPdzTZMYQQZoMub195zgv",
+}
+
+# Michelson data longer than this is passed to octez-client as a file, a
+# single command line argument is limited to 128KiB on Linux.
+MAX_INLINE_DATA = 64 * 1024
+
+# storage burn, in mutez per byte, and the bytes an origination allocates
+COST_PER_BYTE = 250
+ORIGINATION_SIZE = 257
+# the binary encoding of a big_map entry, with its key hash, can be larger
+# than its Michelson text
+BURN_MARGIN = 4
+# burn cap of the calls, in mutez: a call adding thousands of entries must
+# not fail on it
+CALL_BURN_CAP = 1000 * 1000000
+
+
+class OctezError(Exception):
+    pass
+
+
+@dataclass
+class Receipt:
+    # summed over the operation and the internal operations it emitted
+    consumed_gas: float
+    paid_storage_size_diff: int
+    # of the first contract in the receipt, the one originated or called
+    storage_size: int
+    output: str
+
+
+def parse_receipt(output):
+    gas = sum(float(g) for g in re.findall(r"Consumed gas: ([\d.]+)", output))
+    paid = sum(int(b) for b in re.findall(r"Paid storage size diff: (\d+) bytes", output))
+    size = re.search(r"Storage size: (\d+) bytes", output)
+    return Receipt(gas, paid, int(size.group(1)) if size else 0, output)
+
+
+def tez(mutez):
+    return "%d.%06d" % divmod(mutez, 1000000)
+
+
+def origination_burn_cap(code_size, storage_size):
+    """Burn cap, in mutez, of originating a script of ``code_size`` bytes
+    with a storage of ``storage_size`` bytes of Michelson text."""
+    return (BURN_MARGIN * (code_size + storage_size) + ORIGINATION_SIZE) * COST_PER_BYTE
+
+
+class Mockup:
+    def __init__(self, base_dir=None, client=None, protocol=None, burn_cap=CALL_BURN_CAP):
+        self.client = client or os.environ.get("OCTEZ_CLIENT", "octez-client")
+        if shutil.which(self.client) is None:
+            raise OctezError("%s not found, set OCTEZ_CLIENT" % self.client)
+        self.owns_base_dir = base_dir is None
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix="mockup-")
+        self.protocol = protocol
+        self.burn_cap = burn_cap
+        if not os.path.exists(os.path.join(self.base_dir, "mockup")):
+            self.run("create", "mockup")
+
+    def close(self):
+        if self.owns_base_dir:
+            shutil.rmtree(self.base_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, *args):
+        command = [self.client, "--mode", "mockup", "--base-dir", self.base_dir]
+        if self.protocol:
+            command += ["--protocol", self.protocol]
+        proc = subprocess.run(command + list(args), capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise OctezError("%s failed:\n%s%s" % (" ".join(args[:2]), proc.stdout, proc.stderr))
+        return proc.stdout
+
+    def data(self, value):
+        """Return a command line argument for the Michelson ``value``."""
+        if len(value) <= MAX_INLINE_DATA:
+            return value
+        fd, path = tempfile.mkstemp(suffix=".tz", dir=self.base_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write(value)
+        return path
+
+    def originate(self, alias, code_path, storage, balance=0, source="bootstrap1"):
+        """Originate the contract in ``code_path``, return its address and the
+        origination receipt. The burn cap grows with the script and storage."""
+        burn_cap = origination_burn_cap(os.path.getsize(code_path), len(storage))
+        output = self.run(
+            "originate", "contract", alias,
+            "transferring", tez(balance), "from", source,
+            "running", code_path,
+            "--init", self.data(storage),
+            "--burn-cap", tez(burn_cap), "--force",
+        )
+        address = re.search(r"New contract (KT1\w+) originated", output)
+        if address is None:
+            raise OctezError("no contract originated:\n%s" % output)
+        return address.group(1), parse_receipt(output)
+
+    def call(self, contract, entrypoint, arg="Unit", amount=0, source="bootstrap2"):
+        output = self.run(
+            "transfer", tez(amount), "from", source, "to", contract,
+            "--entrypoint", entrypoint,
+            "--arg", self.data(arg),
+            "--burn-cap", tez(self.burn_cap),
+        )
+        return parse_receipt(output)
+
+    def new_account(self, alias, balance, source="bootstrap1"):
+        """Create, fund and reveal the implicit account ``alias``, return its
+        address. The reveal is done here so that it is not counted in the
+        first call of the account."""
+        self.run("gen", "keys", alias, "--force")
+        self.run("transfer", tez(balance), "from", source, "to", alias, "--burn-cap", "1")
+        self.run("reveal", "key", "for", alias)
+        output = self.run("show", "address", alias)
+        return re.search(r"Hash: (tz\w+)", output).group(1)
+
+    def data_size(self, value):
+        """Size in bytes of the binary encoding of the Michelson ``value``, as
+        it is serialized in an operation."""
+        output = self.run("convert", "data", self.data(value), "from", "michelson", "to", "binary")
+        return (len(output.strip()) - len("0x")) // 2
+
+    def storage(self, contract):
+        return self.run("get", "contract", "storage", "for", contract).strip()
@@ -0,0 +1,156 @@
+"""Run the sp.add_test scenarios of startup/ and market/ in parallel.
+
+SmartPy.sh runs all the scenarios of a script at once, so a script is the
+unit of work: the scripts are sharded over the workers longest first, by
+their last duration, and each one is run through the tools.cache cache. The
+results are written as JUnit XML to ``<project>/test/junit.xml``, and the
+scenario outputs to ``<project>/test/output/<script>``.
+
+    python3 -m tools.scenarios [--jobs N] [--failed | --changed] [--shard I/N] [script ...]
+
+``--failed`` reruns only the scripts that failed last time, ``--changed``
+only those that failed or changed since their last run; ``--shard I/N``
+runs the I-th of N shards, to split the scripts across CI machines.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tools import ROOT, cache, smartpy_cli, targets
+
+STATE = ".test-state.json"
+
+
+def output_dir(script):
+    name = os.path.splitext(os.path.basename(script.path))[0]
+    return os.path.join(script.test_dir, "output", name)
+
+
+def read_state(directory):
+    path = os.path.join(ROOT, directory, STATE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(directory, state):
+    with open(os.path.join(ROOT, directory, STATE), "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+
+def shard(scripts, durations, index, count):
+    """Split ``scripts`` in ``count`` shards of about the same duration,
+    longest first, and return the ``index``-th one."""
+    shards = [[0.0, []] for _ in range(count)]
+    for script in sorted(scripts, key=lambda s: -durations.get(s.path, 0)):
+        lightest = min(shards, key=lambda s: s[0])
+        lightest[0] += durations.get(script.path, 0) or 1
+        lightest[1].append(script)
+    return shards[index][1]
+
+
+def run_script(script, cache_dir):
+    start = time.monotonic()
+    hit, error = False, None
+    try:
+        _, hit = cache.run(
+            "test", script, output_dir(script), (),
+            cache.Cache(cache_dir) if cache_dir else None,
+        )
+    except smartpy_cli.SmartPyError as e:
+        error = str(e)
+    return time.monotonic() - start, hit, error
+
+
+def junit(project, results):
+    """Write the ``results`` of ``project`` as ``<project>/test/junit.xml``,
+    one testcase per scenario, timed as its whole script."""
+    suites = ET.Element("testsuites", name=project)
+    for script, (seconds, hit, error) in sorted(results, key=lambda r: r[0].path):
+        suite = ET.SubElement(
+            suites, "testsuite", name=script.path, tests=str(len(script.tests)),
+            failures=str(len(script.tests) if error else 0), time="%.3f" % seconds,
+        )
+        for name in script.tests:
+            case = ET.SubElement(suite, "testcase", classname=script.path, name=name, time="%.3f" % seconds)
+            if error:
+                ET.SubElement(case, "failure", message="scenario failed").text = error
+            elif hit:
+                ET.SubElement(case, "system-out").text = "cached"
+    path = os.path.join(ROOT, project, "test", "junit.xml")
+    ET.ElementTree(suites).write(path, encoding="utf-8", xml_declaration=True)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scripts", nargs="*", help="only run these scripts")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count())
+    parser.add_argument("--shard", default="1/1", help="I/N, run the I-th of N shards")
+    parser.add_argument("--no-cache", action="store_true", help="always run the scenarios")
+    rerun = parser.add_mutually_exclusive_group()
+    rerun.add_argument("--failed", action="store_true", help="only the scripts that failed last time")
+    rerun.add_argument("--changed", action="store_true", help="only the failed or changed scripts")
+    args = parser.parse_args(argv)
+
+    scripts = [
+        s for s in targets.scripts(kinds=("contracts", "test"))
+        if s.tests and (not args.scripts or s.path in args.scripts)
+    ]
+    states = {s.test_dir: read_state(s.test_dir) for s in scripts}
+    last = {s.path: states[s.test_dir].get(s.path) for s in scripts}
+    if args.failed:
+        scripts = [s for s in scripts if last[s.path] and not last[s.path]["ok"]]
+    elif args.changed:
+        scripts = [
+            s for s in scripts
+            if not last[s.path] or not last[s.path]["ok"] or last[s.path]["digest"] != targets.digest(s.path)
+        ]
+    index, count = map(int, args.shard.split("/"))
+    durations = {path: entry["seconds"] for path, entry in last.items() if entry}
+    scripts = shard(scripts, durations, index - 1, count)
+
+    start = time.monotonic()
+    results = []
+    cache_dir = None if args.no_cache else cache.DEFAULT_DIR
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {
+            pool.submit(run_script, script, cache_dir): script
+            for script in sorted(scripts, key=lambda s: -durations.get(s.path, 0))
+        }
+        for future in as_completed(futures):
+            script = futures[future]
+            seconds, hit, error = future.result()
+            results.append((script, (seconds, hit, error)))
+            print("%-45s %s in %.1fs%s  %s" % (
+                script.path, "FAILED" if error else "ok", seconds,
+                " (cached)" if hit else "", ", ".join(script.tests)))
+            if error:
+                print(error)
+            states[script.test_dir][script.path] = {
+                "digest": targets.digest(script.path),
+                "ok": error is None,
+                # a cache hit says nothing of how long the scenarios take
+                "seconds": last[script.path]["seconds"] if hit and last[script.path] else seconds,
+            }
+
+    for directory, state in states.items():
+        write_state(directory, state)
+    for project in sorted({s.project for s, _ in results}):
+        print("wrote %s" % os.path.relpath(
+            junit(project, [(s, r) for s, r in results if s.project == project]), ROOT))
+    failed = [s.path for s, r in results if r[2]]
+    print("%d scripts, %d scenarios, %d failed in %.1fs" % (
+        len(results), sum(len(s.tests) for s, _ in results), len(failed), time.monotonic() - start))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
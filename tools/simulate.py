@@ -0,0 +1,248 @@
+"""Drive a Market with seeded random traffic and report gas percentiles.
+
+A Market, warm-started with ``--prefill`` items listed by bootstrap2 (the
+``bench_market_<size>`` target of market/test/bench.py), is originated in an
+octez mockup next to a few mock FA2 collections. Generated sellers and buyers
+then list, buy and delist items at random, in the proportions of ``--mix``.
+The same seed replays the same traffic.
+
+The report gives, per entry point and per range of items listed so far, the
+p50/p95/p99 gas and the storage bytes paid per call, the storage size of the
+Market as it grows and the calls that failed, which leave the listings as
+they were.
+
+``--save-snapshot`` writes the contracts, accounts and listings at the end of
+the run with tools.snapshot, ``--snapshot`` starts a run from them instead of
+the prefilled Market:
+
+    python3 -m tools.simulate --seed 1 --ops 2000 --prefill 100000 --json simulation.json
+    python3 -m tools.simulate --ops 50000 --save-snapshot market-50k.gz
+    python3 -m tools.simulate --ops 1000 --snapshot market-50k.gz
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+from collections import Counter, defaultdict
+
+from tools import octez, smartpy_cli, snapshot
+
+SCRIPT = "market/test/bench.py"
+FA2_PLACEHOLDER = "KT1C58ssiuw2Y92kK5VwXhE9k69P9aqhtP1Q"
+LIST_FEE = 1000000
+# price of the prefilled items
+PREFILL_PRICE = 2000000
+# listings are priced from the fee, taken from the price at the sale, to
+# MAX_PRICE
+MAX_PRICE = 10000000
+# SELLER of market/test/bench.py
+PREFILL_SELLER = "bootstrap2"
+
+OPS = {
+    "list": "crerate_market_item",
+    "sale": "create_market_sale",
+    "delist": "delete_market_item",
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op not in OPS:
+            raise argparse.ArgumentTypeError("unknown operation %s, expected %s" % (op, ", ".join(OPS)))
+        mix[op] = float(weight)
+    return mix
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of the sorted ``values``."""
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def bucket(items):
+    """Lower bound of the power of ten range of ``items``."""
+    return 10 ** int(math.log10(max(items, 1)))
+
+
+class Simulation:
+    def __init__(self, mockup, market, collections, accounts, prefill, seed, state=None):
+        self.mockup = mockup
+        self.market = market
+        self.collections = collections
+        self.accounts = accounts
+        self.random = random.Random(seed)
+        if state is None:
+            # id -> (seller alias, collection index, price) of the items for sale
+            self.active = {i: (PREFILL_SELLER, 0, PREFILL_PRICE) for i in range(1, prefill + 1)}
+            self.next_id = prefill + 1
+            self.next_token = [prefill + 1] * len(collections)
+        else:
+            self.active = {int(i): tuple(item) for i, item in state["active"].items()}
+            self.next_id = state["next_id"]
+            self.next_token = state["next_token"]
+        self.active_ids = list(self.active)
+        self.samples = []
+        self.storage = {}
+        # entry point -> calls that failed
+        self.errors = Counter()
+
+    def state(self):
+        """The listings, to continue the simulation from a snapshot."""
+        return {"active": self.active, "next_id": self.next_id, "next_token": self.next_token}
+
+    def pick_active(self):
+        # swap-remove keeps the draw O(1) as the item count grows
+        index = self.random.randrange(len(self.active_ids))
+        self.active_ids[index], self.active_ids[-1] = self.active_ids[-1], self.active_ids[index]
+        item_id = self.active_ids.pop()
+        return item_id, self.active.pop(item_id)
+
+    def put_back(self, item_id, item):
+        self.active[item_id] = item
+        self.active_ids.append(item_id)
+
+    def step(self, op):
+        if op != "list" and not self.active_ids:
+            op = "list"
+        picked = None
+        try:
+            if op == "list":
+                seller = self.random.choice(self.accounts)
+                collection = self.random.randrange(len(self.collections))
+                price = self.random.randint(LIST_FEE // 100000, MAX_PRICE // 100000) * 100000
+                token_id = self.next_token[collection]
+                self.next_token[collection] += 1
+                receipt = self.mockup.call(
+                    self.market, OPS[op], 'Pair "%s" (Pair %d %d)' % (self.collections[collection], token_id, price),
+                    amount=LIST_FEE, source=seller,
+                )
+                self.put_back(self.next_id, (seller, collection, price))
+                self.next_id += 1
+            elif op == "sale":
+                picked = self.pick_active()
+                item_id, (_, collection, price) = picked
+                receipt = self.mockup.call(
+                    self.market, OPS[op], 'Pair "%s" %d' % (self.collections[collection], item_id),
+                    amount=price, source=self.random.choice(self.accounts),
+                )
+            else:
+                picked = self.pick_active()
+                item_id, (seller, _, _) = picked
+                receipt = self.mockup.call(self.market, OPS[op], str(item_id), source=seller)
+        except octez.OctezError as e:
+            # the call changed nothing, the item is still for sale
+            if picked is not None:
+                self.put_back(*picked)
+            self.errors[OPS[op]] += 1
+            print("%s failed: %s" % (OPS[op], str(e).splitlines()[0]), file=sys.stderr)
+            return
+        items = self.next_id - 1
+        self.samples.append((OPS[op], bucket(items), receipt.consumed_gas, receipt.paid_storage_size_diff))
+        self.storage[items] = receipt.storage_size
+
+    def run(self, ops, mix):
+        names, weights = zip(*mix.items())
+        for n in range(ops):
+            self.step(self.random.choices(names, weights)[0])
+            if (n + 1) % 100 == 0:
+                print("%d operations, %d items" % (n + 1, self.next_id - 1), file=sys.stderr)
+
+    def report(self):
+        grouped = defaultdict(list)
+        for entrypoint, items, gas, paid in self.samples:
+            grouped[entrypoint, items].append((gas, paid))
+        rows = []
+        for (entrypoint, items), values in sorted(grouped.items()):
+            gas = sorted(g for g, _ in values)
+            rows.append({
+                "entrypoint": entrypoint,
+                "items": items,
+                "calls": len(values),
+                "gas_p50": percentile(gas, 50),
+                "gas_p95": percentile(gas, 95),
+                "gas_p99": percentile(gas, 99),
+                "paid_bytes_mean": sum(p for _, p in values) / len(values),
+            })
+        return {"calls": rows, "storage_size": sorted(self.storage.items()), "errors": dict(self.errors)}
+
+
+def originate(mockup, args):
+    """Originate the collections and the prefilled Market, create the
+    accounts, return their addresses and aliases."""
+    with tempfile.TemporaryDirectory() as output_dir:
+        os.environ["BENCH_SIZES"] = str(args.prefill)
+        smartpy_cli.compile(SCRIPT, output_dir)
+        fa2_code, fa2_storage = smartpy_cli.compiled(output_dir, "mock_fa2")
+        with open(fa2_storage) as f:
+            fa2_storage = f.read()
+        collections = [
+            mockup.originate("collection_%d" % i, fa2_code, fa2_storage)[0]
+            for i in range(args.collections)
+        ]
+        code, storage = smartpy_cli.compiled(output_dir, "bench_market_%d" % args.prefill)
+        with open(storage) as f:
+            market, _ = mockup.originate("market", code, f.read().replace(FA2_PLACEHOLDER, collections[0]))
+    # enough for every call of the run to be a listing or the priciest sale
+    balance = args.ops * MAX_PRICE // args.accounts + MAX_PRICE
+    accounts = ["trader_%d" % i for i in range(args.accounts)]
+    for account in accounts:
+        mockup.new_account(account, balance)
+    return collections, market, accounts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ops", type=int, default=1000, help="random calls to make")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("list=0.6,sale=0.3,delist=0.1"))
+    parser.add_argument("--prefill", type=int, default=1, help="items listed at origination")
+    parser.add_argument("--accounts", type=int, default=20, help="generated sellers and buyers")
+    parser.add_argument("--collections", type=int, default=3, help="mock FA2 contracts")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--snapshot", help="start from this tools.snapshot file")
+    parser.add_argument("--save-snapshot", help="snapshot the contracts at the end of the run")
+    args = parser.parse_args(argv)
+
+    with octez.Mockup() as mockup:
+        recorder = snapshot.Recorder(mockup)
+        if args.snapshot:
+            addresses, meta = snapshot.restore(recorder, args.snapshot)
+            collections = [addresses[alias] for alias in meta["collections"]]
+            market, accounts, state = addresses["market"], meta["accounts"], meta["simulation"]
+        else:
+            collections, market, accounts = originate(recorder, args)
+            state = None
+
+        simulation = Simulation(recorder, market, collections, accounts, args.prefill, args.seed, state)
+        simulation.run(args.ops, args.mix)
+        report = simulation.report()
+        if args.save_snapshot:
+            aliases = ["collection_%d" % i for i in range(len(collections))]
+            snapshot.snapshot(recorder, args.save_snapshot, aliases + ["market"], accounts, {
+                "collections": aliases,
+                "accounts": accounts,
+                "simulation": simulation.state(),
+            })
+
+    print("%-22s %-14s %6s %10s %10s %10s %11s" % ("entry point", "items", "calls", "gas p50", "p95", "p99", "paid bytes"))
+    for row in report["calls"]:
+        print("%-22s %-14s %6d %10.1f %10.1f %10.1f %11.1f" % (
+            row["entrypoint"], "%d-%d" % (row["items"], row["items"] * 10), row["calls"],
+            row["gas_p50"], row["gas_p95"], row["gas_p99"], row["paid_bytes_mean"]))
+    if report["storage_size"]:
+        (first_items, first_size), (last_items, last_size) = report["storage_size"][0], report["storage_size"][-1]
+        print("storage %d bytes at %d items, %d bytes at %d items" % (first_size, first_items, last_size, last_items))
+    for entrypoint, count in sorted(report["errors"].items()):
+        print("%-22s %6d calls failed" % (entrypoint, count))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
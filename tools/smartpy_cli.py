@@ -0,0 +1,91 @@
+"""Locate and drive the SmartPy CLI installed by install.sh."""
+
+import glob
+import os
+import shutil
+import subprocess
+
+from tools import ROOT
+
+# install.sh default --prefix
+DEFAULT_PREFIX = os.path.expanduser("~/smartpy-cli")
+
+
+class SmartPyError(Exception):
+    pass
+
+
+def find_cli():
+    """Return the path of SmartPy.sh: $SMARTPY_CLI, then $PATH, then the
+    install.sh default prefix."""
+    path = (
+        os.environ.get("SMARTPY_CLI")
+        or shutil.which("SmartPy.sh")
+        or os.path.join(DEFAULT_PREFIX, "SmartPy.sh")
+    )
+    if not os.path.exists(path):
+        raise SmartPyError("SmartPy CLI not found, run install.sh or set SMARTPY_CLI")
+    return path
+
+
+_version = None
+
+
+def version():
+    """Return the version printed by ``SmartPy.sh --version``."""
+    global _version
+    if _version is None:
+        proc = subprocess.run([find_cli(), "--version"], capture_output=True, text=True)
+        _version = (proc.stdout or proc.stderr).strip()
+    return _version
+
+
+def run(command, source, output_dir, *flags, cwd=ROOT):
+    """Run ``SmartPy.sh <command> <source> <output_dir> [flags]`` from the
+    repository root, scripts import each other with root-relative paths.
+    ``cwd`` is another tree laid out as the repository."""
+    proc = subprocess.run(
+        [find_cli(), command, source, os.path.join(ROOT, output_dir), *flags],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise SmartPyError(
+            "SmartPy.sh %s %s failed:\n%s%s" % (command, source, proc.stdout, proc.stderr)
+        )
+    return proc.stdout
+
+
+def compile(source, output_dir, *flags):
+    return run("compile", source, output_dir, *flags)
+
+
+def test(source, output_dir, *flags):
+    return run("test", source, output_dir, *flags)
+
+
+def contract_size(output_dir, target):
+    """Size in bytes of the compiled contract, as SmartPy reports it in
+    sizes.csv, or of its Michelson text."""
+    prefix = os.path.join(output_dir, target, "step_000_cont_0_")
+    if os.path.exists(prefix + "sizes.csv"):
+        with open(prefix + "sizes.csv") as f:
+            for line in f:
+                name, _, size = line.strip().partition(",")
+                if name == "contract":
+                    return int(size)
+    return os.path.getsize(prefix + "contract.tz")
+
+
+def compiled(output_dir, target):
+    """Return the paths of the Michelson code and initial storage written by
+    ``compile`` for ``sp.add_compilation_target(target, ...)``."""
+    prefix = os.path.join(output_dir, target, "step_000_cont_0_")
+    return prefix + "contract.tz", prefix + "storage.tz"
+
+
+def metadata(output_dir, target):
+    """Return the paths of the metadata JSON written for the
+    ``self.init_metadata`` calls of the target."""
+    return sorted(glob.glob(os.path.join(output_dir, target, "step_000_cont_0_metadata.*.json")))
@@ -0,0 +1,341 @@
+"""Snapshot contracts of an octez mockup and originate them again later.
+
+A ``Recorder`` wraps a ``Mockup`` and follows the big_map updates printed in
+every receipt, so that it knows the content of every big_map it has seen
+created. ``snapshot`` then writes the code and storage of the contracts, the
+big_maps inlined as literal maps, the balances and the keys of the generated
+accounts to a gzipped JSON file. ``restore`` originates them in another
+mockup, addresses remapped, so that a large state is set up once instead of
+replaying its calls on every run.
+
+    recorder = Recorder(mockup)
+    market, _ = recorder.originate("market", code, storage)
+    ... recorder.call(market, ...) ...
+    snapshot(recorder, "market.snapshot.gz", ["market"], accounts=["trader_0"])
+
+    addresses, meta = restore(Recorder(other_mockup), "market.snapshot.gz")
+"""
+
+import gzip
+import json
+import os
+import re
+import tempfile
+
+from tools import octez
+
+NEW = re.compile(r"New map\((\d+)\)")
+SET = re.compile(r"Set map\((\d+)\)\[(.*?)\] to (.*)$")
+UNSET = re.compile(r"Unset map\((\d+)\)\[(.*)\]$")
+CLEAR = re.compile(r"Clear map\((\d+)\)")
+COPY = re.compile(r"Copy map\((\d+)\) to map\((\d+)\)")
+DIFF = re.compile(r"^(New|Set|Unset|Clear|Copy) map\(")
+
+
+def big_map_updates(output):
+    """Yield the lines of the ``Updated big_maps`` sections of a receipt,
+    the values printed over several lines joined."""
+    lines = output.splitlines()
+    i = 0
+    while i < len(lines):
+        if lines[i].strip() != "Updated big_maps:":
+            i += 1
+            continue
+        indent = len(lines[i + 1]) - len(lines[i + 1].lstrip()) if i + 1 < len(lines) else 0
+        i += 1
+        current = None
+        while i < len(lines) and len(lines[i]) - len(lines[i].lstrip()) >= indent and lines[i].strip():
+            line = lines[i].strip()
+            if DIFF.match(line) and len(lines[i]) - len(lines[i].lstrip()) == indent:
+                if current is not None:
+                    yield current
+                current = line
+            else:
+                current += " " + line
+            i += 1
+        if current is not None:
+            yield current
+
+
+class Recorder:
+    def __init__(self, mockup):
+        self.mockup = mockup
+        # big_map id -> {key: value}, in Michelson
+        self.big_maps = {}
+        # alias -> address of the contracts originated through the recorder
+        self.contracts = {}
+
+    def __getattr__(self, name):
+        # the recorder stands for its mockup, restore() included
+        return getattr(self.mockup, name)
+
+    def apply(self, output):
+        for line in big_map_updates(output):
+            if NEW.match(line):
+                self.big_maps[int(NEW.match(line).group(1))] = {}
+            elif SET.match(line):
+                big_map, key, value = SET.match(line).groups()
+                self.big_maps.setdefault(int(big_map), {})[key] = value
+            elif UNSET.match(line):
+                big_map, key = UNSET.match(line).groups()
+                self.big_maps.get(int(big_map), {}).pop(key, None)
+            elif CLEAR.match(line):
+                self.big_maps[int(CLEAR.match(line).group(1))] = {}
+            elif COPY.match(line):
+                source, target = map(int, COPY.match(line).groups())
+                self.big_maps[target] = dict(self.big_maps.get(source, {}))
+
+    def originate(self, alias, code_path, storage, balance=0, source="bootstrap1"):
+        address, receipt = self.mockup.originate(alias, code_path, storage, balance, source)
+        self.apply(receipt.output)
+        self.contracts[alias] = address
+        return address, receipt
+
+    def call(self, contract, entrypoint, arg="Unit", amount=0, source="bootstrap2"):
+        receipt = self.mockup.call(contract, entrypoint, arg, amount, source)
+        self.apply(receipt.output)
+        return receipt
+
+
+# Michelson literals, to sort the keys of the inlined big_maps
+
+TOKEN = re.compile(r'\s+|"(?:[^"\\]|\\.)*"|0x[0-9a-fA-F]*|-?\d+|[A-Za-z_][A-Za-z0-9_]*|[(){};]|[%@:][\w.%@]*')
+
+
+def parse(text):
+    """Parse the Michelson data ``text`` to Micheline JSON."""
+    tokens = [t for t in TOKEN.findall(text) if t.strip() and t[0] not in "%@:"]
+    position = 0
+
+    def atom():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+        if token == "(":
+            node = expression()
+            position += 1
+            return node
+        if token == "{":
+            items = []
+            while tokens[position] != "}":
+                if tokens[position] == ";":
+                    position += 1
+                    continue
+                items.append(expression())
+            position += 1
+            return items
+        if token.startswith('"'):
+            return {"string": json.loads(token)}
+        if token.startswith("0x"):
+            return {"bytes": token[2:]}
+        if token[0] in "-0123456789":
+            return {"int": token}
+        return {"prim": token}
+
+    def expression():
+        nonlocal position
+        node = atom()
+        if isinstance(node, dict) and "prim" in node and "args" not in node:
+            args = []
+            while position < len(tokens) and tokens[position] not in ");}":
+                args.append(atom())
+            if args:
+                node["args"] = args
+        return node
+
+    return expression()
+
+
+B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+# base58 prefix -> binary tag of the address, implicit ones before originated
+ADDRESS_TAGS = {"tz1": b"\0\0", "tz2": b"\0\1", "tz3": b"\0\2", "tz4": b"\0\3", "KT1": b"\1", "sr1": b"\3"}
+
+
+def address_bytes(text):
+    n = 0
+    for c in text:
+        n = n * 58 + B58.index(c)
+    raw = n.to_bytes(27, "big")
+    # 3 bytes of prefix, 20 of hash, 4 of checksum
+    return ADDRESS_TAGS[text[:3]] + raw[3:23]
+
+
+def comb(args):
+    return args if len(args) <= 2 else [args[0], {"prim": "pair", "args": args[1:]}]
+
+
+def sort_key(type_, value):
+    """A Python value ordered as Michelson compares ``value`` of ``type_``."""
+    prim = type_["prim"]
+    if prim in ("int", "nat", "mutez"):
+        return int(value["int"])
+    if prim == "timestamp" and "int" in value:
+        return int(value["int"])
+    if prim in ("string", "timestamp"):
+        return value["string"]
+    if prim in ("bytes", "chain_id", "signature", "key"):
+        return bytes.fromhex(value["bytes"]) if "bytes" in value else value["string"]
+    if prim in ("address", "key_hash", "contract"):
+        if "bytes" in value:
+            return bytes.fromhex(value["bytes"])
+        return address_bytes(value["string"].split("%")[0])
+    if prim == "bool":
+        return value["prim"] == "True"
+    if prim == "unit":
+        return 0
+    if prim == "pair":
+        types = comb(type_["args"])
+        values = comb(value["args"] if isinstance(value, dict) else value)
+        return tuple(sort_key(t, v) for t, v in zip(types, values))
+    if prim == "option":
+        return (0,) if value["prim"] == "None" else (1, sort_key(type_["args"][0], value["args"][0]))
+    if prim == "or":
+        side = 0 if value["prim"] == "Left" else 1
+        return (side, sort_key(type_["args"][side], value["args"][0]))
+    raise ValueError("%s keys are not supported" % prim)
+
+
+# Micheline JSON to Michelson
+
+def render(node, wrap=False):
+    """Michelson of ``node``, an application in parentheses when ``wrap``,
+    as the argument of another one."""
+    if isinstance(node, list):
+        return "{ %s }" % " ; ".join(render(n) for n in node) if node else "{}"
+    if "int" in node:
+        return node["int"]
+    if "string" in node:
+        return json.dumps(node["string"])
+    if "bytes" in node:
+        return "0x" + node["bytes"]
+    if not node.get("args"):
+        return node["prim"]
+    text = " ".join([node["prim"]] + [render(a, True) for a in node["args"]])
+    return "(%s)" % text if wrap else text
+
+
+def typed(value, type_, leaf):
+    """Rebuild ``value`` of ``type_``, the elements of maps and sets sorted
+    as Michelson requires, and ``leaf(value, type_)`` applied to the
+    big_maps and the values of the other types."""
+    prim = type_["prim"]
+    args = type_.get("args", [])
+    if prim == "big_map":
+        value = leaf(value, type_)
+    if prim in ("map", "big_map"):
+        return sorted(
+            ({"prim": "Elt", "args": [typed(e["args"][0], args[0], leaf), typed(e["args"][1], args[1], leaf)]}
+             for e in value),
+            key=lambda e: sort_key(args[0], e["args"][0]),
+        )
+    if prim == "set":
+        return sorted((typed(v, args[0], leaf) for v in value), key=lambda v: sort_key(args[0], v))
+    if prim == "list":
+        return [typed(v, args[0], leaf) for v in value]
+    if prim == "pair":
+        types = comb(args)
+        values = comb(value["args"] if isinstance(value, dict) else value)
+        return {"prim": "Pair", "args": [typed(v, t, leaf) for t, v in zip(types, values)]}
+    if prim == "option" and value["prim"] == "Some":
+        return {"prim": "Some", "args": [typed(value["args"][0], args[0], leaf)]}
+    if prim == "or":
+        side = 0 if value["prim"] == "Left" else 1
+        return {"prim": value["prim"], "args": [typed(value["args"][0], args[side], leaf)]}
+    return leaf(value, type_)
+
+
+def inline_big_maps(big_maps):
+    """A ``typed`` leaf replacing the big_map ids by their content."""
+    def leaf(value, type_):
+        if type_["prim"] != "big_map":
+            return value
+        big_map = int(value["int"])
+        if big_map not in big_maps:
+            raise octez.OctezError("big_map %d was not created through the recorder" % big_map)
+        return [{"prim": "Elt", "args": [parse(k), parse(v)]} for k, v in big_maps[big_map].items()]
+    return leaf
+
+
+def rename(addresses):
+    """A ``typed`` leaf replacing the ``addresses`` mapped to new ones."""
+    def leaf(value, type_):
+        if type_["prim"] in ("address", "contract") and "string" in value:
+            address, sep, entrypoint = value["string"].partition("%")
+            if address in addresses:
+                return {"string": addresses[address] + sep + entrypoint}
+        return value
+    return leaf
+
+
+# snapshot files
+
+def mutez(balance):
+    """Mutez of a balance printed by octez-client, such as ``12.5 ꜩ``."""
+    units, _, decimals = balance.split()[0].partition(".")
+    return int(units) * 1000000 + int((decimals + "000000")[:6])
+
+
+def contract_snapshot(recorder, alias):
+    mockup = recorder.mockup
+    address = recorder.contracts[alias]
+    path = "/chains/main/blocks/head/context/contracts/%s" % address
+    code = json.loads(mockup.run("rpc", "get", path + "/script"))["code"]
+    storage_type = next(s["args"][0] for s in code if s["prim"] == "storage")
+    storage = json.loads(mockup.run(
+        "rpc", "post", path + "/storage/normalized", "with", '{"unparsing_mode": "Readable"}'))
+    return {
+        "address": address,
+        "code": mockup.run("get", "contract", "code", "for", address),
+        "storage_type": storage_type,
+        "storage": typed(storage, storage_type, inline_big_maps(recorder.big_maps)),
+        "balance": mutez(mockup.run("get", "balance", "for", address)),
+    }
+
+
+def snapshot(recorder, path, contracts, accounts=(), meta=None):
+    """Write the ``contracts``, by alias, in origination order, the
+    ``accounts``, by alias, and the free-form ``meta`` to ``path``."""
+    mockup = recorder.mockup
+    data = {
+        "contracts": {alias: contract_snapshot(recorder, alias) for alias in contracts},
+        "accounts": {
+            alias: {
+                "address": re.search(r"Hash: (tz\w+)", mockup.run("show", "address", alias)).group(1),
+                "secret_key": re.search(r"Secret Key: (\S+)", mockup.run("show", "address", alias, "-S")).group(1),
+                "balance": mutez(mockup.run("get", "balance", "for", alias)),
+            }
+            for alias in accounts
+        },
+        "meta": meta or {},
+    }
+    with gzip.open(path, "wt") as f:
+        json.dump(data, f)
+
+
+def load(path):
+    with gzip.open(path, "rt") as f:
+        return json.load(f)
+
+
+def restore(mockup, path, source="bootstrap1"):
+    """Import the accounts and originate the contracts of the snapshot at
+    ``path`` in ``mockup``, a Recorder to snapshot them again. Return
+    {alias: new address} and the snapshot meta. Addresses of the snapshot
+    are replaced by the new ones in the storages."""
+    data = load(path)
+    addresses = {}
+    renamed = {}
+    for alias, account in data["accounts"].items():
+        mockup.run("import", "secret", "key", alias, account["secret_key"], "--force")
+        mockup.run("transfer", octez.tez(account["balance"]), "from", source, "to", alias, "--burn-cap", "1")
+        mockup.run("reveal", "key", "for", alias)
+        addresses[alias] = account["address"]
+    for alias, contract in data["contracts"].items():
+        storage = render(typed(contract["storage"], contract["storage_type"], rename(renamed)))
+        fd, code_path = tempfile.mkstemp(suffix=".tz", dir=mockup.base_dir)
+        with os.fdopen(fd, "w") as f:
+            f.write(contract["code"])
+        address, _ = mockup.originate(alias, code_path, storage, contract["balance"], source)
+        renamed[contract["address"]] = address
+        addresses[alias] = address
+    return addresses, data["meta"]
@@ -0,0 +1,92 @@
+"""Find the SmartPy scripts of the workshop and what they define."""
+
+import hashlib
+import os
+import re
+from dataclasses import dataclass
+
+from tools import ROOT
+
+PROJECTS = ["startup", "market"]
+
+IMPORT = re.compile(r'sp\.io\.import_script_from_url\(\s*"file:([^"]+)"')
+TARGET = re.compile(r'sp\.add_compilation_target\(\s*"([^"]+)"')
+TEST = re.compile(r'sp\.add_test\(\s*name\s*=\s*"([^"]+)"')
+
+
+@dataclass
+class Script:
+    # relative to the repository root, as SmartPy.sh is run from there
+    path: str
+    project: str
+    # target name -> source of the sp.add_compilation_target call
+    targets: dict
+    tests: list
+    imports: list
+
+    @property
+    def compilation_dir(self):
+        return os.path.join(self.project, "compilation")
+
+    @property
+    def test_dir(self):
+        return os.path.join(self.project, "test")
+
+
+def call_source(text, start):
+    """Return the call expression starting at ``start``, up to its closing
+    parenthesis."""
+    depth = 0
+    for i in range(text.index("(", start), len(text)):
+        if text[i] == "(":
+            depth += 1
+        elif text[i] == ")":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def load(path):
+    with open(os.path.join(ROOT, path)) as f:
+        text = f.read()
+    return Script(
+        path=path,
+        project=path.split("/")[0],
+        targets={m.group(1): call_source(text, m.start()) for m in TARGET.finditer(text)},
+        tests=TEST.findall(text),
+        imports=IMPORT.findall(text),
+    )
+
+
+def scripts(kinds=("contracts",)):
+    """Return the scripts of ``<project>/<kind>/`` for every project and kind,
+    in path order."""
+    found = []
+    for project in PROJECTS:
+        for kind in kinds:
+            directory = os.path.join(ROOT, project, kind)
+            if os.path.isdir(directory):
+                found += [
+                    load("%s/%s/%s" % (project, kind, name))
+                    for name in sorted(os.listdir(directory))
+                    if name.endswith(".py")
+                ]
+    return found
+
+
+def digest(path, *extra, _seen=None):
+    """Hash of the script, of every script it imports, recursively, and of
+    ``extra`` strings such as compiler flags."""
+    seen = _seen if _seen is not None else set()
+    seen.add(path)
+    h = hashlib.sha256()
+    with open(os.path.join(ROOT, path), "rb") as f:
+        text = f.read()
+    h.update(path.encode() + b"\0" + text)
+    for imported in IMPORT.findall(text.decode()):
+        if imported not in seen:
+            h.update(digest(imported, _seen=seen).encode())
+    for e in extra:
+        h.update(b"\0" + str(e).encode())
+    return h.hexdigest()
@@ -0,0 +1,80 @@
+"""Message extraction, rewriting and code assignment of tools.error_codes.
+
+    python3 -m unittest tools.test_error_codes
+"""
+
+import unittest
+
+from tools import error_codes
+
+SCRIPT = '''import smartpy as sp
+
+class C(sp.Contract):
+    @sp.entry_point
+    def f(self, x):
+        sp.verify(x > 0, "A")
+        sp.verify(x < 10)
+        sp.for y in sp.range(0, x):
+            sp.failwith("B")
+        self.data.m.get_opt(x).open_some(message = "C")
+        sp.verify(x != 5, message = "A")
+
+@sp.add_test(name = "t")
+def test():
+    scenario.verify(c.data.x == 1)
+'''
+
+
+def script(*messages):
+    return "".join('sp.failwith("%s")\n' % message for message in messages)
+
+
+class MessagesTest(unittest.TestCase):
+
+    def test_messages(self):
+        found = [message for _, _, message in error_codes.messages(SCRIPT)]
+        self.assertEqual(sorted(found), ["A", "A", "B", "C", "WrongCondition: x < 10"])
+
+    def test_offsets_are_utf8(self):
+        text = '# é\nsp.failwith("D")\n'
+        (start, end, message), = error_codes.messages(text)
+        self.assertEqual(text.encode()[start:end], b'"D"')
+
+    def test_transform(self):
+        codes = {"A": 1, "B": 2, "C": 3, "WrongCondition: x < 10": 4}
+        text = error_codes.transform(SCRIPT, codes)
+        self.assertIn('sp.verify(x > 0, 1)', text)
+        self.assertIn('sp.verify(x < 10, 4)', text)
+        self.assertIn('sp.failwith(2)', text)
+        self.assertIn('open_some(message = 3)', text)
+        self.assertIn('sp.verify(x != 5, message = 1)', text)
+        self.assertIn('scenario.verify(c.data.x == 1)', text)
+        self.assertEqual(list(error_codes.messages(text)), [])
+
+
+class AssignTest(unittest.TestCase):
+
+    def test_new_messages(self):
+        self.assertEqual(error_codes.assign([script("B", "A")]), {"A": 1, "B": 2})
+
+    def test_codes_are_kept(self):
+        codes = error_codes.assign([script("A", "C", "B")], {"B": 1, "A": 2})
+        self.assertEqual(codes, {"B": 1, "A": 2, "C": 3})
+
+    def test_retired_codes_are_not_reused(self):
+        codes = error_codes.assign([script("A")], {"A": 1, "B": 2})
+        self.assertEqual(codes, {"A": 1, "B": 2})
+        codes = error_codes.assign([script("A", "C")], codes)
+        self.assertEqual(codes["C"], 3)
+
+    def test_mapping_round_trip(self):
+        import os
+        import tempfile
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, error_codes.MAPPING)
+            error_codes.write_mapping(path, {"A": 1, "B": 2})
+            self.assertEqual(error_codes.read_mapping(path), {"A": 1, "B": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+"""Reorgs and skipped calls of tools.indexer, from a log and from a node.
+
+    python3 -m unittest tools.test_indexer
+"""
+
+import io
+import unittest
+from unittest import mock
+
+from tools import indexer
+
+OWNER = "tz1KqTpEZ7Yob7QbPE4Hy4Wo8fHG8LhKxZSx"
+SELLER = "tz1gjaF81ZRRvdzjobyfVNsAeSC6PScjfQwN"
+BUYER = "tz1faswCTDciRzE4oJ9jn2Vm2dvjeyA9fUzU"
+FA2 = "KT1C58ssiuw2Y92kK5VwXhE9k69P9aqhtP1Q"
+MARKET = "KT1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB"
+NODE = "http://node"
+
+# a Market storage type and value, the fields in a comb, the address optimized
+STORAGE_TYPE = {"prim": "pair", "args": [
+    {"prim": "nat", "annots": ["%item_id"]},
+    {"prim": "mutez", "annots": ["%list_fee"]},
+    {"prim": "pair", "args": [
+        {"prim": "address", "annots": ["%owner_address"]},
+        {"prim": "big_map", "args": [{"prim": "address"}, {"prim": "mutez"}], "annots": ["%balances"]},
+    ]},
+]}
+STORAGE = {"prim": "Pair", "args": [
+    {"int": "3"}, {"int": "500000"},
+    [{"bytes": "000002298c03ed7d454a101eb7022bc95f7e5f41ac78"}, {"int": "17"}],
+]}
+
+
+def listing(token_id, price=2000000):
+    return {"entrypoint": "crerate_market_item", "sender": SELLER, "amount": 1000000,
+            "parameters": {"prim": "Pair", "args": [
+                {"string": FA2}, {"prim": "Pair", "args": [{"int": str(token_id)}, {"int": str(price)}]}]}}
+
+
+def sale(item_id, price=2000000):
+    return {"entrypoint": "create_market_sale", "sender": BUYER, "amount": price,
+            "parameters": {"prim": "Pair", "args": [{"string": FA2}, {"int": str(item_id)}]}}
+
+
+def chain(*blocks):
+    """Blocks from level 1, each a (hash, operations) pair."""
+    result = []
+    for level, (hash_, operations) in enumerate(blocks, 1):
+        result.append({"level": level, "hash": hash_,
+                       "predecessor": result[-1]["hash"] if result else "genesis",
+                       "operations": operations})
+    return result
+
+
+class FakeNode:
+    """Serves the headers and Market calls of ``blocks`` as the node RPC
+    does."""
+
+    def __init__(self, blocks):
+        self.blocks = {block["level"]: block for block in blocks}
+
+    def rpc(self, node, path):
+        if path.endswith("/script"):
+            return {"code": [{"prim": "parameter", "args": [{"prim": "unit"}]},
+                             {"prim": "storage", "args": [STORAGE_TYPE]},
+                             {"prim": "code", "args": [[]]}]}
+        if path.endswith("/storage"):
+            return STORAGE
+        level = path.split("/")[4]
+        block = self.blocks[max(self.blocks) if level == "head" else int(level)]
+        if path.endswith("/header"):
+            return {"level": block["level"], "hash": block["hash"], "predecessor": block["predecessor"]}
+        return [{"contents": [{
+            "kind": "transaction", "source": op["sender"], "destination": MARKET, "amount": str(op["amount"]),
+            "parameters": {"entrypoint": op["entrypoint"], "value": op["parameters"]},
+            "metadata": {"operation_result": {"status": "applied"}},
+        }]} for op in block["operations"]]
+
+
+class ReorgTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = indexer.Index(":memory:", OWNER, 1000000)
+
+    def state(self):
+        return ([(item["id"], item["token_id"], item["state"]) for item in self.index.items("1", [])],
+                dict(self.index.db.execute("SELECT address, amount FROM balances").fetchall()))
+
+    def test_same_level_replacement(self):
+        blocks = chain(("B1", [listing(1)]), ("B2", [listing(2), sale(1)]))
+        indexer.sync(self.index, blocks)
+        replacement = dict(blocks[1], hash="B2'", operations=[listing(3)])
+        self.assertTrue(self.index.apply(replacement))
+        self.assertEqual(self.state(), ([(1, 1, "created"), (2, 3, "created")], {}))
+        self.assertEqual(self.index.block_hash(2), "B2'")
+        self.assertEqual(self.index.get_meta("item_id"), 3)
+
+    def test_rollback_restores_the_rows(self):
+        blocks = chain(("B1", [listing(1)]), ("B2", [sale(1)]), ("B3", [listing(2)]))
+        indexer.sync(self.index, blocks[:1])
+        before = self.state()
+        indexer.sync(self.index, blocks[1:])
+        self.index.rollback(1)
+        self.assertEqual(self.state(), before)
+        self.assertEqual(self.index.head()["hash"], "B1")
+        self.assertEqual(self.index.get_meta("item_id"), 2)
+
+    def test_no_credit_for_nothing(self):
+        indexer.sync(self.index, chain(("B1", [listing(1, 1000000)]), ("B2", [sale(1, 1000000)])))
+        self.assertEqual(self.state()[1], {OWNER: 1000000})
+
+    def test_unknown_predecessor(self):
+        indexer.sync(self.index, chain(("B1", []), ("B2", [])))
+        with self.assertRaises(indexer.ReorgError):
+            self.index.apply({"level": 3, "hash": "B3", "predecessor": "X2", "operations": []})
+
+    def test_node_fork(self):
+        indexed = chain(("B1", [listing(1)]), ("B2", [sale(1)]), ("B3", [listing(2)]))
+        indexer.sync(self.index, indexed)
+        # the node switched to a branch from B1, as long as the index
+        node = FakeNode(chain(("B1", [listing(1)]), ("C2", [listing(3)]), ("C3", [])))
+        with mock.patch.object(indexer, "rpc", node.rpc):
+            start = indexer.node_start(self.index, NODE, 1)
+            self.assertEqual(start, 2)
+            self.assertEqual(self.index.head()["hash"], "B1")
+            self.assertEqual(indexer.sync(self.index, indexer.node_blocks(NODE, MARKET, start)), 2)
+        self.assertEqual(self.state(), ([(1, 1, "created"), (2, 3, "created")], {}))
+        self.assertEqual(self.index.block_hash(3), "C3")
+
+    def test_node_behind_the_index(self):
+        indexer.sync(self.index, chain(("B1", []), ("B2", []), ("B3", [listing(1)])))
+        node = FakeNode(chain(("B1", []), ("B2", [])))
+        with mock.patch.object(indexer, "rpc", node.rpc):
+            self.assertEqual(indexer.node_start(self.index, NODE, 1), 3)
+        self.assertEqual(self.index.head()["hash"], "B2")
+        self.assertEqual(self.state(), ([], {}))
+
+    def test_node_up_to_date(self):
+        blocks = chain(("B1", []), ("B2", []))
+        indexer.sync(self.index, blocks)
+        with mock.patch.object(indexer, "rpc", FakeNode(blocks).rpc):
+            self.assertEqual(indexer.node_start(self.index, NODE, 1), 3)
+        self.assertEqual(self.index.head()["hash"], "B2")
+
+    def test_fork_below_the_indexed_blocks(self):
+        indexer.sync(self.index, chain(("B1", []), ("B2", [])))
+        node = FakeNode(chain(("C1", []), ("C2", [])))
+        with mock.patch.object(indexer, "rpc", node.rpc):
+            with self.assertRaises(indexer.ReorgError):
+                indexer.node_start(self.index, NODE, 1)
+
+
+class CallsTest(unittest.TestCase):
+
+    def test_unknown_entry_points_are_skipped(self):
+        index = indexer.Index(":memory:", OWNER, 1000000)
+        update = {"entrypoint": "update_entry_point", "sender": OWNER, "amount": 0,
+                  "parameters": {"prim": "Pair", "args": [{"int": "0"}, []]}}
+        default = {"entrypoint": "default", "sender": BUYER, "amount": 5, "parameters": {"prim": "Unit"}}
+        with mock.patch("sys.stderr", io.StringIO()) as stderr:
+            self.assertEqual(indexer.sync(index, chain(("B1", [listing(1), update, default, sale(1)]))), 1)
+        self.assertIn("skipped a call to update_entry_point", stderr.getvalue())
+        self.assertEqual([item["state"] for item in index.items("1", [])], ["release"])
+        self.assertEqual(index.head()["hash"], "B1")
+
+    def test_node_settings(self):
+        with mock.patch.object(indexer, "rpc", FakeNode(chain(("B1", []))).rpc):
+            self.assertEqual(indexer.node_settings(NODE, MARKET), (OWNER, 500000))
+
+
+if __name__ == "__main__":
+    unittest.main()
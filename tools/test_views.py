@@ -0,0 +1,110 @@
+"""Cache invalidation of tools.views as the node's head moves.
+
+    python3 -m unittest tools.test_views
+"""
+
+import unittest
+from unittest import mock
+
+from tools import views
+
+MARKET = "KT1TZBoXYVy26eaBFbTXvbQXVtZc9SdNgedB"
+OTHER = "KT1C58ssiuw2Y92kK5VwXhE9k69P9aqhtP1Q"
+
+
+def chain(*blocks):
+    """Blocks from level 1, each a (hash, contracts reached) pair."""
+    result = []
+    for level, (hash_, reached) in enumerate(blocks, 1):
+        result.append({"level": level, "hash": hash_,
+                       "predecessor": result[-1]["hash"] if result else "genesis",
+                       "reached": reached})
+    return result
+
+
+class FakeNode:
+    """Serves the headers and transactions of ``blocks`` and counts the view
+    runs, whose result is the count."""
+
+    def __init__(self, blocks):
+        self.switch(blocks)
+        self.runs = 0
+
+    def switch(self, blocks):
+        self.blocks = {block["level"]: block for block in blocks}
+        self.by_hash = {block["hash"]: block for block in blocks}
+
+    def rpc(self, path, body=None):
+        block = path.split("/")[4]
+        if path.endswith("/run_script_view"):
+            self.runs += 1
+            return {"data": {"int": str(self.runs)}}
+        if path.endswith("/header"):
+            block = self.blocks[max(self.blocks) if block == "head" else int(block)]
+            return {"chain_id": "NetXdQprcVkpaWU", "level": block["level"], "hash": block["hash"],
+                    "predecessor": block["predecessor"]}
+        return [{"contents": [{
+            "kind": "transaction", "destination": contract,
+            "metadata": {"operation_result": {"status": "applied"}},
+        }]} for contract in self.by_hash[block]["reached"]]
+
+
+class FollowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.node = FakeNode(chain(("B1", []), ("B2", [])))
+        self.client = views.ViewClient("http://node")
+        patcher = mock.patch.object(self.client, "rpc", self.node.rpc)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def evaluate(self):
+        return self.client.evaluate(MARKET, "get_list_fee")
+
+    def test_same_head_hits(self):
+        first = self.evaluate()
+        self.assertEqual(self.evaluate(), first)
+        self.assertEqual(self.node.runs, 1)
+
+    def test_other_contracts_keep_the_cache(self):
+        first = self.evaluate()
+        self.node.switch(chain(("B1", []), ("B2", []), ("B3", [OTHER]), ("B4", [])))
+        self.assertEqual(self.evaluate(), first)
+        self.assertEqual(self.client.fingerprint(OTHER), "B3")
+
+    def test_reached_contract_misses(self):
+        self.evaluate()
+        self.node.switch(chain(("B1", []), ("B2", []), ("B3", [MARKET]), ("B4", [])))
+        self.evaluate()
+        self.assertEqual(self.node.runs, 2)
+        self.assertEqual(self.client.fingerprint(MARKET), "B3")
+
+    def test_fork_at_the_same_level(self):
+        self.evaluate()
+        self.node.switch(chain(("B1", []), ("C2", [])))
+        self.evaluate()
+        self.assertEqual(self.node.runs, 2)
+        self.assertEqual(self.client.head_hash, "C2")
+
+    def test_fork_below_the_head(self):
+        self.evaluate()
+        # C2 dropped B2, which could have reached MARKET, though C2 and C3 do not
+        self.node.switch(chain(("B1", []), ("C2", []), ("C3", [])))
+        self.evaluate()
+        self.assertEqual(self.node.runs, 2)
+
+    def test_head_going_back(self):
+        self.evaluate()
+        self.node.switch(chain(("B1", [])))
+        self.evaluate()
+        self.assertEqual(self.node.runs, 2)
+
+    def test_gap(self):
+        self.evaluate()
+        self.node.switch(chain(*[("B%d" % level, []) for level in range(1, views.MAX_FOLLOW + 4)]))
+        self.evaluate()
+        self.assertEqual(self.node.runs, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+"""Evaluate contract views on a node, with a result cache.
+
+On-chain views (``sp.onchain_view``, e.g. ``MultisigLambda.get_lambda``) run
+through the node's ``run_script_view``; off-chain views (``sp.offchain_view``,
+e.g. ``Market.fetch_active_items``) run their TZIP-16 Michelson code through
+``run_code`` against the contract's current storage.
+
+A result is cached under (contract, view, argument, storage fingerprint). The
+fingerprint is the hash of the last block in which an applied transaction
+reached the contract, which is the only way its storage, big_maps included, or
+balance change; the client follows the new blocks once per evaluation batch to
+update it, and evaluates the views at the head it followed. A new block whose
+predecessor is not the block followed before it is a reorg, the blocks the
+fingerprints come from may be gone, so the cache is dropped. Entries also
+expire after a TTL and the least recently used are evicted past a maximum
+count. Identical requests of a batch are evaluated once and the
+misses run concurrently.
+
+    python3 -m tools.views --node http://localhost:8732 KT1... get_lambda:0
+    python3 -m tools.views --node http://localhost:8732 --metadata views.json \\
+        KT1... fetch_active_items get_list_fee --watch 5
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# past this many new blocks the cache is dropped rather than followed
+MAX_FOLLOW = 100
+
+
+class ViewError(Exception):
+    pass
+
+
+class ResultCache:
+    def __init__(self, max_entries=1024, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def load_views(path):
+    """Return the michelsonStorageView implementations, by view name, of a
+    TZIP-16 metadata JSON, as SmartPy writes it for the offchain views listed
+    in ``init_metadata``."""
+    with open(path) as f:
+        metadata = json.load(f)
+    views = {}
+    for view in metadata.get("views", []):
+        for implementation in view["implementations"]:
+            if "michelsonStorageView" in implementation:
+                views[view["name"]] = implementation["michelsonStorageView"]
+    return views
+
+
+def key_of(contract, view, arg):
+    return contract, view, json.dumps(arg, sort_keys=True)
+
+
+class ViewClient:
+    def __init__(self, node, offchain_views=None, cache=None, workers=8):
+        self.node = node.rstrip("/")
+        self.offchain_views = offchain_views or {}
+        self.cache = cache or ResultCache()
+        self.workers = workers
+        self.head = None
+        self.head_hash = None
+        self.touched = {}
+        self.chain_id = None
+        self.scripts = {}
+
+    def rpc(self, path, body=None):
+        request = urllib.request.Request(
+            self.node + path,
+            data=None if body is None else json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.load(response)
+        except urllib.error.HTTPError as e:
+            raise ViewError("%s: %s" % (path, e.read().decode()))
+
+    # storage fingerprints
+
+    def follow(self):
+        """Record the contracts reached by the blocks baked since the last
+        call, or drop the cache if they do not extend the followed head."""
+        header = self.rpc("/chains/main/blocks/head/header")
+        self.chain_id = header["chain_id"]
+        level = header["level"]
+        if level == self.head and header["hash"] == self.head_hash:
+            return
+        touched = self.extension(header)
+        if touched is None:
+            # a reorg, or nothing known about the skipped blocks: start over
+            self.cache.clear()
+            self.touched.clear()
+        else:
+            self.touched.update(touched)
+        self.head = level
+        self.head_hash = header["hash"]
+
+    def extension(self, header):
+        """Return {contract: hash of the last block reaching it} for the
+        blocks from the followed head to ``header``, or None if they do not
+        chain onto it."""
+        level = header["level"]
+        if self.head is None or not self.head < level <= self.head + MAX_FOLLOW:
+            return None
+        touched = {}
+        predecessor = self.head_hash
+        for block in range(self.head + 1, level + 1):
+            current = header if block == level else self.rpc("/chains/main/blocks/%d/header" % block)
+            if current["predecessor"] != predecessor:
+                return None
+            predecessor = current["hash"]
+            for contract in self.reached(current["hash"]):
+                touched[contract] = current["hash"]
+        return touched
+
+    def reached(self, block):
+        for op in self.rpc("/chains/main/blocks/%s/operations/3" % block):
+            for content in op["contents"]:
+                metadata = content.get("metadata", {})
+                results = [(content, metadata.get("operation_result", {}))]
+                results += [(i, i.get("result", {})) for i in metadata.get("internal_operation_results", [])]
+                for operation, result in results:
+                    if operation.get("kind") == "transaction" and result.get("status") == "applied":
+                        yield operation["destination"]
+
+    def fingerprint(self, contract):
+        return self.touched.get(contract)
+
+    # evaluation
+
+    def storage_type(self, contract):
+        if contract not in self.scripts:
+            code = self.rpc("/chains/main/blocks/head/context/contracts/%s/script" % contract)["code"]
+            self.scripts[contract] = next(s["args"][0] for s in code if s["prim"] == "storage")
+        return self.scripts[contract]
+
+    def run_onchain(self, contract, view, arg):
+        return self.rpc("/chains/main/blocks/%s/helpers/scripts/run_script_view" % self.head_hash, {
+            "contract": contract,
+            "view": view,
+            "input": arg if arg is not None else {"prim": "Unit"},
+            "chain_id": self.chain_id,
+            "unlimited_gas": True,
+            "unparsing_mode": "Readable",
+        })["data"]
+
+    def run_offchain(self, contract, view, arg):
+        implementation = self.offchain_views[view]
+        storage = self.rpc("/chains/main/blocks/%s/context/contracts/%s/storage" % (self.head_hash, contract))
+        storage_type = self.storage_type(contract)
+        if "parameter" in implementation:
+            parameter = {"prim": "pair", "args": [implementation["parameter"], storage_type]}
+            value = {"prim": "Pair", "args": [arg, storage]}
+        else:
+            parameter, value = storage_type, storage
+        script = [
+            {"prim": "parameter", "args": [parameter]},
+            {"prim": "storage", "args": [{"prim": "option", "args": [implementation["returnType"]]}]},
+            {"prim": "code", "args": [[
+                {"prim": "CAR"}, implementation["code"], {"prim": "SOME"},
+                {"prim": "NIL", "args": [{"prim": "operation"}]}, {"prim": "PAIR"},
+            ]]},
+        ]
+        result = self.rpc("/chains/main/blocks/%s/helpers/scripts/run_code" % self.head_hash, {
+            "script": script,
+            "storage": {"prim": "None"},
+            "input": value,
+            "amount": "0",
+            "chain_id": self.chain_id,
+            "self": contract,
+            "unparsing_mode": "Readable",
+        })
+        return result["storage"]["args"][0]
+
+    def run(self, contract, view, arg):
+        if view in self.offchain_views:
+            return self.run_offchain(contract, view, arg)
+        return self.run_onchain(contract, view, arg)
+
+    def evaluate_many(self, requests):
+        """Evaluate the (contract, view, Micheline argument or None) requests,
+        return their results in the same order."""
+        self.follow()
+        keys = [key_of(*request) + (self.fingerprint(request[0]),) for request in requests]
+        results = {}
+        missing = {}
+        for key, request in zip(keys, requests):
+            if key in results or key in missing:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                missing[key] = request
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for key, result in zip(missing, pool.map(lambda r: self.run(*r), missing.values())):
+                self.cache.put(key, result)
+                results[key] = result
+        return [results[key] for key in keys]
+
+    def evaluate(self, contract, view, arg=None):
+        return self.evaluate_many([(contract, view, arg)])[0]
+
+
+def parse_request(text):
+    """``view`` or ``view:<Micheline JSON>``, an integer is a nat."""
+    view, _, arg = text.partition(":")
+    if not arg:
+        return view, None
+    return view, {"int": arg} if arg.isdigit() else json.loads(arg)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--node", default="http://localhost:8732")
+    parser.add_argument("--metadata", help="TZIP-16 metadata JSON with the offchain views")
+    parser.add_argument("--ttl", type=float, default=60)
+    parser.add_argument("--watch", type=float, help="evaluate again every this many seconds")
+    parser.add_argument("contract")
+    parser.add_argument("views", nargs="+", help="view or view:argument")
+    args = parser.parse_args(argv)
+
+    client = ViewClient(
+        args.node,
+        load_views(args.metadata) if args.metadata else None,
+        ResultCache(ttl=args.ttl),
+    )
+    requests = [(args.contract,) + parse_request(view) for view in args.views]
+    while True:
+        try:
+            results = client.evaluate_many(requests)
+        except ViewError as e:
+            sys.exit(str(e))
+        for (_, view, _), result in zip(requests, results):
+            print("%s: %s" % (view, json.dumps(result)))
+        if not args.watch:
+            break
+        print("level %d, %d hits, %d misses" % (client.head, client.cache.hits, client.cache.misses))
+        time.sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()